@@ -5,8 +5,24 @@ Word和Markdown文件向量化存储系统
 __version__ = "1.0.0"
 
 from .file_parsers.file_parser import FileParserFactory, WordParser, MarkdownParser
-from .clip.vectorizer import CLIPVectorizer
-from .milvus.milvus_store import MilvusStore
+
+# CLIPVectorizer（clip_client / grpc）和 MilvusStore（pymilvus）依赖较重，
+# 延迟到首次访问时再导入，只解析文件时无需加载它们
+_LAZY_IMPORTS = {
+    'CLIPVectorizer': '.clip.vectorizer',
+    'MilvusStore': '.milvus.milvus_store',
+}
+
+
+def __getattr__(name):
+    module_name = _LAZY_IMPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
 
 __all__ = [
     'FileParserFactory',
@@ -15,4 +31,3 @@ __all__ = [
     'CLIPVectorizer',
     'MilvusStore',
 ]
-
@@ -1,4 +1,4 @@
-from .vectorizer import CLIPVectorizer
-
-__all__ = ['CLIPVectorizer']
+from .vectorizer import CLIPVectorizer, get_default_vectorizer
+from .cache import EmbeddingCache, PersistentEmbeddingCache, normalize_text
 
+__all__ = ['CLIPVectorizer', 'get_default_vectorizer', 'EmbeddingCache', 'PersistentEmbeddingCache', 'normalize_text']
@@ -0,0 +1,155 @@
+"""
+向量缓存：缓存已编码的文本/图像向量，避免重复请求CLIP服务器
+"""
+import re
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Hashable, List, Optional
+import numpy as np
+
+
+_WHITESPACE_RE = re.compile(r'\s+')
+# 首尾的标点不影响语义，近似查询（如 "一只猫" / "一只猫。"）复用同一条缓存
+_EDGE_PUNCT = ' \t\r\n.,!?;:\'"`~()[]{}<>。，！？；：、“”‘’（）【】《》…'
+
+
+def normalize_text(text: str) -> str:
+    """
+    生成文本的近似缓存键：统一Unicode形式、大小写、空白和首尾标点
+    
+    OpenAI CLIP的分词器本身会做小写化和空白清洗，因此这些差异不会改变向量；
+    首尾标点的差异对向量的影响也很小，可以视为同一个查询。
+    其他模型（如多语言CLIP）的分词器可能区分大小写，因此向量化器默认不使用这个键。
+    """
+    normalized = unicodedata.normalize('NFKC', text).casefold()
+    normalized = _WHITESPACE_RE.sub(' ', normalized).strip(_EDGE_PUNCT)
+    # 全是标点的文本保留原样，避免不同内容映射到同一个空键
+    return normalized or text
+
+
+class EmbeddingCache:
+    """线程安全的LRU向量缓存"""
+
+    def __init__(self, maxsize: int = 10_000, dtype: str = "float32"):
+        """
+        初始化向量缓存
+
+        Args:
+            maxsize: 最大缓存条目数，<= 0 表示禁用缓存
+            dtype: 缓存中向量的存储精度，'float16' 可使同样内存容纳两倍条目
+        """
+        self.maxsize = maxsize
+        self.dtype = np.dtype(dtype)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        """获取缓存的向量，未命中返回None"""
+        if self.maxsize <= 0:
+            return None
+        with self._lock:
+            vector = self._data.get(key)
+            if vector is not None:
+                self._data.move_to_end(key)
+            return vector
+
+    def put(self, key: Hashable, vector: np.ndarray):
+        """写入向量，超出容量时淘汰最久未使用的条目"""
+        if self.maxsize <= 0:
+            return
+        vector = np.ascontiguousarray(vector, dtype=self.dtype)
+        with self._lock:
+            self._data[key] = vector
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+
+class PersistentEmbeddingCache:
+    """基于sqlite的持久化向量缓存，进程重启后仍可复用已编码的向量"""
+
+    # sqlite单条语句的参数个数上限为999，批量查询时按此分批
+    _MAX_PARAMS = 900
+
+    def __init__(self, path: str, dtype: str = "float16", namespace: str = ""):
+        """
+        初始化持久化缓存
+
+        Args:
+            path: sqlite数据库文件路径
+            dtype: 向量在磁盘上的存储精度，默认float16以减半占用空间
+            namespace: 缓存键的命名空间（如CLIP服务器地址或模型名），不同命名空间的向量互不可见
+        """
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.namespace = namespace
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(hash BLOB PRIMARY KEY, dim INTEGER NOT NULL, vec BLOB NOT NULL)"
+            )
+
+    def _hash(self, key: Hashable, dim: int) -> bytes:
+        """将命名空间、向量维度和缓存键转换为固定长度的摘要"""
+        return hashlib.blake2b(repr((self.namespace, dim, key)).encode('utf-8'), digest_size=16).digest()
+
+    def get_many(self, keys: List[Hashable], dim: int) -> List[Optional[np.ndarray]]:
+        """批量查询维度为 dim 的向量，未命中或维度不符的位置为None"""
+        hashes = [self._hash(key, dim) for key in keys]
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), self._MAX_PARAMS):
+                batch = hashes[start:start + self._MAX_PARAMS]
+                placeholders = ','.join('?' * len(batch))
+                found.update(
+                    (h, vec) for h, row_dim, vec in self._conn.execute(
+                        f"SELECT hash, dim, vec FROM embeddings WHERE hash IN ({placeholders})", batch
+                    )
+                    if row_dim == dim
+                )
+        return [
+            np.frombuffer(found[h], dtype=self.dtype) if h in found else None
+            for h in hashes
+        ]
+
+    def put_many(self, keys: List[Hashable], vectors: np.ndarray):
+        """在一个事务中批量写入向量"""
+        vectors = np.ascontiguousarray(vectors, dtype=self.dtype)
+        rows = [
+            (self._hash(key, vec.shape[0]), vec.shape[0], vec.tobytes())
+            for key, vec in zip(keys, vectors)
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (hash, dim, vec) VALUES (?, ?, ?)", rows
+            )
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM embeddings")
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
@@ -2,61 +2,149 @@
 CLIP向量化服务：使用CLIP-as-service对文本和图像进行编码
 """
 import io
-from typing import List, Union, Dict
+import os
+import asyncio
+import functools
+import base64
+import hashlib
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Union, Dict, Hashable, Tuple, Optional, Sequence
 import numpy as np
 from clip_client import Client
+from PIL import Image
 from tqdm import tqdm
 
+from .cache import EmbeddingCache, PersistentEmbeddingCache, normalize_text
+
+
+# 常见图像格式的data URI前缀，避免每张图像都做字符串格式化
+_DATA_URI_PREFIXES = {
+    fmt: f"data:image/{fmt.lower()};base64,".encode('ascii')
+    for fmt in ('PNG', 'JPEG', 'JPG', 'GIF', 'BMP', 'WEBP', 'TIFF')
+}
+
+
+def _to_data_uri(binary: bytes, img_format: str = 'PNG') -> str:
+    """将图像二进制数据转换为base64 data URI"""
+    prefix = _DATA_URI_PREFIXES.get(img_format)
+    if prefix is None:
+        prefix = f"data:image/{img_format.lower()};base64,".encode('ascii')
+    # clip_client只接受str形式的URI，拼接完成后一次性解码
+    return (prefix + base64.b64encode(binary)).decode('ascii')
+
+
+def _pil_to_document(img: Image.Image, quality: int = 85):
+    """
+    将内存中的PIL图像编码为JPEG字节并包装为Document，
+    以二进制blob直接发送，省去base64编码
+    
+    Returns:
+        (Document, JPEG字节)
+    """
+    from docarray import Document
+    
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality)
+    binary = buffer.getvalue()
+    return Document(blob=binary, mime_type='image/jpeg'), binary
+
+
+def _chunked(items: List, size: int):
+    """按固定大小切分列表"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _l2_normalize(x: np.ndarray) -> np.ndarray:
+    """
+    原地对每一行做L2归一化（零向量保持不变）
+    
+    归一化后的向量之间的内积即为余弦相似度，可配合Milvus的IP度量使用
+    """
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    np.divide(x, norms, out=x, where=norms > 0)
+    return x
+
 
 class CLIPVectorizer:
     """使用CLIP-as-service进行向量化"""
     
-    def __init__(self, server_url: str = "grpc://0.0.0.0:51000"):
+    def __init__(self,
+                 server_url: str = "grpc://0.0.0.0:51000",
+                 cache_size: int = 10_000,
+                 semantic_cache: bool = False,
+                 pool_size: int = 4,
+                 dtype: str = "float32",
+                 embedding_dim: Optional[int] = None,
+                 batch_size: int = 64,
+                 cache_path: Optional[str] = None,
+                 cache_namespace: Optional[str] = None):
         """
         初始化CLIP向量化器
         
         Args:
             server_url: CLIP服务器地址，格式如 'grpc://0.0.0.0:51000'
+            cache_size: 向量LRU缓存的最大条目数（文本和图像共用），0表示禁用缓存
+            semantic_cache: 是否按归一化后的文本匹配缓存（忽略大小写、空白和首尾标点），
+                使近似重复的查询直接复用已有向量。默认关闭：开启后只相差大小写或首尾标点的文档块
+                也会共用一个向量，只适合只编码查询文本的向量化器
+            pool_size: 客户端连接池大小，并发调用时轮询使用不同的连接，避免单连接队头阻塞
+            dtype: 返回向量的精度，'float32' 或 'float16'。float16 可将内存、缓存和传输量减半，
+                归一化仍在float32下完成；存入Milvus时需使用 FLOAT16_VECTOR 字段
+            embedding_dim: 已知的向量维度（如512），提供后 get_embedding_dimension 无需请求服务器
+            batch_size: 每次请求发送的最大条目数，大列表会分批发送，限制客户端和服务器的峰值内存
+            cache_path: sqlite持久化缓存文件路径，提供后已编码的向量会跨进程复用，
+                重复导入相同内容时无需再请求服务器
+            cache_namespace: 持久化缓存的命名空间，默认为 server_url；同一地址上更换模型时应设为模型名，
+                避免读到旧模型的向量
         """
-        self.client = Client(server_url)
+        if dtype not in ('float32', 'float16'):
+            raise ValueError(f"Unsupported dtype: {dtype}, expected 'float32' or 'float16'")
+        self.dtype = np.dtype(dtype)
+        self._dim = embedding_dim
+        self._empty_result = None
+        self.batch_size = max(1, batch_size)
+        self.server_url = server_url
+        # 连接池：每个Client持有独立的连接，并发的encode_*调用轮询分配
+        self._pool = [Client(server_url) for _ in range(max(1, pool_size))]
+        self._pool_cycle = itertools.cycle(self._pool)
+        self._pool_lock = threading.Lock()
+        self.client = self._pool[0]
+        self.semantic_cache = semantic_cache
+        self._cache = EmbeddingCache(maxsize=cache_size, dtype=dtype)
+        self._store = (PersistentEmbeddingCache(cache_path, namespace=cache_namespace or server_url)
+                       if cache_path else None)
         print(f"✓ Connected to CLIP server: {server_url}")
     
-    def encode_texts(self, texts: List[str], show_progress: bool = True) -> np.ndarray:
+    def encode_texts(self,
+                     texts: List[str],
+                     show_progress: bool = True,
+                     normalize: bool = True) -> np.ndarray:
         """
         对文本列表进行向量化
         
         Args:
             texts: 文本列表
             show_progress: 是否显示进度条
+            normalize: 是否对向量做L2归一化
             
         Returns:
             向量数组，shape: (n_texts, embedding_dim)
         """
         if not texts:
-            return np.array([])
-        
-        # 使用clip_client进行编码
-        result = self.client.encode(
-            texts,
-            show_progress=show_progress
-        )
+            return self._empty()
         
-        # 转换为numpy数组
-        if hasattr(result, 'embeddings'):
-            return np.array(result.embeddings)
-        elif isinstance(result, np.ndarray):
-            return result
-        else:
-            # 如果是DocumentArray
-            embeddings = []
-            for doc in result:
-                if hasattr(doc, 'embedding'):
-                    embeddings.append(doc.embedding)
-                elif hasattr(doc, 'tensor'):
-                    embeddings.append(doc.tensor)
-            return np.array(embeddings)
-    
-    def encode_images(self, images: List[Union[str, bytes, Dict]], show_progress: bool = True) -> np.ndarray:
+        return self._encode_cached(texts, self._text_keys(texts), show_progress, normalize)
+    
+    def encode_images(self,
+                      images: List[Union[str, bytes, Dict, Image.Image]],
+                      show_progress: bool = True,
+                      normalize: bool = True) -> np.ndarray:
         """
         对图像列表进行向量化
         
@@ -65,76 +153,353 @@ class CLIPVectorizer:
                 - 图像路径字符串列表
                 - 图像二进制数据列表 (bytes)
                 - 包含 'binary' 或 'path' 键的字典列表
+                - PIL.Image.Image 对象列表（以JPEG字节直接发送，不经过base64）
+                - 解析器返回的 ImagesSoA（按列读取二进制数据和格式）
             show_progress: 是否显示进度条
+            normalize: 是否对向量做L2归一化
             
         Returns:
             向量数组，shape: (n_images, embedding_dim)
         """
         if not images:
-            return np.array([])
+            return self._empty()
+        
+        image_inputs, cache_keys = self._prepare_images(images)
+        return self._encode_cached(image_inputs, cache_keys, show_progress, normalize)
+    
+    def _empty(self) -> np.ndarray:
+        """空输入的返回值：shape为 (0, embedding_dim) 的只读数组，按维度缓存复用"""
+        dim = self._dim or 0
+        if self._empty_result is None or self._empty_result.shape[1] != dim:
+            empty = np.empty((0, dim), dtype=self.dtype)
+            empty.flags.writeable = False
+            self._empty_result = empty
+        return self._empty_result
+    
+    def _text_keys(self, texts: List[str]) -> List[Hashable]:
+        """计算文本的缓存键"""
+        if self.semantic_cache:
+            return [('text', normalize_text(t)) for t in texts]
+        return [('text', t) for t in texts]
+    
+    def _prepare_images(self, images: List[Union[str, bytes, Dict, Image.Image]]) -> Tuple[List, List[Hashable]]:
+        """
+        预处理图像输入，同时计算缓存键
+        
+        Returns:
+            (输入列表, 缓存键列表)，二进制图像以 (binary, format) 元组表示
+        """
+        # 列式存储的图像（file_parsers.ImagesSoA）直接按列读取，无需逐个字典取值
+        binaries = getattr(images, 'binaries', None)
+        if binaries is not None:
+            return list(zip(binaries, images.formats)), [self._binary_key(b) for b in binaries]
+        
+        # 常见的同构输入（全部是路径或全部是二进制）走直线路径，跳过逐项类型分派
+        if all(isinstance(img, str) for img in images):
+            return list(images), [self._path_key(img) for img in images]
+        if all(isinstance(img, (bytes, bytearray)) for img in images):
+            return [(img, 'PNG') for img in images], [self._binary_key(img) for img in images]
         
-        # 预处理图像输入
         image_inputs = []
+        cache_keys = []
         for img in images:
             if isinstance(img, dict):
                 # 如果是字典，优先使用binary，否则使用path
-                if 'binary' in img:
-                    # 转换为base64 data URI
-                    import base64
-                    img_format = img.get('format', 'PNG')
-                    img_data = base64.b64encode(img['binary']).decode()
-                    image_inputs.append(f"data:image/{img_format.lower()};base64,{img_data}")
+                binary = img.get('binary')
+                if binary is not None:
+                    # 发送前再按批转换为base64 data URI
+                    image_inputs.append((binary, img.get('format', 'PNG')))
+                    cache_keys.append(self._binary_key(binary))
                 elif 'path' in img:
                     image_inputs.append(img['path'])
+                    cache_keys.append(self._path_key(img['path']))
                 else:
                     raise ValueError("Dictionary must contain 'binary' or 'path' key")
-            elif isinstance(img, bytes):
-                # 二进制数据转换为base64
-                import base64
-                img_data = base64.b64encode(img).decode()
-                image_inputs.append(f"data:image/png;base64,{img_data}")
+            elif isinstance(img, (bytes, bytearray)):
+                # 二进制数据，发送前再按批转换为base64
+                image_inputs.append((img, 'PNG'))
+                cache_keys.append(self._binary_key(img))
+            elif isinstance(img, Image.Image):
+                doc, binary = _pil_to_document(img)
+                image_inputs.append(doc)
+                cache_keys.append(self._binary_key(binary))
             else:
                 # 字符串路径
                 image_inputs.append(img)
+                cache_keys.append(self._path_key(img))
         
-        # 使用clip_client进行编码
-        result = self.client.encode(
-            image_inputs,
-            show_progress=show_progress
-        )
+        return image_inputs, cache_keys
+    
+    def _encode_cached(self,
+                       inputs: List,
+                       keys: List[Hashable],
+                       show_progress: bool,
+                       normalize: bool = True) -> np.ndarray:
+        """
+        先查缓存，只把未命中的输入发送到CLIP服务器，再按原顺序拼回结果
+        
+        Args:
+            inputs: 文本、图像路径或 (binary, format) 元组列表
+            keys: 与inputs一一对应的缓存键
+            show_progress: 是否显示进度条
+            normalize: 是否对向量做L2归一化
+            
+        Returns:
+            向量数组，shape: (len(inputs), embedding_dim)
+        """
+        cached, misses, unique, inverse = self._lookup(keys)
+        
+        encoded = None
+        if misses:
+            # 重复的输入只发送一次
+            encoded = self._encode_batches(inputs, unique, show_progress)[inverse]
+        
+        return self._assemble(keys, cached, misses, encoded, normalize)
+    
+    def _encode_batches(self, inputs: List, indices: List[int], show_progress: bool) -> np.ndarray:
+        """
+        按 batch_size 分批编码 inputs 中指定位置的输入
         
-        # 转换为numpy数组
-        if hasattr(result, 'embeddings'):
-            return np.array(result.embeddings)
-        elif isinstance(result, np.ndarray):
-            return result
-        else:
-            # 如果是DocumentArray
-            embeddings = []
-            for doc in result:
-                if hasattr(doc, 'embedding'):
-                    embeddings.append(doc.embedding)
-                elif hasattr(doc, 'tensor'):
-                    embeddings.append(doc.tensor)
-            return np.array(embeddings)
-    
-    def encode_mixed(self, texts: List[str], images: List[Union[str, bytes, Dict]], 
-                     show_progress: bool = True) -> tuple:
-        """
-        同时对文本和图像进行向量化
+        base64转换也在每批发送前进行，峰值内存只与批大小有关；
+        下一批的转换在后台线程中进行，与当前批的RPC重叠
+        
+        Returns:
+            float32向量数组，shape: (len(indices), embedding_dim)
+        """
+        batches = list(_chunked(indices, self.batch_size))
+        out = None
+        offset = 0
+        with ThreadPoolExecutor(max_workers=1) as executor, \
+                tqdm(total=len(indices), unit='items', disable=not show_progress) as pbar:
+            pending = executor.submit(self._build_payload, inputs, batches[0])
+            for k, batch in enumerate(batches):
+                payload = pending.result()
+                if k + 1 < len(batches):
+                    pending = executor.submit(self._build_payload, inputs, batches[k + 1])
+                vectors = self._to_numpy(self._next_client().encode(payload, show_progress=False))
+                if out is None:
+                    out = np.empty((len(indices), vectors.shape[1]), dtype=np.float32)
+                out[offset:offset + len(batch)] = vectors
+                offset += len(batch)
+                pbar.update(len(batch))
+        return out
+    
+    @staticmethod
+    def _build_payload(inputs: List, batch: List[int]) -> List:
+        """生成一批发送给clip_client的输入，二进制图像转换为data URI"""
+        return [
+            _to_data_uri(*inputs[i]) if isinstance(inputs[i], tuple) else inputs[i]
+            for i in batch
+        ]
+    
+    async def aencode_texts(self, texts: List[str], normalize: bool = True) -> np.ndarray:
+        """
+        异步对文本列表进行向量化，未命中缓存的文本被拆分到连接池中的多个连接上并发编码
+        
+        Args:
+            texts: 文本列表
+            normalize: 是否对向量做L2归一化
+            
+        Returns:
+            向量数组，shape: (n_texts, embedding_dim)
+        """
+        if not texts:
+            return self._empty()
+        
+        keys = self._text_keys(texts)
+        cached, misses, unique, inverse = self._lookup(keys)
+        
+        encoded = None
+        if misses:
+            n_shards = min(len(self._pool), len(unique))
+            shard_size = -(-len(unique) // n_shards)
+            shards = [unique[k:k + shard_size] for k in range(0, len(unique), shard_size)]
+            results = await asyncio.gather(*[
+                self._next_client().aencode([texts[i] for i in shard])
+                for shard in shards
+            ])
+            encoded = np.concatenate([self._to_numpy(r) for r in results])[inverse]
+        
+        return self._assemble(keys, cached, misses, encoded, normalize)
+    
+    def _lookup(self, keys: List[Hashable]) -> Tuple[List, List[int], List[int], List[int]]:
+        """
+        查询缓存（先内存，再持久化缓存），并对未命中的输入按缓存键去重
+        
+        Returns:
+            (缓存查询结果, 未命中位置, 去重后需要编码的位置, 每个未命中位置对应的去重序号)
+        """
+        cached = [self._cache.get(key) for key in keys]
+        misses = [i for i, vec in enumerate(cached) if vec is None]
+        
+        if misses and self._store is not None:
+            # 只接受与当前模型维度一致的向量
+            stored = self._store.get_many([keys[i] for i in misses], dim=self.get_embedding_dimension())
+            for i, vec in zip(misses, stored):
+                if vec is not None:
+                    cached[i] = vec
+                    self._cache.put(keys[i], vec)
+            misses = [i for i in misses if cached[i] is None]
+        
+        unique, inverse, first_seen = [], [], {}
+        for i in misses:
+            j = first_seen.get(keys[i])
+            if j is None:
+                j = first_seen[keys[i]] = len(unique)
+                unique.append(i)
+            inverse.append(j)
+        
+        return cached, misses, unique, inverse
+    
+    def _assemble(self,
+                  keys: List[Hashable],
+                  cached: List[Optional[np.ndarray]],
+                  misses: List[int],
+                  encoded: Optional[np.ndarray],
+                  normalize: bool = True) -> np.ndarray:
+        """
+        将缓存命中的向量和新编码的向量按原顺序写入预分配的float32数组，并更新缓存，
+        最后转换为 self.dtype
+        
+        Args:
+            keys: 缓存键列表
+            cached: 缓存查询结果，未命中为None
+            misses: 未命中的位置
+            encoded: 未命中输入的编码结果，顺序与misses一致
+            normalize: 是否对结果做L2归一化（缓存中保存的是原始向量）
+            
+        Returns:
+            向量数组，shape: (len(keys), embedding_dim)
+        """
+        dim = encoded.shape[1] if encoded is not None else cached[0].shape[0]
+        if self._dim is None:
+            self._dim = dim
+        out = np.empty((len(keys), dim), dtype=np.float32)
+        
+        for i, vec in enumerate(cached):
+            if vec is not None:
+                out[i] = vec
+        
+        if encoded is not None:
+            out[misses] = encoded
+            for i in misses:
+                self._cache.put(keys[i], out[i].copy())
+            if self._store is not None:
+                self._store.put_many([keys[i] for i in misses], out[misses])
+        
+        if normalize:
+            _l2_normalize(out)
+        
+        return out.astype(self.dtype, copy=False)
+    
+    def _next_client(self) -> Client:
+        """轮询获取连接池中的下一个客户端"""
+        with self._pool_lock:
+            return next(self._pool_cycle)
+    
+    @staticmethod
+    def _to_numpy(result) -> np.ndarray:
+        """将clip_client的返回结果转换为float32的numpy数组（已是float32时不复制）"""
+        if isinstance(result, np.ndarray):
+            return np.asarray(result, dtype=np.float32)
+        
+        embeddings = getattr(result, 'embeddings', None)
+        if embeddings is not None:
+            return np.asarray(embeddings, dtype=np.float32)
+        
+        # 如果是DocumentArray，逐个读取向量写入预分配的数组
+        rows = []
+        for doc in result:
+            if hasattr(doc, 'embedding'):
+                rows.append(doc.embedding)
+            elif hasattr(doc, 'tensor'):
+                rows.append(doc.tensor)
+        if not rows:
+            return np.empty((0, 0), dtype=np.float32)
+        out = np.empty((len(rows), np.size(rows[0])), dtype=np.float32)
+        for i, row in enumerate(rows):
+            out[i] = np.ravel(row)
+        return out
+    
+    @staticmethod
+    def _binary_key(binary: bytes) -> tuple:
+        """图像二进制数据的缓存键"""
+        return ('blob', hashlib.blake2b(binary, digest_size=16).digest())
+    
+    @staticmethod
+    def _path_key(path: str) -> tuple:
+        """图像路径的缓存键（文件被修改后自动失效）"""
+        try:
+            return ('path', path, os.path.getmtime(path))
+        except OSError:
+            return ('path', path, None)
+    
+    def encode_mixed(self, texts: List[str], images: List[Union[str, bytes, Dict, Image.Image]], 
+                     show_progress: bool = True, normalize: bool = True) -> tuple:
+        """
+        同时对文本和图像进行向量化，文本和图像合并为一次请求发送
         
         Args:
             texts: 文本列表
             images: 图像列表
             show_progress: 是否显示进度条
+            normalize: 是否对向量做L2归一化
             
         Returns:
             (text_vectors, image_vectors) 元组
         """
-        text_vectors = self.encode_texts(texts, show_progress=show_progress) if texts else np.array([])
-        image_vectors = self.encode_images(images, show_progress=show_progress) if images else np.array([])
+        if not texts or not images:
+            text_vectors = self.encode_texts(texts, show_progress=show_progress, normalize=normalize)
+            image_vectors = self.encode_images(images, show_progress=show_progress, normalize=normalize)
+            return text_vectors, image_vectors
+        
+        image_inputs, image_keys = self._prepare_images(images)
+        vectors = self._encode_cached(
+            list(texts) + image_inputs,
+            self._text_keys(texts) + image_keys,
+            show_progress,
+            normalize
+        )
         
-        return text_vectors, image_vectors
+        return vectors[:len(texts)], vectors[len(texts):]
+    
+    def autotune_batch_size(self,
+                            sample: List,
+                            is_image: bool = False,
+                            candidates: Sequence[int] = (4, 16, 64, 128)) -> int:
+        """
+        在样本上测量各候选批大小的吞吐量，并把 batch_size 设置为吞吐量最高的值
+        
+        测量绕过向量缓存，直接请求服务器；大于样本数量的候选值不参与测量
+        
+        Args:
+            sample: 用于测量的文本，或 encode_images 接受的图像输入
+            is_image: 样本是否为图像
+            candidates: 候选批大小
+            
+        Returns:
+            选中的批大小
+        """
+        inputs = self._prepare_images(sample)[0] if is_image else list(sample)
+        if not inputs:
+            return self.batch_size
+        indices = list(range(len(inputs)))
+        sizes = [size for size in candidates if size <= len(inputs)] or [min(candidates)]
+        
+        # 预热一次，避免把建立连接的开销计入第一个候选值
+        self._encode_batches(inputs, indices[:1], show_progress=False)
+        
+        best_size, best_rate = self.batch_size, 0.0
+        for size in sizes:
+            self.batch_size = size
+            start = time.perf_counter()
+            self._encode_batches(inputs, indices, show_progress=False)
+            rate = len(indices) / max(time.perf_counter() - start, 1e-9)
+            if rate > best_rate:
+                best_size, best_rate = size, rate
+        
+        self.batch_size = best_size
+        return best_size
     
     def get_embedding_dimension(self) -> int:
         """
@@ -143,7 +508,35 @@ class CLIPVectorizer:
         Returns:
             向量维度
         """
-        # 使用一个简单的测试文本来获取维度
-        test_vector = self.encode_texts(["test"])
-        return test_vector.shape[1] if len(test_vector) > 0 else 512
+        # 已经编码过数据或在构造时指定了维度，无需再请求服务器
+        if self._dim is not None:
+            return self._dim
+        
+        # 使用一个简单的测试文本来获取维度（直接请求服务器，不经过缓存）
+        test_vector = self._to_numpy(self._next_client().encode(["test"], show_progress=False))
+        if len(test_vector) == 0:
+            return 512
+        self._dim = test_vector.shape[1]
+        return self._dim
+    
+    @staticmethod
+    def reset_default():
+        """清除 get_default_vectorizer 缓存的共享实例（主要用于测试）"""
+        get_default_vectorizer.cache_clear()
+
+
+@functools.lru_cache(maxsize=None)
+def get_default_vectorizer(server_url: str = "grpc://0.0.0.0:51000") -> CLIPVectorizer:
+    """
+    获取按服务器地址共享的CLIPVectorizer实例，避免在同一进程中重复建立gRPC连接
+    
+    同一个实例可以被多个线程并发调用 encode_*：请求会轮询分配到连接池中的不同连接上
+    
+    Args:
+        server_url: CLIP服务器地址
+        
+    Returns:
+        共享的CLIPVectorizer实例
+    """
+    return CLIPVectorizer(server_url=server_url)
 
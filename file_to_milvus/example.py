@@ -1,11 +1,30 @@
 """
 使用示例：演示如何使用各个组件
 """
+import io
+from concurrent.futures import ProcessPoolExecutor
+
 from file_parsers.file_parser import FileParserFactory
-from clip.vectorizer import CLIPVectorizer
+from clip.vectorizer import get_default_vectorizer
 from milvus.milvus_store import MilvusStore
 
 
+def _decode_to_rgb_jpeg(binary: bytes) -> bytes:
+    """
+    在子进程中解码图像、转换为RGB（CLIP需要）并重新编码为JPEG
+    
+    PIL Image对象无法直接跨进程传递，因此返回编码后的字节
+    """
+    from PIL import Image
+    
+    img = Image.open(io.BytesIO(binary))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
 def example_parse_file():
     """示例：解析文件"""
     print("=" * 60)
@@ -34,7 +53,7 @@ def example_vectorize():
     print("=" * 60)
     
     # 连接到CLIP服务器
-    vectorizer = CLIPVectorizer(server_url="grpc://0.0.0.0:51000")
+    vectorizer = get_default_vectorizer("grpc://0.0.0.0:51000")
     
     # 向量化文本
     texts = ["这是第一个文本", "这是第二个文本"]
@@ -81,7 +100,7 @@ def example_search():
     print("=" * 60)
     
     # 初始化组件
-    vectorizer = CLIPVectorizer(server_url="grpc://0.0.0.0:51000")
+    vectorizer = get_default_vectorizer("grpc://0.0.0.0:51000")
     store = MilvusStore(
         host="localhost",
         port=19530,
@@ -118,7 +137,7 @@ def example_full_workflow():
     print(f"提取到 {len(extracted.images)} 个图像")
     
     # 2. 向量化
-    vectorizer = CLIPVectorizer(server_url="grpc://0.0.0.0:51000")
+    vectorizer = get_default_vectorizer("grpc://0.0.0.0:51000")
     
     # 3. 存储
     store = MilvusStore(
@@ -142,26 +161,22 @@ def example_full_workflow():
     
     # 处理图像
     if extracted.images:
-        from PIL import Image
-        import io
-        
-        # 将图像二进制数据转换为PIL Image对象
-        pil_images = []
+        # 在进程池中并行解码并转换为RGB
+        images = []
         image_paths = []
-        for img_info in extracted.images:
-            try:
-                img = Image.open(io.BytesIO(img_info['binary']))
-                # 转换为RGB模式（CLIP需要）
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                pil_images.append(img)
-                image_paths.append(img_info['path'])
-            except Exception as e:
-                print(f"Warning: 无法加载图像 {img_info['path']}: {e}")
+        paths = extracted.images.paths
+        with ProcessPoolExecutor() as executor:
+            futures = [executor.submit(_decode_to_rgb_jpeg, binary) for binary in extracted.images.binaries]
+            for path, future in zip(paths, futures):
+                try:
+                    images.append({'binary': future.result(), 'format': 'JPEG'})
+                    image_paths.append(path)
+                except Exception as e:
+                    print(f"Warning: 无法加载图像 {path}: {e}")
         
-        if pil_images:
+        if images:
             # 向量化图像
-            image_embeddings = vectorizer.encode_images(pil_images)
+            image_embeddings = vectorizer.encode_images(images)
             
             # 存储图像向量
             store.insert_images(
@@ -171,7 +186,7 @@ def example_full_workflow():
                 file_type="word",
                 metadata=extracted.metadata
             )
-            print(f"✓ 已存储 {len(pil_images)} 个图像")
+            print(f"✓ 已存储 {len(images)} 个图像")
     
     print("✓ 完整流程执行成功")
 
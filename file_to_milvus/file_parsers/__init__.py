@@ -1,17 +1,22 @@
-from .file_parser import FileParserFactory, ExtractedContent
+from .file_parser import FileParserFactory, ExtractedContent, ImagesSoA
 from .hierarchical_parser import (
     HierarchicalWordParser,
     HierarchicalMarkdownParser,
     HierarchicalContent,
-    Chunk
+    Chunk,
+    parse_one,
+    parse_many
 )
 
 __all__ = [
     'FileParserFactory',
     'ExtractedContent',
+    'ImagesSoA',
     'HierarchicalWordParser',
     'HierarchicalMarkdownParser',
     'HierarchicalContent',
-    'Chunk'
+    'Chunk',
+    'parse_one',
+    'parse_many'
 ]
 
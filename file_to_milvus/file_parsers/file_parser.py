@@ -5,8 +5,8 @@ import os
 import io
 import re
 from pathlib import Path
-from typing import List, Dict, Tuple
-from dataclasses import dataclass
+from typing import List, Dict, Tuple, Iterator
+from dataclasses import dataclass, field
 
 try:
     from docx import Document
@@ -26,11 +26,47 @@ from bs4 import BeautifulSoup
 from PIL import Image
 
 
+@dataclass
+class ImagesSoA:
+    """
+    图像列表的列式存储：路径、格式、二进制数据和alt文本分别保存在平行列表中
+    
+    批量处理时可直接读取整列（如 images.binaries），无需逐个字典取值；
+    迭代和下标访问仍返回 {'path', 'binary', 'format', 'alt'} 字典，兼容原有用法
+    """
+    paths: List[str] = field(default_factory=list)
+    formats: List[str] = field(default_factory=list)
+    binaries: List[bytes] = field(default_factory=list)
+    alts: List[str] = field(default_factory=list)
+    
+    def append(self, path: str, binary: bytes, img_format: str, alt: str = ''):
+        """添加一张图像"""
+        self.paths.append(path)
+        self.binaries.append(binary)
+        self.formats.append(img_format)
+        self.alts.append(alt)
+    
+    def __len__(self) -> int:
+        return len(self.paths)
+    
+    def __getitem__(self, index: int) -> Dict:
+        return {
+            'path': self.paths[index],
+            'binary': self.binaries[index],
+            'format': self.formats[index],
+            'alt': self.alts[index],
+        }
+    
+    def __iter__(self) -> Iterator[Dict]:
+        for path, binary, img_format, alt in zip(self.paths, self.binaries, self.formats, self.alts):
+            yield {'path': path, 'binary': binary, 'format': img_format, 'alt': alt}
+
+
 @dataclass
 class ExtractedContent:
     """提取的内容数据类"""
     text_chunks: List[str]  # 文本块列表
-    images: List[Dict]      # 图像列表，每个包含 {'path': str, 'binary': bytes, 'format': str}
+    images: ImagesSoA       # 图像列表，迭代时每项为 {'path': str, 'binary': bytes, 'format': str, 'alt': str}
     metadata: Dict          # 元数据
 
 
@@ -73,7 +109,7 @@ class WordParser:
                 text_chunks.append("\n".join(table_text))
         
         # 提取图像
-        images = []
+        images = ImagesSoA()
         doc_path = Path(file_path)
         
         # 从Word文档内部提取嵌入的图像
@@ -99,11 +135,7 @@ class WordParser:
                     # 使用partname作为标识
                     img_name = image_part.partname.split('/')[-1]
                     
-                    images.append({
-                        'path': f"{file_path}:{img_name}",
-                        'binary': image_data,
-                        'format': img_format
-                    })
+                    images.append(f"{file_path}:{img_name}", image_data, img_format)
         except Exception as e:
             print(f"Warning: Could not extract images from Word: {e}")
         
@@ -180,7 +212,7 @@ class MarkdownParser:
                 text_chunks.append(f"[代码块]\n{text}")
         
         # 提取图像
-        images = []
+        images = ImagesSoA()
         md_path = Path(file_path)
         md_dir = md_path.parent
         
@@ -203,12 +235,7 @@ class MarkdownParser:
                         img_obj = Image.open(io.BytesIO(image_data))
                         img_format = img_obj.format or 'PNG'
                         
-                        images.append({
-                            'path': str(img_path),
-                            'binary': image_data,
-                            'format': img_format,
-                            'alt': img.get('alt', '')
-                        })
+                        images.append(str(img_path), image_data, img_format, img.get('alt', ''))
                     except Exception as e:
                         print(f"Warning: Could not load image {img_path}: {e}")
         
@@ -224,18 +251,13 @@ class MarkdownParser:
                 
                 if img_path.exists() and img_path.is_file():
                     # 避免重复添加
-                    if not any(img['path'] == str(img_path) for img in images):
+                    if str(img_path) not in images.paths:
                         try:
                             with open(img_path, 'rb') as f:
                                 image_data = f.read()
                             img_obj = Image.open(io.BytesIO(image_data))
                             img_format = img_obj.format or 'PNG'
-                            images.append({
-                                'path': str(img_path),
-                                'binary': image_data,
-                                'format': img_format,
-                                'alt': ''
-                            })
+                            images.append(str(img_path), image_data, img_format)
                         except Exception as e:
                             print(f"Warning: Could not load image {img_path}: {e}")
         
@@ -1,13 +1,42 @@
 """
 层次化文件解析器：支持父子分段（Hierarchical Chunking）
 """
+import hashlib
+import importlib.util
 import os
+import pickle
+import random
 import re
+from bisect import bisect_right
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import accumulate
 from pathlib import Path
-from typing import List, Dict, Optional
-from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Sequence, Tuple
+from dataclasses import dataclass
 from enum import Enum
 
+import numpy as np
+
+# numba 为可选依赖，只在第一次切分句子时导入和编译，不拖慢包的导入
+NUMBA_AVAILABLE = importlib.util.find_spec('numba') is not None
+
+
+# 句子分割和标题级别提取的正则，在模块加载时编译一次
+_SENT_SPLIT_RE = re.compile(r'([。！？.!?]\s*)')
+_HEADING_LEVEL_RE = re.compile(r'heading\s*(\d+)')
+
+# 解析结果缓存的格式版本：分块逻辑或 HierarchicalContent 的结构变化时加1，使旧缓存失效
+PARSE_CACHE_VERSION = 3
+
+# 内容定义切分使用的Gear哈希表：由固定种子生成的两组256个64位随机数，保证切分点跨进程稳定。
+# 字符的Gear值为低字节和高位字节各查一张表后异或，BMP内的每个码位（包括全部常用汉字）都有不同的值
+_MASK64 = (1 << 64) - 1
+_GEAR_BITS = random.Random(0x9E3779B9).getrandbits(64 * 512)
+_GEAR = tuple((_GEAR_BITS >> (64 * i)) & _MASK64 for i in range(256))
+_GEAR_HI = tuple((_GEAR_BITS >> (64 * i)) & _MASK64 for i in range(256, 512))
+
 
 class ChunkType(Enum):
     """分段类型"""
@@ -18,80 +47,223 @@ class ChunkType(Enum):
     SENTENCE = "sentence"      # 句子级别
 
 
-@dataclass
+@dataclass(eq=False, slots=True)
 class Chunk:
-    """文本块数据类，支持父子关系"""
+    """文本块数据类，支持父子关系（按对象身份比较和哈希，块由 index 唯一标识）"""
     content: str
     chunk_type: ChunkType
     index: int
     parent_id: Optional[int] = None
-    children_ids: List[int] = field(default_factory=list)
+    children_ids: Sequence[int] = ()  # 没有子块时共享空元组，解析完成后由 _link_children 填充
     level: int = 0  # 层级深度
-    metadata: Dict = field(default_factory=dict)
-    
-    def __hash__(self):
-        return hash((self.content[:50], self.index, self.chunk_type))
-    
-    def __eq__(self, other):
-        if not isinstance(other, Chunk):
-            return False
-        return (self.content[:50] == other.content[:50] and
-                self.index == other.index and
-                self.chunk_type == other.chunk_type)
+    metadata: Optional[Dict] = None  # 没有元数据时为None，读取时视为空字典
 
 
 @dataclass
 class HierarchicalContent:
     """层次化内容数据类"""
     chunks: List[Chunk]  # 所有块的扁平列表
-    chunk_tree: Dict[int, Chunk]  # 块索引到块的映射
+    chunk_tree: List[Chunk]  # 按块索引排列的块列表（索引连续，chunk_tree[i].index == i）
     root_chunks: List[int]  # 根块索引列表
     metadata: Dict  # 文档元数据
     
     def get_chunk(self, chunk_id: int) -> Optional[Chunk]:
         """根据ID获取块"""
-        return self.chunk_tree.get(chunk_id)
+        return self.chunk_tree[chunk_id] if 0 <= chunk_id < len(self.chunk_tree) else None
     
     def get_children(self, chunk_id: int) -> List[Chunk]:
         """获取子块列表"""
         chunk = self.get_chunk(chunk_id)
         if not chunk:
             return []
-        return [self.chunk_tree[cid] for cid in chunk.children_ids if cid in self.chunk_tree]
+        return [self.chunk_tree[cid] for cid in chunk.children_ids]
     
     def get_parent(self, chunk_id: int) -> Optional[Chunk]:
         """获取父块"""
         chunk = self.get_chunk(chunk_id)
         if not chunk or chunk.parent_id is None:
             return None
-        return self.chunk_tree.get(chunk.parent_id)
+        return self.chunk_tree[chunk.parent_id]
     
     def get_siblings(self, chunk_id: int) -> List[Chunk]:
         """获取兄弟块"""
         chunk = self.get_chunk(chunk_id)
-        if not chunk or chunk.parent_id is None:
-            return []
-        parent = self.get_parent(chunk_id)
-        if not parent:
+        if chunk is None or chunk.parent_id is None:
             return []
-        siblings = [self.chunk_tree[cid] for cid in parent.children_ids 
-                   if cid in self.chunk_tree and cid != chunk_id]
-        return siblings
+        parent = self.chunk_tree[chunk.parent_id]
+        return [self.chunk_tree[cid] for cid in parent.children_ids if cid != chunk_id]
     
     def get_ancestors(self, chunk_id: int) -> List[Chunk]:
-        """获取所有祖先块"""
+        """获取所有祖先块（由近及远）"""
         ancestors = []
         chunk = self.get_chunk(chunk_id)
-        while chunk and chunk.parent_id is not None:
-            parent = self.get_parent(chunk.index)
-            if parent:
-                ancestors.append(parent)
-                chunk = parent
-            else:
-                break
+        while chunk is not None and chunk.parent_id is not None:
+            chunk = self.chunk_tree[chunk.parent_id]
+            ancestors.append(chunk)
         return ancestors
 
 
+def _link_children(chunks: List[Chunk]):
+    """解析完成后按 parent_id 一次性填充各块的 children_ids（保持块的原始顺序）"""
+    children = defaultdict(list)
+    for chunk in chunks:
+        if chunk.parent_id is not None:
+            children[chunk.parent_id].append(chunk.index)
+    for parent_id, children_ids in children.items():
+        chunks[parent_id].children_ids = children_ids
+
+
+def _append_chunk(chunks: List[Chunk],
+                  content: str,
+                  chunk_type: ChunkType,
+                  parent_id: Optional[int],
+                  level: int,
+                  metadata: Optional[Dict] = None) -> int:
+    """创建块（索引为其在块列表中的位置）并加入块列表，返回新块的索引"""
+    index = len(chunks)
+    chunks.append(Chunk(content, chunk_type, index, parent_id, (), level, metadata))
+    return index
+
+
+def _content_defined_cuts(text: str, min_size: int, avg_size: int, max_size: int) -> List[int]:
+    """
+    FastCDC风格的内容定义切分（Gear滚动哈希），返回每块的结束位置
+    
+    切分点由附近的字符内容决定而不是固定步长，在文本前部插入或删除字符时，
+    后续的切分点基本不变，已编码块的向量缓存仍可复用。
+    前 min_size 个字符不计算哈希；avg_size 之前使用更严格的掩码，之后使用更宽松的掩码
+    （归一化切分），块长度集中在 avg_size 附近且不超过 max_size。
+    """
+    bits = max(2, avg_size.bit_length() - 1)
+    # 取哈希的高位做判断：左移累加的Gear哈希中，高位受更多历史字符影响
+    mask_strict = ((1 << (bits + 1)) - 1) << (63 - bits)
+    mask_loose = ((1 << (bits - 1)) - 1) << (65 - bits)
+    
+    cuts = []
+    start, n = 0, len(text)
+    while start < n:
+        end = min(n, start + max_size)
+        cut = end
+        if end - start > min_size:
+            normal = min(end, start + avg_size)
+            h = 0
+            for i in range(start + min_size, end):
+                c = ord(text[i])
+                h = ((h << 1) + (_GEAR[c & 0xFF] ^ _GEAR_HI[((c >> 8) ^ (c >> 16)) & 0xFF])) & _MASK64
+                if not h & (mask_strict if i < normal else mask_loose):
+                    cut = i + 1
+                    break
+        cuts.append(cut)
+        start = cut
+    return cuts
+
+
+def _greedy_split_indices(sentence_lens: np.ndarray, max_size: int) -> np.ndarray:
+    """
+    按句子长度贪心合并，返回每块的 (start, stop) 句子下标对
+    
+    单个句子超过 max_size 时单独成块（stop == start + 1），由调用方进一步切分。
+    只做整数累加，安装了numba时会被JIT编译为机器码。
+    """
+    n = sentence_lens.shape[0]
+    spans = np.empty((n, 2), dtype=np.int64)
+    count = 0
+    start = 0
+    while start < n:
+        total = 0
+        stop = start
+        while stop < n and total + sentence_lens[stop] <= max_size:
+            total += sentence_lens[stop]
+            stop += 1
+        if stop == start:
+            stop = start + 1
+        spans[count, 0] = start
+        spans[count, 1] = stop
+        count += 1
+        start = stop
+    return spans[:count]
+
+
+_greedy_split_jit = None
+# JIT编译约需0.5秒（每个解析进程各编译一次），而每个句子只比二分查找快约40ns，句子很少时还更慢：
+# 默认走二分查找，只有本进程累计处理的长文本句子数足以摊平编译开销后才切换到JIT版本
+_JIT_MIN_SENTENCES = 1000
+_JIT_AMORTIZE_SENTENCES = 10_000_000
+_long_sentences_seen = 0
+
+
+def _get_greedy_split_jit():
+    """
+    第一次调用时导入numba并编译 _greedy_split_indices，之后复用编译结果
+    
+    不使用 cache=True：本文件会以 file_parsers.hierarchical_parser 和
+    file_to_milvus.file_parsers.hierarchical_parser 两个模块名被导入，共用磁盘缓存会导致导入失败
+    """
+    global _greedy_split_jit
+    if _greedy_split_jit is None:
+        import numba
+        _greedy_split_jit = numba.njit(_greedy_split_indices)
+    return _greedy_split_jit
+
+
+def _sentence_spans(sentences: List[str], max_chunk_size: int) -> List[Tuple[int, int]]:
+    """
+    计算句子贪心合并的 (start, stop) 下标对
+    
+    默认用前缀和加二分查找；安装了numba且本进程处理过足够多的长文本后，长文本改走JIT版本
+    """
+    global _long_sentences_seen
+    if NUMBA_AVAILABLE and len(sentences) >= _JIT_MIN_SENTENCES:
+        _long_sentences_seen += len(sentences)
+        if _long_sentences_seen >= _JIT_AMORTIZE_SENTENCES:
+            lens = np.fromiter(map(len, sentences), dtype=np.int64, count=len(sentences))
+            return [tuple(span) for span in _get_greedy_split_jit()(lens, max_chunk_size).tolist()]
+    
+    ends = list(accumulate(map(len, sentences)))
+    spans = []
+    start, base = 0, 0
+    while start < len(sentences):
+        stop = max(bisect_right(ends, base + max_chunk_size, lo=start), start + 1)
+        spans.append((start, stop))
+        start, base = stop, ends[stop - 1]
+    return spans
+
+
+def _split_sentences(text: str,
+                     max_chunk_size: int,
+                     overlap_size: int,
+                     min_chunk_size: int = 0) -> List[str]:
+    """
+    按句子贪心地合并成不超过 max_chunk_size 的块，单个超长句子按内容定义的切分点分割
+    
+    每块的句子范围由 _sentence_spans 计算，每块只做一次 join；
+    超长句子的每块（除第一块外）带上前一块末尾 overlap_size 个字符作为重叠
+    """
+    sentences = _SENT_SPLIT_RE.split(text)
+    chunks = []
+    
+    for start, stop in _sentence_spans(sentences, max_chunk_size):
+        sentence = sentences[start]
+        if stop - start > 1 or len(sentence) <= max_chunk_size:
+            current_chunk = "".join(sentences[start:stop])
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+            continue
+        
+        # 单个句子就超过最大长度，按内容定义的切分点分割（加上重叠后仍不超过最大长度）
+        step = max(1, max_chunk_size - overlap_size)
+        avg_size = max(1, step // 2)
+        # min_chunk_size 作为切分的最小块长度，但不超过平均长度的四分之一，保留足够的切分点选择范围
+        prev = 0
+        for cut in _content_defined_cuts(sentence, min(min_chunk_size, avg_size // 4), avg_size, step):
+            chunk = sentence[max(0, prev - overlap_size):cut]
+            if chunk.strip():
+                chunks.append(chunk.strip())
+            prev = cut
+    
+    return chunks
+
+
 class HierarchicalWordParser:
     """层次化Word文档解析器"""
     
@@ -129,123 +301,72 @@ class HierarchicalWordParser:
         """
         doc = self.Document(file_path)
         chunks = []
-        chunk_tree = {}
         root_chunks = []
-        chunk_index = 0
         
         # 第一层：文档级别
-        doc_chunk = Chunk(
-            content=f"Document: {Path(file_path).stem}",
-            chunk_type=ChunkType.DOCUMENT,
-            index=chunk_index,
-            level=0,
-            metadata={'file_path': file_path}
+        doc_index = _append_chunk(
+            chunks, f"Document: {Path(file_path).stem}", ChunkType.DOCUMENT,
+            None, 0, {'file_path': file_path}
         )
-        chunks.append(doc_chunk)
-        chunk_tree[chunk_index] = doc_chunk
-        doc_index = chunk_index
-        chunk_index += 1
         
-        current_section = None
-        current_subsection = None
+        # 当前所在的标题路径 [文档, 章节, 小节]（章节、小节可缺省），新块挂在栈顶下，层级为栈深度
+        scope = [doc_index]
+        
+        # 解析段落：直接遍历body下的 <w:p> 元素，样式名通过预先建立的映射解析，
+        # 避免为每个段落创建Paragraph包装对象并在样式表中逐个查找样式
+        from docx.oxml.ns import qn
         
-        # 解析段落
-        for para in doc.paragraphs:
-            text = para.text.strip()
+        style_names, default_style = self._paragraph_style_names(doc)
+        for p in doc.element.body.iterchildren(qn('w:p')):
+            text = p.text.strip()
             if not text:
                 continue
             
             # 判断是否是标题（章节）
-            style_name = para.style.name.lower() if para.style else ""
-            is_heading = "heading" in style_name or para.style.name.startswith("Heading")
+            style_name = style_names.get(p.style, default_style).lower()
+            is_heading = "heading" in style_name
             
             if is_heading:
                 # 提取标题级别
-                heading_level = self._extract_heading_level(para.style.name)
+                heading_level = self._extract_heading_level(style_name)
                 
                 if heading_level <= 2:  # 主要章节
                     # 创建章节块
-                    section_chunk = Chunk(
-                        content=text,
-                        chunk_type=ChunkType.SECTION,
-                        index=chunk_index,
-                        parent_id=doc_index,
-                        level=1,
-                        metadata={'heading_level': heading_level}
+                    section_index = _append_chunk(
+                        chunks, text, ChunkType.SECTION,
+                        doc_index, 1, {'heading_level': heading_level}
                     )
-                    chunks.append(section_chunk)
-                    chunk_tree[chunk_index] = section_chunk
-                    doc_chunk.children_ids.append(chunk_index)
-                    current_section = chunk_index
-                    current_subsection = None
-                    chunk_index += 1
+                    scope[1:] = [section_index]
                 
                 elif heading_level <= 4:  # 小节
-                    parent_id = current_section if current_section else doc_index
-                    subsection_chunk = Chunk(
-                        content=text,
-                        chunk_type=ChunkType.SUBSECTION,
-                        index=chunk_index,
-                        parent_id=parent_id,
-                        level=2 if current_section else 1,
-                        metadata={'heading_level': heading_level}
-                    )
-                    chunks.append(subsection_chunk)
-                    chunk_tree[chunk_index] = subsection_chunk
-                    if parent_id in chunk_tree:
-                        chunk_tree[parent_id].children_ids.append(chunk_index)
-                    current_subsection = chunk_index
-                    chunk_index += 1
+                    if chunks[scope[-1]].chunk_type is ChunkType.SUBSECTION:
+                        scope.pop()
+                    scope.append(_append_chunk(
+                        chunks, text, ChunkType.SUBSECTION,
+                        scope[-1], len(scope), {'heading_level': heading_level}
+                    ))
             
             else:
                 # 普通段落
-                # 分段处理长段落
-                paragraphs = self._split_long_text(text)
+                # 分段处理长段落（多数段落不超过最大长度，直接使用，省去一次方法调用）
+                paragraphs = (text,) if len(text) <= self.max_chunk_size else self._split_long_text(text)
                 
                 for para_text in paragraphs:
                     if len(para_text.strip()) < self.min_chunk_size:
                         continue
                     
-                    parent_id = current_subsection if current_subsection else (
-                        current_section if current_section else doc_index
-                    )
-                    
-                    para_chunk = Chunk(
-                        content=para_text,
-                        chunk_type=ChunkType.PARAGRAPH,
-                        index=chunk_index,
-                        parent_id=parent_id,
-                        level=3 if current_subsection else (2 if current_section else 1),
-                        metadata={}
-                    )
-                    chunks.append(para_chunk)
-                    chunk_tree[chunk_index] = para_chunk
-                    if parent_id in chunk_tree:
-                        chunk_tree[parent_id].children_ids.append(chunk_index)
-                    chunk_index += 1
+                    _append_chunk(chunks, para_text, ChunkType.PARAGRAPH, scope[-1], len(scope))
         
         # 处理表格
         for table_idx, table in enumerate(doc.tables):
             table_text = self._extract_table_text(table)
             if table_text:
-                parent_id = current_subsection if current_subsection else (
-                    current_section if current_section else doc_index
-                )
-                
-                table_chunk = Chunk(
-                    content=f"[表格 {table_idx + 1}]\n{table_text}",
-                    chunk_type=ChunkType.PARAGRAPH,
-                    index=chunk_index,
-                    parent_id=parent_id,
-                    level=3 if current_subsection else (2 if current_section else 1),
-                    metadata={'table_index': table_idx}
+                _append_chunk(
+                    chunks, f"[表格 {table_idx + 1}]\n{table_text}", ChunkType.PARAGRAPH,
+                    scope[-1], len(scope), {'table_index': table_idx}
                 )
-                chunks.append(table_chunk)
-                chunk_tree[chunk_index] = table_chunk
-                if parent_id in chunk_tree:
-                    chunk_tree[parent_id].children_ids.append(chunk_index)
-                chunk_index += 1
         
+        _link_children(chunks)
         root_chunks = [doc_index]
         
         metadata = {
@@ -257,62 +378,72 @@ class HierarchicalWordParser:
         
         return HierarchicalContent(
             chunks=chunks,
-            chunk_tree=chunk_tree,
+            chunk_tree=chunks,  # 块索引与列表下标一致，直接复用块列表
             root_chunks=root_chunks,
             metadata=metadata
         )
     
+    def _paragraph_style_names(self, doc) -> Tuple[Dict[str, str], str]:
+        """
+        建立段落样式ID到样式名的映射
+        
+        Returns:
+            (样式ID -> 样式名, 默认段落样式名)；与 Paragraph.style 一致，
+            未设置或无法识别的样式ID回退到默认段落样式
+        """
+        from docx.enum.style import WD_STYLE_TYPE
+        
+        style_names = {
+            style.style_id: style.name or ""
+            for style in doc.styles
+            if style.type == WD_STYLE_TYPE.PARAGRAPH
+        }
+        default = doc.styles.default(WD_STYLE_TYPE.PARAGRAPH)
+        default_name = (default.name or "") if default is not None else ""
+        return style_names, default_name
+    
     def _extract_heading_level(self, style_name: str) -> int:
         """从样式名提取标题级别"""
-        match = re.search(r'heading\s*(\d+)', style_name.lower())
+        # 常见情况：样式名就是 "Heading N"，无需正则
+        if style_name[:8] in ('Heading ', 'heading ') and style_name[8:].isdecimal():
+            return int(style_name[8:])
+        match = _HEADING_LEVEL_RE.search(style_name.lower())
         if match:
             return int(match.group(1))
-        # 默认判断
-        if 'heading 1' in style_name.lower():
-            return 1
-        elif 'heading 2' in style_name.lower():
-            return 2
-        elif 'heading 3' in style_name.lower():
-            return 3
         return 2  # 默认级别
     
     def _split_long_text(self, text: str) -> List[str]:
         """将长文本分割成多个块"""
         if len(text) <= self.max_chunk_size:
             return [text]
+        return _split_sentences(text, self.max_chunk_size, self.overlap_size, self.min_chunk_size)
+    
+    def _extract_table_text(self, table) -> str:
+        """
+        提取表格文本
         
-        chunks = []
-        # 按句子分割
-        sentences = re.split(r'([。！？.!?]\s*)', text)
-        current_chunk = ""
+        直接遍历 <w:tr>/<w:tc> 元素；与 row.cells 一致，横向合并的单元格按跨列数重复，
+        纵向合并的单元格取合并区域首行的内容，每个单元格的文本只提取一次
+        """
+        from docx.oxml.ns import qn
         
-        for sentence in sentences:
-            if len(current_chunk) + len(sentence) <= self.max_chunk_size:
-                current_chunk += sentence
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                # 如果单个句子就超过最大长度，强制分割
-                if len(sentence) > self.max_chunk_size:
-                    # 按字符分割
-                    for i in range(0, len(sentence), self.max_chunk_size - self.overlap_size):
-                        chunk = sentence[i:i + self.max_chunk_size]
-                        if chunk.strip():
-                            chunks.append(chunk.strip())
-                    current_chunk = ""
-                else:
-                    current_chunk = sentence
+        cell_texts = {}
         
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+        def cell_text(tc) -> str:
+            while tc.vMerge == "continue":
+                tc = tc._tc_above
+            text = cell_texts.get(tc)
+            if text is None:
+                text = "\n".join(p.text for p in tc.iterchildren(qn('w:p'))).strip()
+                cell_texts[tc] = text
+            return text
         
-        return chunks
-    
-    def _extract_table_text(self, table) -> str:
-        """提取表格文本"""
         rows_text = []
-        for row in table.rows:
-            row_text = " | ".join(cell.text.strip() for cell in row.cells)
+        for tr in table._tbl.tr_lst:
+            cells = []
+            for tc in tr.tc_lst:
+                cells.extend([cell_text(tc)] * tc.grid_span)
+            row_text = " | ".join(cells)
             if row_text.strip():
                 rows_text.append(row_text)
         return "\n".join(rows_text)
@@ -353,183 +484,90 @@ class HierarchicalMarkdownParser:
         Returns:
             HierarchicalContent对象
         """
-        with open(file_path, 'r', encoding='utf-8') as f:
-            md_content = f.read()
-        
         chunks = []
-        chunk_tree = {}
         root_chunks = []
-        chunk_index = 0
-        
-        # 解析Markdown结构
-        lines = md_content.split('\n')
         
         # 文档级别块
-        doc_chunk = Chunk(
-            content=f"Document: {Path(file_path).stem}",
-            chunk_type=ChunkType.DOCUMENT,
-            index=chunk_index,
-            level=0,
-            metadata={'file_path': file_path}
+        doc_index = _append_chunk(
+            chunks, f"Document: {Path(file_path).stem}", ChunkType.DOCUMENT,
+            None, 0, {'file_path': file_path}
         )
-        chunks.append(doc_chunk)
-        chunk_tree[chunk_index] = doc_chunk
-        doc_index = chunk_index
-        chunk_index += 1
         
-        current_section = None
-        current_subsection = None
+        # 当前所在的标题路径 [文档, 章节, 小节]（章节、小节可缺省），新块挂在栈顶下，层级为栈深度
+        scope = [doc_index]
         current_paragraph = []
         
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            
-            # 检查是否是标题
-            if line.startswith('#'):
-                # 先处理之前的段落
-                if current_paragraph:
-                    para_text = '\n'.join(current_paragraph).strip()
-                    if para_text and len(para_text) >= self.min_chunk_size:
-                        para_chunks = self._split_long_text(para_text)
-                        for para_chunk_text in para_chunks:
-                            parent_id = current_subsection if current_subsection else (
-                                current_section if current_section else doc_index
-                            )
-                            para_chunk = Chunk(
-                                content=para_chunk_text,
-                                chunk_type=ChunkType.PARAGRAPH,
-                                index=chunk_index,
-                                parent_id=parent_id,
-                                level=3 if current_subsection else (2 if current_section else 1),
-                                metadata={}
-                            )
-                            chunks.append(para_chunk)
-                            chunk_tree[chunk_index] = para_chunk
-                            if parent_id in chunk_tree:
-                                chunk_tree[parent_id].children_ids.append(chunk_index)
-                            chunk_index += 1
-                    current_paragraph = []
-                
-                # 处理标题
-                heading_level = len(line) - len(line.lstrip('#'))
-                heading_text = line.lstrip('#').strip()
+        def emit(text: str, metadata: Optional[Dict] = None):
+            """在当前标题路径下添加一个段落块（普通段落或代码块）"""
+            _append_chunk(chunks, text, ChunkType.PARAGRAPH, scope[-1], len(scope), metadata)
+        
+        def flush_paragraph():
+            """将累积的段落行（按长度切分后）写入为段落块，并清空累积的行"""
+            para_text = '\n'.join(current_paragraph).strip()
+            if para_text and len(para_text) >= self.min_chunk_size:
+                if len(para_text) <= self.max_chunk_size:
+                    emit(para_text)
+                else:
+                    for para_chunk_text in self._split_long_text(para_text):
+                        emit(para_chunk_text)
+            current_paragraph.clear()
+        
+        # 逐行流式解析Markdown结构，不把整个文件读入内存
+        with open(file_path, 'r', encoding='utf-8', buffering=1 << 20) as f:
+            for raw_line in f:
+                line = raw_line.strip()
                 
-                if heading_level <= 2:  # 主要章节
-                    section_chunk = Chunk(
-                        content=heading_text,
-                        chunk_type=ChunkType.SECTION,
-                        index=chunk_index,
-                        parent_id=doc_index,
-                        level=1,
-                        metadata={'heading_level': heading_level}
-                    )
-                    chunks.append(section_chunk)
-                    chunk_tree[chunk_index] = section_chunk
-                    doc_chunk.children_ids.append(chunk_index)
-                    current_section = chunk_index
-                    current_subsection = None
-                    chunk_index += 1
+                # 检查是否是标题
+                if line.startswith('#'):
+                    # 先处理之前的段落
+                    if current_paragraph:
+                        flush_paragraph()
+                    
+                    # 处理标题：统计开头的 '#' 个数（超过6级的标题都会被忽略，最多数到7）
+                    heading_level = 1
+                    while heading_level < min(7, len(line)) and line[heading_level] == '#':
+                        heading_level += 1
+                    heading_text = line[heading_level:].strip()
+                    
+                    if heading_level <= 2:  # 主要章节
+                        section_index = _append_chunk(
+                            chunks, heading_text, ChunkType.SECTION,
+                            doc_index, 1, {'heading_level': heading_level}
+                        )
+                        scope[1:] = [section_index]
+                    
+                    elif heading_level <= 4:  # 小节
+                        if chunks[scope[-1]].chunk_type is ChunkType.SUBSECTION:
+                            scope.pop()
+                        scope.append(_append_chunk(
+                            chunks, heading_text, ChunkType.SUBSECTION,
+                            scope[-1], len(scope), {'heading_level': heading_level}
+                        ))
                 
-                elif heading_level <= 4:  # 小节
-                    parent_id = current_section if current_section else doc_index
-                    subsection_chunk = Chunk(
-                        content=heading_text,
-                        chunk_type=ChunkType.SUBSECTION,
-                        index=chunk_index,
-                        parent_id=parent_id,
-                        level=2 if current_section else 1,
-                        metadata={'heading_level': heading_level}
-                    )
-                    chunks.append(subsection_chunk)
-                    chunk_tree[chunk_index] = subsection_chunk
-                    if parent_id in chunk_tree:
-                        chunk_tree[parent_id].children_ids.append(chunk_index)
-                    current_subsection = chunk_index
-                    chunk_index += 1
-            
-            elif line.startswith('```'):  # 代码块
-                # 收集代码块
-                code_lines = [line]
-                i += 1
-                while i < len(lines) and not lines[i].strip().startswith('```'):
-                    code_lines.append(lines[i])
-                    i += 1
-                if i < len(lines):
-                    code_lines.append(lines[i])
+                elif line.startswith('```'):  # 代码块
+                    # 从同一个文件迭代器继续读取，直到结束标记（或文件末尾）
+                    code_lines = [line]
+                    for code_line in f:
+                        code_line = code_line.rstrip('\n')
+                        code_lines.append(code_line)
+                        if code_line.lstrip().startswith('```'):
+                            break
+                    
+                    emit('\n'.join(code_lines), {'is_code': True})
                 
-                code_text = '\n'.join(code_lines)
-                parent_id = current_subsection if current_subsection else (
-                    current_section if current_section else doc_index
-                )
+                elif line:
+                    current_paragraph.append(line)
                 
-                code_chunk = Chunk(
-                    content=code_text,
-                    chunk_type=ChunkType.PARAGRAPH,
-                    index=chunk_index,
-                    parent_id=parent_id,
-                    level=3 if current_subsection else (2 if current_section else 1),
-                    metadata={'is_code': True}
-                )
-                chunks.append(code_chunk)
-                chunk_tree[chunk_index] = code_chunk
-                if parent_id in chunk_tree:
-                    chunk_tree[parent_id].children_ids.append(chunk_index)
-                chunk_index += 1
-            
-            elif line.strip():
-                current_paragraph.append(line)
-            
-            else:
-                # 空行，结束当前段落
-                if current_paragraph:
-                    para_text = '\n'.join(current_paragraph).strip()
-                    if para_text and len(para_text) >= self.min_chunk_size:
-                        para_chunks = self._split_long_text(para_text)
-                        for para_chunk_text in para_chunks:
-                            parent_id = current_subsection if current_subsection else (
-                                current_section if current_section else doc_index
-                            )
-                            para_chunk = Chunk(
-                                content=para_chunk_text,
-                                chunk_type=ChunkType.PARAGRAPH,
-                                index=chunk_index,
-                                parent_id=parent_id,
-                                level=3 if current_subsection else (2 if current_section else 1),
-                                metadata={}
-                            )
-                            chunks.append(para_chunk)
-                            chunk_tree[chunk_index] = para_chunk
-                            if parent_id in chunk_tree:
-                                chunk_tree[parent_id].children_ids.append(chunk_index)
-                            chunk_index += 1
-                    current_paragraph = []
-            
-            i += 1
+                else:
+                    # 空行，结束当前段落
+                    if current_paragraph:
+                        flush_paragraph()
         
         # 处理最后的段落
         if current_paragraph:
-            para_text = '\n'.join(current_paragraph).strip()
-            if para_text and len(para_text) >= self.min_chunk_size:
-                para_chunks = self._split_long_text(para_text)
-                for para_chunk_text in para_chunks:
-                    parent_id = current_subsection if current_subsection else (
-                        current_section if current_section else doc_index
-                    )
-                    para_chunk = Chunk(
-                        content=para_chunk_text,
-                        chunk_type=ChunkType.PARAGRAPH,
-                        index=chunk_index,
-                        parent_id=parent_id,
-                        level=3 if current_subsection else (2 if current_section else 1),
-                        metadata={}
-                    )
-                    chunks.append(para_chunk)
-                    chunk_tree[chunk_index] = para_chunk
-                    if parent_id in chunk_tree:
-                        chunk_tree[parent_id].children_ids.append(chunk_index)
-                    chunk_index += 1
+            flush_paragraph()
         
+        _link_children(chunks)
         root_chunks = [doc_index]
         
         metadata = {
@@ -541,7 +579,7 @@ class HierarchicalMarkdownParser:
         
         return HierarchicalContent(
             chunks=chunks,
-            chunk_tree=chunk_tree,
+            chunk_tree=chunks,  # 块索引与列表下标一致，直接复用块列表
             root_chunks=root_chunks,
             metadata=metadata
         )
@@ -550,28 +588,100 @@ class HierarchicalMarkdownParser:
         """将长文本分割成多个块"""
         if len(text) <= self.max_chunk_size:
             return [text]
+        return _split_sentences(text, self.max_chunk_size, self.overlap_size, self.min_chunk_size)
+
+
+def _parse_cache_path(cache_dir: str, file_path: str, parser) -> Path:
+    """
+    解析结果缓存文件的路径：由缓存版本、文件的绝对路径、修改时间、大小、解析器类型和分块参数决定，
+    文件、分块参数或分块逻辑变化后自动失效
+    """
+    stat = os.stat(file_path)
+    key = (f"{PARSE_CACHE_VERSION}|{os.path.abspath(file_path)}|{stat.st_mtime_ns}|{stat.st_size}|"
+           f"{type(parser).__name__}|{parser.max_chunk_size}|{parser.min_chunk_size}|{parser.overlap_size}")
+    return Path(cache_dir) / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.pkl"
+
+
+def parse_one(file_path: str,
+              max_chunk_size: int = 500,
+              cache_dir: Optional[str] = None) -> HierarchicalContent:
+    """
+    根据文件扩展名选择层次化解析器并解析单个文件
+    
+    Args:
+        file_path: 文件路径（.docx / .md / .markdown）
+        max_chunk_size: 最大块大小
+        cache_dir: 解析结果缓存目录，为None时不使用缓存；文件未变化时直接读取上次的解析结果
         
-        chunks = []
-        sentences = re.split(r'([。！？.!?]\s*)', text)
-        current_chunk = ""
-        
-        for sentence in sentences:
-            if len(current_chunk) + len(sentence) <= self.max_chunk_size:
-                current_chunk += sentence
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                if len(sentence) > self.max_chunk_size:
-                    for i in range(0, len(sentence), self.max_chunk_size - self.overlap_size):
-                        chunk = sentence[i:i + self.max_chunk_size]
-                        if chunk.strip():
-                            chunks.append(chunk.strip())
-                    current_chunk = ""
-                else:
-                    current_chunk = sentence
-        
-        if current_chunk:
-            chunks.append(current_chunk.strip())
-        
-        return chunks
+    Returns:
+        HierarchicalContent对象
+    """
+    ext = Path(file_path).suffix.lower()
+    if ext == '.docx':
+        parser = HierarchicalWordParser(max_chunk_size=max_chunk_size)
+    elif ext in ('.md', '.markdown'):
+        parser = HierarchicalMarkdownParser(max_chunk_size=max_chunk_size)
+    else:
+        raise ValueError(f"Unsupported file type: {ext}")
+    
+    if cache_dir is None:
+        return parser.parse(file_path)
+    
+    cache_path = _parse_cache_path(cache_dir, file_path, parser)
+    try:
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        # 缓存不存在或已损坏时重新解析
+        pass
+    
+    content = parser.parse(file_path)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再替换，多个进程同时写同一缓存时也不会读到不完整的文件
+        tmp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(content, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return content
+
+
+def _parse_one_or_error(file_path: str, max_chunk_size: int, cache_dir: Optional[str] = None):
+    """parse_one 的包装：出错时返回异常对象而不是抛出，避免一个文件失败中断整个批次"""
+    try:
+        return parse_one(file_path, max_chunk_size, cache_dir)
+    except Exception as e:
+        return e
 
+
+def parse_many(file_paths: List[str],
+               max_chunk_size: int = 500,
+               workers: Optional[int] = None,
+               return_exceptions: bool = False,
+               cache_dir: Optional[str] = None) -> List:
+    """
+    使用多进程并行解析多个文件，结果顺序与 file_paths 一致
+    
+    Args:
+        file_paths: 文件路径列表
+        max_chunk_size: 最大块大小
+        workers: 进程数，默认为CPU核数
+        return_exceptions: 为True时解析失败的文件在结果中以异常对象表示，否则直接抛出
+        cache_dir: 解析结果缓存目录，为None时不使用缓存
+        
+    Returns:
+        HierarchicalContent列表（return_exceptions=True 时可能包含异常对象）
+    """
+    if not file_paths:
+        return []
+    workers = min(workers or os.cpu_count() or 1, len(file_paths))
+    worker = _parse_one_or_error if return_exceptions else parse_one
+    chunksize = max(1, len(file_paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+            partial(worker, max_chunk_size=max_chunk_size, cache_dir=cache_dir),
+            file_paths,
+            chunksize=chunksize
+        ))
@@ -19,26 +19,49 @@ python main.py --search "你想找的图像描述" --content-type image
     # 搜索并显示图片
     python image_folder_to_milvus.py --search "蓝天白云" --show
 """
+from __future__ import annotations
+
+import io
+import json
 import os
 import sys
 import argparse
+import itertools
+import queue
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple
 from tqdm import tqdm
 from dotenv import load_dotenv
-import numpy as np
 
-from clip.vectorizer import CLIPVectorizer
-from milvus.milvus_store import MilvusStore
+# numpy、CLIP（clip_client / grpc）和Milvus（pymilvus）客户端导入较慢，在用到时才导入，
+# 这样 --help 等不需要它们的调用可以快速返回
+if TYPE_CHECKING:
+    import numpy as np
+    from clip.vectorizer import CLIPVectorizer
+    from milvus.milvus_store import MilvusStore
 
 # 加载环境变量
 load_dotenv()
 
 # 支持的图片格式
 SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.tif'}
+# 扩展名与图像格式名不一致的情况
+_SUFFIX_FORMATS = {'.jpg': 'JPEG', '.tif': 'TIFF'}
+
+# CLIP模型的输入分辨率，服务端会把图片短边缩放到该尺寸后中心裁剪
+CLIP_INPUT_SIZE = 224
+
+# 批大小自动调优结果的缓存文件，按 (CLIP服务器地址, 向量维度) 记录
+AUTOTUNE_CACHE_PATH = Path.home() / '.clip_milvus_tune.json'
+
+# 上传的图片文件大小范围：过小的多为损坏或空文件，过大的会拖慢甚至卡住编码
+MIN_IMAGE_BYTES = 1024
+MAX_IMAGE_BYTES = 50 << 20
 
 
-def collect_images(directory: str, recursive: bool = True) -> List[Path]:
+def collect_images(directory: str, recursive: bool = True) -> Iterator[Path]:
     """
     收集目录中的所有图片文件
     
@@ -47,32 +70,149 @@ def collect_images(directory: str, recursive: bool = True) -> List[Path]:
         recursive: 是否递归搜索子目录
         
     Returns:
-        图片文件路径列表
+        图片文件路径的迭代器（按目录遍历顺序，不排序），边扫描边产出，
+        调用方可以在扫描完成前开始处理
     """
     dir_path = Path(directory)
     if not dir_path.exists():
         raise FileNotFoundError(f"目录不存在: {directory}")
+    return _scan_images(directory, recursive)
+
+
+def _scan_images(directory: str, recursive: bool) -> Iterator[Path]:
+    """遍历目录树，逐个产出扩展名和文件大小符合要求的图片路径"""
+    # 只遍历一次目录树，按扩展名（不区分大小写）筛选；文件大小直接取自 scandir 的目录项，
+    # 在大多数平台上无需额外的 stat 调用
+    exts = tuple(SUPPORTED_FORMATS)
+    skipped = 0
+    pending_dirs = [directory]
+    while pending_dirs:
+        try:
+            entries = os.scandir(pending_dirs.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        # 与 os.walk 一致，不进入符号链接指向的目录
+                        if recursive and not entry.is_symlink():
+                            pending_dirs.append(entry.path)
+                    elif entry.name.lower().endswith(exts):
+                        if MIN_IMAGE_BYTES <= entry.stat().st_size <= MAX_IMAGE_BYTES:
+                            yield Path(entry.path)
+                        else:
+                            skipped += 1
+                except OSError:
+                    continue
+    
+    if skipped:
+        print(f"\n⚠️ 跳过 {skipped} 个大小不在 {MIN_IMAGE_BYTES // 1024}KB-{MAX_IMAGE_BYTES >> 20}MB 范围内的图片")
+
+
+def _preprocess_image(path: str, n_px: int = CLIP_INPUT_SIZE) -> bytes:
+    """
+    在子进程中解码图片、转换为RGB，并把短边缩小到 n_px 后重新编码为JPEG
     
-    images = []
-    if recursive:
-        for ext in SUPPORTED_FORMATS:
-            images.extend(dir_path.rglob(f"*{ext}"))
-            images.extend(dir_path.rglob(f"*{ext.upper()}"))
-    else:
-        for ext in SUPPORTED_FORMATS:
-            images.extend(dir_path.glob(f"*{ext}"))
-            images.extend(dir_path.glob(f"*{ext.upper()}"))
+    CLIP服务端最终也会把短边缩放到 n_px，提前在客户端多核并行缩小，
+    可以减少传输的数据量和服务端的解码、缩放开销
+    """
+    from PIL import Image
+    
+    with Image.open(path) as img:
+        # JPEG可在解码时直接按 1/2、1/4、1/8 缩小（结果不小于请求的尺寸）
+        img.draft('RGB', (n_px, n_px))
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        width, height = img.size
+        scale = n_px / min(width, height)
+        if scale < 1:
+            img = img.resize((max(n_px, round(width * scale)), max(n_px, round(height * scale))),
+                             Image.BICUBIC)
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=95)
+        return buffer.getvalue()
+
+
+def _load_image_inputs(paths: List[Path],
+                       executor: Optional[Executor] = None) -> Tuple[List[str], List[dict]]:
+    """
+    读取一批图片，后续编码（包括失败后的逐张重试）都复用这份数据
+    
+    Args:
+        paths: 图片路径列表
+        executor: 进程池；提供时在子进程中并行预处理（解码、缩小），否则直接读取原始字节
+    
+    Returns:
+        (成功读取的图片路径列表, {'binary', 'format'} 字典列表)
+    """
+    str_paths = []
+    image_inputs = []
+    
+    if executor is not None:
+        futures = [executor.submit(_preprocess_image, str(path)) for path in paths]
+        for path, future in zip(paths, futures):
+            try:
+                binary = future.result()
+            except Exception as e:
+                print(f"  ✗ 跳过图片 {path}: {e}")
+                continue
+            str_paths.append(str(path))
+            image_inputs.append({'binary': binary, 'format': 'JPEG'})
+        return str_paths, image_inputs
+    
+    for path in paths:
+        try:
+            binary = path.read_bytes()
+        except OSError as e:
+            print(f"  ✗ 跳过图片 {path}: {e}")
+            continue
+        suffix = path.suffix.lower()
+        str_paths.append(str(path))
+        image_inputs.append({'binary': binary, 'format': _SUFFIX_FORMATS.get(suffix, suffix[1:].upper())})
+    return str_paths, image_inputs
+
+
+def _autotuned_batch_size(vectorizer: CLIPVectorizer,
+                          sample_paths: List[Path],
+                          executor: Optional[Executor]) -> Optional[int]:
+    """
+    获取当前CLIP服务器吞吐量最高的批大小：优先读取缓存的调优结果，否则在样本图片上测量并写入缓存
     
-    # 去重
-    images = list(set(images))
-    return sorted(images)
+    Returns:
+        批大小；样本不可用时返回None
+    """
+    key = f"{vectorizer.server_url}|{vectorizer.get_embedding_dimension()}"
+    try:
+        tuned = json.loads(AUTOTUNE_CACHE_PATH.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        tuned = {}
+    if key in tuned:
+        print(f"✓ 使用缓存的调优批大小: {tuned[key]}")
+        return tuned[key]
+    
+    _, sample_inputs = _load_image_inputs(sample_paths, executor)
+    if not sample_inputs:
+        return None
+    
+    print(f"⏱️ 在 {len(sample_inputs)} 张样本图片上测量最佳批大小...")
+    tuned[key] = vectorizer.autotune_batch_size(sample_inputs, is_image=True)
+    print(f"✓ 最佳批大小: {tuned[key]}")
+    try:
+        AUTOTUNE_CACHE_PATH.write_text(json.dumps(tuned, indent=2), encoding='utf-8')
+    except OSError as e:
+        print(f"⚠️ 无法保存调优结果: {e}")
+    return tuned[key]
 
 
 def upload_images(image_dir: str,
                   vectorizer: CLIPVectorizer,
                   milvus_store: MilvusStore,
                   batch_size: int = 32,
-                  recursive: bool = True):
+                  recursive: bool = True,
+                  preprocess_workers: Optional[int] = None,
+                  sort_paths: bool = False,
+                  autotune: bool = False):
     """
     将图片文件夹上传到Milvus
     
@@ -82,53 +222,165 @@ def upload_images(image_dir: str,
         milvus_store: Milvus存储
         batch_size: 批处理大小
         recursive: 是否递归搜索
+        preprocess_workers: 并行预处理图片的进程数，None 表示CPU核数，0 表示不预处理、直接发送原图
+        sort_paths: 是否按路径排序后再上传（需要确定的上传顺序时使用，如断点续传）
+        autotune: 是否在样本图片上测量并使用吞吐量最高的批大小（结果按CLIP服务器缓存）
     """
     print(f"\n📁 扫描目录: {image_dir}")
     images = collect_images(image_dir, recursive)
+    if sort_paths:
+        # 排序需要先扫描完整个目录
+        images = iter(sorted(images))
     
-    if not images:
+    # 先取出开头的一部分：判断目录是否为空，并作为自动调优的样本；其余路径在上传过程中边扫描边读取
+    head = list(itertools.islice(images, 64))
+    if not head:
         print(f"⚠️ 未找到支持的图片文件 (支持格式: {', '.join(SUPPORTED_FORMATS)})")
         return
-    
-    print(f"✓ 找到 {len(images)} 张图片")
     print("=" * 60)
     
-    # 分批处理
-    for i in tqdm(range(0, len(images), batch_size), desc="上传图片"):
-        batch_paths = images[i:i + batch_size]
-        
-        # 将图片路径转为字符串
-        str_paths = [str(p) for p in batch_paths]
-        
+    executor = ProcessPoolExecutor(max_workers=preprocess_workers) if preprocess_workers != 0 else None
+    try:
+        if autotune:
+            batch_size = _autotuned_batch_size(vectorizer, head, executor) or batch_size
+            vectorizer.batch_size = batch_size
+        num_images = _upload_batches(itertools.chain(head, images), image_dir,
+                                     vectorizer, milvus_store, batch_size, executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    
+    print(f"\n✓ 图片上传完成! 共处理 {num_images} 张图片")
+
+
+_PIPELINE_DONE = object()  # 流水线各阶段之间的结束标记
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """向有界队列放入元素，下游已停止时放弃等待并返回False"""
+    while not stop.is_set():
         try:
-            # 向量化图片
-            embeddings = vectorizer.encode_images(str_paths, show_progress=False)
-            
-            # 存储到Milvus
-            milvus_store.insert_images(
-                image_paths=str_paths,
-                embeddings=embeddings,
-                file_path=image_dir,
-                file_type="image_folder",
-                metadata={"source_dir": image_dir}
-            )
-        except Exception as e:
-            print(f"\n⚠️ 批次处理失败: {e}")
-            # 尝试逐个处理
-            for path in str_paths:
-                try:
-                    emb = vectorizer.encode_images([path], show_progress=False)
-                    milvus_store.insert_images(
-                        image_paths=[path],
-                        embeddings=emb,
-                        file_path=image_dir,
-                        file_type="image_folder",
-                        metadata={"source_dir": image_dir}
-                    )
-                except Exception as e2:
-                    print(f"  ✗ 跳过图片 {path}: {e2}")
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    """从队列取出元素，下游已停止时返回结束标记"""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _PIPELINE_DONE
+
+
+def _upload_batches(images: Iterable[Path],
+                    image_dir: str,
+                    vectorizer: CLIPVectorizer,
+                    milvus_store: MilvusStore,
+                    batch_size: int,
+                    executor: Optional[Executor]) -> int:
+    """
+    以三段流水线分批读取、向量化并写入图片
+    
+    读取线程从 images 中按批取出路径（目录扫描也在该线程中随之推进）并预取图片，
+    编码线程调用CLIP服务器，主线程写入Milvus，
+    各阶段之间用容量为2的队列衔接，使目录扫描、磁盘读取、CLIP编码和Milvus写入相互重叠
     
-    print(f"\n✓ 图片上传完成!")
+    Returns:
+        处理的图片数量
+    """
+    import numpy as np
+    
+    to_encode = queue.Queue(maxsize=2)
+    to_insert = queue.Queue(maxsize=2)
+    stop = threading.Event()
+    
+    def load_stage():
+        try:
+            paths = iter(images)
+            while batch_paths := list(itertools.islice(paths, batch_size)):
+                # 每张图片只从磁盘读取一次
+                str_paths, image_inputs = _load_image_inputs(batch_paths, executor)
+                if not _put(to_encode, (len(batch_paths), str_paths, image_inputs), stop):
+                    return
+        finally:
+            _put(to_encode, _PIPELINE_DONE, stop)
+    
+    def encode_stage():
+        try:
+            while True:
+                item = _get(to_encode, stop)
+                if item is _PIPELINE_DONE:
+                    return
+                num_images, str_paths, image_inputs = item
+                embeddings = None
+                if str_paths:
+                    try:
+                        embeddings = vectorizer.encode_images(image_inputs, show_progress=False)
+                    except Exception as e:
+                        print(f"\n⚠️ 批次向量化失败: {e}")
+                        # 尝试逐个处理（复用已读取的图片数据）
+                        kept_paths, kept_embeddings = [], []
+                        for path, image_input in zip(str_paths, image_inputs):
+                            try:
+                                kept_embeddings.append(
+                                    vectorizer.encode_images([image_input], show_progress=False)[0])
+                                kept_paths.append(path)
+                            except Exception as e2:
+                                print(f"  ✗ 跳过图片 {path}: {e2}")
+                        str_paths = kept_paths
+                        embeddings = np.stack(kept_embeddings) if kept_embeddings else None
+                if not _put(to_insert, (num_images, str_paths, embeddings), stop):
+                    return
+        finally:
+            _put(to_insert, _PIPELINE_DONE, stop)
+    
+    def insert(paths, embeddings):
+        milvus_store.insert_images(
+            image_paths=paths,
+            embeddings=embeddings,
+            file_path=image_dir,
+            file_type="image_folder",
+            metadata={"source_dir": image_dir},
+            auto_flush=False
+        )
+    
+    # 图片总数在扫描结束前未知，进度条只显示已处理的数量和速度
+    with ThreadPoolExecutor(max_workers=2) as stages, tqdm(
+            desc="上传图片", unit="张", mininterval=0.5, smoothing=0.1) as pbar:
+        futures = [stages.submit(load_stage), stages.submit(encode_stage)]
+        try:
+            while True:
+                item = to_insert.get()
+                if item is _PIPELINE_DONE:
+                    break
+                num_images, str_paths, embeddings = item
+                if embeddings is not None:
+                    try:
+                        # 存储到Milvus
+                        insert(str_paths, embeddings)
+                    except Exception as e:
+                        print(f"\n⚠️ 批次写入失败: {e}")
+                        for path, embedding in zip(str_paths, embeddings):
+                            try:
+                                insert([path], embedding[None, :])
+                            except Exception as e2:
+                                print(f"  ✗ 跳过图片 {path}: {e2}")
+                pbar.update(num_images)
+        finally:
+            stop.set()
+        
+        # 读取或编码阶段的异常在这里重新抛出
+        for future in futures:
+            future.result()
+    
+    # 所有批次插入完成后统一flush一次
+    milvus_store.flush()
+    return pbar.n
 
 
 def search_images(query_text: str,
@@ -149,9 +401,6 @@ def search_images(query_text: str,
     Returns:
         搜索结果列表
     """
-    print(f"\n🔍 搜索: {query_text}")
-    print("=" * 60)
-    
     # 将文本转为向量
     query_vector = vectorizer.encode_texts([query_text], show_progress=False)
     
@@ -162,67 +411,149 @@ def search_images(query_text: str,
         limit=limit
     )
     
+    return _show_image_results(query_text, results, milvus_store, show_images)
+
+
+def _show_image_results(query_text: str,
+                        results: List[dict],
+                        milvus_store: MilvusStore,
+                        show_images: bool) -> List[dict]:
+    """打印（并可选显示）一个查询的搜索结果"""
+    print(f"\n🔍 搜索: {query_text}")
+    print("=" * 60)
+    
     if not results:
         print("未找到匹配的图片")
         return []
     
     print(f"\n找到 {len(results)} 张相关图片:\n")
     
-    for i, result in enumerate(results, 1):
-        image_path = result['content']
-        distance = result['distance']
-        # L2距离越小越相似，转换为相似度分数
-        similarity = 1 / (1 + distance)
-        
-        print(f"[{i}] 相似度: {similarity:.4f}")
-        print(f"    路径: {image_path}")
-        
-        if show_images:
-            try:
-                from PIL import Image
-                import matplotlib.pyplot as plt
-                
-                if Path(image_path).exists():
-                    img = Image.open(image_path)
-                    plt.figure(figsize=(8, 8))
-                    plt.imshow(img)
-                    plt.title(f"#{i} 相似度: {similarity:.4f}\n{Path(image_path).name}")
-                    plt.axis('off')
-                    plt.show()
-            except ImportError:
-                print("    (需要安装 matplotlib 才能显示图片: pip install matplotlib)")
-            except Exception as e:
-                print(f"    ⚠️ 无法显示图片: {e}")
-        print()
+    # 一次性把所有距离转换为相似度分数（L2距离越小越相似）
+    similarities = milvus_store.similarities(results)
+    
+    # 先写入缓冲区，最后一次性输出，避免每行一次stdout写入
+    buffer = io.StringIO()
+    for i, (result, similarity) in enumerate(zip(results, similarities), 1):
+        buffer.write(f"[{i}] 相似度: {similarity:.4f}\n    路径: {result['content']}\n\n")
+    sys.stdout.write(buffer.getvalue())
+    
+    if show_images:
+        _show_image_grid(results, similarities)
     
     return results
 
 
+def _show_image_grid(results: List[dict],
+                     similarities: np.ndarray,
+                     ncols: int = 4,
+                     thumb_size: int = 400):
+    """
+    把所有结果图片放进同一个网格图中，只调用一次 plt.show()
+    
+    Args:
+        results: 搜索结果列表
+        similarities: 与results对应的相似度分数
+        ncols: 每行显示的图片数
+        thumb_size: 缩略图的最大边长
+    """
+    try:
+        from PIL import Image
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("    (需要安装 matplotlib 才能显示图片: pip install matplotlib)")
+        return
+    
+    ncols = min(ncols, len(results))
+    nrows = -(-len(results) // ncols)
+    fig, axes = plt.subplots(nrows, ncols, figsize=(4 * ncols, 4 * nrows), squeeze=False)
+    
+    for i, ax in enumerate(axes.flat):
+        ax.axis('off')
+        if i >= len(results):
+            continue
+        image_path = results[i]['content']
+        try:
+            with Image.open(image_path) as img:
+                # JPEG在解码时直接按比例缩小，只解码显示所需的分辨率
+                img.draft('RGB', (thumb_size, thumb_size))
+                img.thumbnail((thumb_size, thumb_size))
+                ax.imshow(img)
+            ax.set_title(f"#{i + 1} 相似度: {similarities[i]:.4f}\n{Path(image_path).name}")
+        except Exception as e:
+            print(f"    ⚠️ 无法显示图片 {image_path}: {e}")
+    
+    fig.tight_layout()
+    plt.show()
+
+
 def interactive_search(vectorizer: CLIPVectorizer,
                        milvus_store: MilvusStore,
-                       show_images: bool = False):
+                       show_images: bool = False,
+                       limit: int = 5,
+                       max_batch: int = 8,
+                       batch_timeout: float = 0.05):
     """
     交互式搜索模式
+    
+    Args:
+        vectorizer: CLIP向量化器
+        milvus_store: Milvus存储
+        show_images: 是否显示图片
+        limit: 每个查询返回的结果数量
+        max_batch: 最多合并多少个查询一起编码和检索
+        batch_timeout: 等待后续查询加入同一批的时间（秒）
     """
     print("\n" + "=" * 60)
     print("🎯 交互式图片搜索")
     print("输入描述来搜索图片，输入 'q' 或 'quit' 退出")
     print("=" * 60)
     
-    while True:
-        try:
-            query = input("\n🔍 请输入搜索描述 > ").strip()
+    # 读取线程把查询放入队列，主线程把短时间内积压的查询合并成一批，
+    # 一次编码、一次向量检索，再按查询分别输出结果
+    queries = queue.Queue()
+    
+    def read_queries():
+        while True:
+            try:
+                query = input("\n🔍 请输入搜索描述 > ").strip()
+            except (EOFError, KeyboardInterrupt):
+                break
             if query.lower() in ['q', 'quit', 'exit', '退出']:
-                print("再见！")
                 break
-            if not query:
+            if query:
+                queries.put(query)
+        queries.put(_PIPELINE_DONE)
+    
+    threading.Thread(target=read_queries, daemon=True).start()
+    
+    try:
+        done = False
+        while not done:
+            batch = [queries.get()]
+            while len(batch) < max_batch:
+                try:
+                    batch.append(queries.get(timeout=batch_timeout))
+                except queue.Empty:
+                    break
+            if _PIPELINE_DONE in batch:
+                done = True
+                batch = batch[:batch.index(_PIPELINE_DONE)]
+            if not batch:
                 continue
             
-            search_images(query, vectorizer, milvus_store, limit=5, show_images=show_images)
-            
-        except KeyboardInterrupt:
-            print("\n再见！")
-            break
+            try:
+                # 重复的查询命中向量化器的LRU缓存（以及 --embedding-cache 的持久化缓存），不会再请求CLIP服务器
+                query_vectors = vectorizer.encode_texts(batch, show_progress=False)
+                results = milvus_store.search_batch(query_vectors=query_vectors, content_type="image", limit=limit)
+            except Exception as e:
+                print(f"\n⚠️ 搜索失败: {e}")
+                continue
+            for query, query_results in zip(batch, results):
+                _show_image_results(query, query_results, milvus_store, show_images)
+    except KeyboardInterrupt:
+        print()
+    
+    print("再见！")
 
 
 def main():
@@ -259,6 +590,10 @@ def main():
                         default=os.getenv('CLIP_SERVER', 'grpc://0.0.0.0:51000'),
                         help='CLIP服务器地址 (默认: grpc://0.0.0.0:51000)')
     
+    parser.add_argument('--embedding-cache', type=str,
+                        default=os.getenv('EMBEDDING_CACHE_PATH'),
+                        help='sqlite向量缓存文件路径，重复的查询和内容跨多次运行复用已编码的向量')
+    
     parser.add_argument('--milvus-host', type=str,
                         default=os.getenv('MILVUS_HOST', 'localhost'),
                         help='Milvus服务器地址 (默认: localhost)')
@@ -283,9 +618,22 @@ def main():
     parser.add_argument('--no-recursive', action='store_true',
                         help='不递归搜索子目录')
     
+    parser.add_argument('--autotune', action='store_true',
+                        help='上传前在样本图片上自动选择吞吐量最高的批大小')
+    
+    parser.add_argument('--sorted', action='store_true',
+                        help='按路径排序后再上传')
+    
+    parser.add_argument('--preprocess-workers', type=int, default=None,
+                        help='并行预处理图片的进程数 (默认: CPU核数，0 表示直接发送原图)')
+    
     parser.add_argument('--drop-collection', action='store_true',
                         help='删除已存在的集合并重建')
     
+    parser.add_argument('--vector-dtype', type=str, choices=['float32', 'float16'],
+                        default=os.getenv('VECTOR_DTYPE', 'float32'),
+                        help='新建集合时向量的存储精度，float16需要Milvus 2.4+ (默认: float32)')
+    
     args = parser.parse_args()
     
     # 初始化组件
@@ -293,18 +641,22 @@ def main():
     print("=" * 60)
     
     try:
+        from clip.vectorizer import CLIPVectorizer
+        from milvus.milvus_store import get_store
+        
         # 初始化CLIP向量化器
-        vectorizer = CLIPVectorizer(server_url=args.clip_server)
+        vectorizer = CLIPVectorizer(server_url=args.clip_server, cache_path=args.embedding_cache)
         embedding_dim = vectorizer.get_embedding_dimension()
         print(f"✓ CLIP服务器连接成功，向量维度: {embedding_dim}")
         
         # 初始化Milvus存储
-        milvus_store = MilvusStore(
+        milvus_store = get_store(
             host=args.milvus_host,
             port=args.milvus_port,
             collection_name=args.collection,
             embedding_dim=embedding_dim,
-            drop_existing=args.drop_collection
+            drop_existing=args.drop_collection,
+            vector_dtype=args.vector_dtype
         )
         
         stats = milvus_store.get_stats()
@@ -324,7 +676,10 @@ def main():
             vectorizer=vectorizer,
             milvus_store=milvus_store,
             batch_size=args.batch_size,
-            recursive=not args.no_recursive
+            recursive=not args.no_recursive,
+            preprocess_workers=args.preprocess_workers,
+            sort_paths=args.sorted,
+            autotune=args.autotune
         )
         stats = milvus_store.get_stats()
         print(f"\n✓ 完成! 当前集合实体数: {stats['num_entities']}")
@@ -47,8 +47,9 @@ def example_basic_usage(file_path: str, query_text: str = "CLIP"):
         print(f"\n找到 {len(results)} 个结果:")
         for i, r in enumerate(results, 1):
             content = r['content'][:150] + "..." if len(r['content']) > 150 else r['content']
-            similarity = 1 / (1 + r['distance'])
-            print(f"\n[{i}] 相似度: {similarity:.4f}")
+            # distance 是混合检索的融合得分（默认为RRF得分），只用于排序，不是余弦相似度
+            score = r['distance']
+            print(f"\n[{i}] 得分: {score:.4f}")
             print(f"    文件: {r['file_path']}")
             print(f"    内容: {content}")
     
@@ -95,8 +96,8 @@ def example_add_and_search():
             if results:
                 for i, r in enumerate(results, 1):
                     content = r['content'][:200] + "..." if len(r['content']) > 200 else r['content']
-                    similarity = 1 / (1 + r['distance'])
-                    print(f"\n[{i}] 相似度: {similarity:.4f}")
+                    score = r['distance']
+                    print(f"\n[{i}] 得分: {score:.4f}")
                     print(f"    {content}")
             else:
                 print("未找到相关结果")
@@ -155,8 +156,8 @@ def example_pure_vector_search():
     print(f"\n找到 {len(results)} 个结果:")
     for i, r in enumerate(results, 1):
         content = r['content'][:150] + "..." if len(r['content']) > 150 else r['content']
-        similarity = 1 / (1 + r['distance'])
-        print(f"\n[{i}] 相似度: {similarity:.4f}")
+        score = r['distance']
+        print(f"\n[{i}] 得分: {score:.4f}")
         print(f"    {content}")
 
 
@@ -1,28 +1,205 @@
 """
 主程序：将Word和Markdown文件向量化并存储到Milvus
 """
+from __future__ import annotations
+
+import io
 import os
 import sys
+import hashlib
 from pathlib import Path
-from typing import List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional
 import argparse
 from tqdm import tqdm
 from dotenv import load_dotenv
 
-from file_parsers.file_parser import FileParserFactory, ExtractedContent
-from clip.vectorizer import CLIPVectorizer
-from milvus.milvus_store import MilvusStore
+
+# 文件解析器、CLIP（clip_client / grpc）和Milvus（pymilvus）客户端导入较慢，在 main() 解析完参数后才导入，
+# 这样 --help 等不需要它们的调用可以快速返回
+if TYPE_CHECKING:
+    from file_parsers.file_parser import FileParserFactory
+    from clip.vectorizer import CLIPVectorizer
+    from milvus.milvus_store import MilvusStore
 
 
 # 加载环境变量
 load_dotenv()
 
 
+def file_content_hash(file_path: str) -> str:
+    """计算文件内容的哈希（分块读取，不把整个文件载入内存）"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BatchAccumulator:
+    """跨文件累积待向量化的文本块和图像，攒够一批后统一编码，再按来源文件分别写入Milvus"""
+    
+    def __init__(self,
+                 vectorizer: CLIPVectorizer,
+                 milvus_store: MilvusStore,
+                 batch_size: int = 256):
+        """
+        初始化批量累积器
+        
+        Args:
+            vectorizer: CLIP向量化器
+            milvus_store: Milvus存储
+            batch_size: 累积到多少个文本块（或图像）时触发一次编码
+        """
+        self.vectorizer = vectorizer
+        self.milvus_store = milvus_store
+        self.batch_size = batch_size
+        # 每种内容类型待处理的 (file_path, file_type, metadata, items) 列表及其条目总数
+        self._pending = {'text': [], 'image': []}
+        self._counts = {'text': 0, 'image': 0}
+        # 尚未全部写入的文件：{file_path: [剩余条目数, 旧数据主键, 已插入的新数据主键, 是否失败]}
+        self._files = {}
+    
+    def add_file(self, file_path: str, file_type: str, metadata: Dict, texts, images, old_ids=()):
+        """
+        加入一个文件的文本块和图像
+        
+        文件的全部内容写入成功后删除 old_ids 对应的旧数据；任一部分编码或写入失败时，
+        删除已写入的新数据并保留旧数据，下次运行时重新处理该文件
+        
+        Args:
+            file_path: 来源文件路径
+            file_type: 文件类型
+            metadata: 文件元数据
+            texts: 文本块列表
+            images: ImagesSoA
+            old_ids: 该文件在集合中已有的旧数据主键
+        """
+        entries = [(kind, items) for kind, items in (('text', texts), ('image', images)) if len(items)]
+        self._files[file_path] = [max(len(entries), 1), list(old_ids), [], False]
+        if not entries:
+            # 文件已没有内容，旧数据直接删除
+            self._finish(file_path)
+        for kind, items in entries:
+            self._pending[kind].append((file_path, file_type, metadata, items))
+            self._counts[kind] += len(items)
+        for kind, _ in entries:
+            if self._counts[kind] >= self.batch_size:
+                self._flush_kind(kind)
+    
+    def flush(self):
+        """编码并写入所有待处理的内容，最后统一flush一次Milvus"""
+        for kind in self._pending:
+            self._flush_kind(kind)
+        self.milvus_store.flush()
+    
+    def _flush_kind(self, kind: str):
+        """一次编码某种类型的全部待处理内容，按记录的偏移切分向量后逐文件插入"""
+        entries = self._pending[kind]
+        if not entries:
+            return
+        self._pending[kind] = []
+        self._counts[kind] = 0
+        
+        try:
+            if kind == 'text':
+                all_items = [text for _, _, _, texts in entries for text in texts]
+            else:
+                from file_parsers.file_parser import ImagesSoA
+                
+                all_items = ImagesSoA()
+                for _, _, _, images in entries:
+                    all_items.paths.extend(images.paths)
+                    all_items.formats.extend(images.formats)
+                    all_items.binaries.extend(images.binaries)
+                    all_items.alts.extend(images.alts)
+            embeddings = self._encode(kind, all_items)
+        except Exception as e:
+            # 整批失败时逐个文件重试，只跳过自身无法编码的文件
+            print(f"  ⚠️  批量向量化失败（{len(entries)} 个文件），逐个文件重试: {e}")
+            self._encode_each(kind, entries)
+            return
+        
+        offset = 0
+        for file_path, file_type, metadata, items in entries:
+            file_embeddings = embeddings[offset:offset + len(items)]
+            offset += len(items)
+            self._insert(kind, file_path, file_type, metadata, items, file_embeddings)
+    
+    def _encode(self, kind: str, items):
+        """编码文本块列表或 ImagesSoA"""
+        if kind == 'text':
+            return self.vectorizer.encode_texts(items, show_progress=False)
+        return self.vectorizer.encode_images(items, show_progress=False)
+    
+    def _encode_each(self, kind: str, entries: List):
+        """逐个文件编码并写入，编码失败的文件跳过"""
+        for file_path, file_type, metadata, items in entries:
+            try:
+                file_embeddings = self._encode(kind, items)
+            except Exception as e:
+                print(f"  ✗ 向量化文件 {file_path} 失败，已跳过: {e}")
+                self._finish(file_path, failed=True)
+                continue
+            self._insert(kind, file_path, file_type, metadata, items, file_embeddings)
+    
+    def _insert(self, kind: str, file_path: str, file_type: str, metadata: Dict, items, file_embeddings):
+        """写入一个文件的文本块或图像向量"""
+        try:
+            if kind == 'text':
+                primary_keys = self.milvus_store.insert_texts(
+                    texts=items,
+                    embeddings=file_embeddings,
+                    file_path=file_path,
+                    file_type=file_type,
+                    metadata=metadata,
+                    auto_flush=False
+                )
+            else:
+                primary_keys = self.milvus_store.insert_images(
+                    image_paths=items.paths,
+                    embeddings=file_embeddings,
+                    file_path=file_path,
+                    file_type=file_type,
+                    metadata=metadata,
+                    auto_flush=False
+                )
+        except Exception as e:
+            print(f"  ✗ 写入文件 {file_path} 的向量时出错: {e}")
+            self._finish(file_path, failed=True)
+            return
+        self._files[file_path][2].extend(primary_keys)
+        self._finish(file_path)
+    
+    def _finish(self, file_path: str, failed: bool = False):
+        """文件的一个条目处理结束；全部结束后删除旧数据，或在失败时撤销已写入的新数据"""
+        state = self._files[file_path]
+        state[0] -= 1
+        state[3] = state[3] or failed
+        if state[0] > 0:
+            return
+        del self._files[file_path]
+        
+        _, old_ids, new_ids, failed = state
+        try:
+            if failed:
+                if new_ids:
+                    self.milvus_store.delete_ids(new_ids)
+                if old_ids:
+                    print(f"  ⚠️  文件 {file_path} 未能完整写入，保留旧数据")
+            elif old_ids:
+                self.milvus_store.delete_ids(old_ids)
+        except Exception as e:
+            print(f"  ✗ 删除文件 {file_path} 的{'新' if failed else '旧'}数据时出错: {e}")
+
+
 def process_file(file_path: str,
                  parser_factory: FileParserFactory,
                  vectorizer: CLIPVectorizer,
                  milvus_store: MilvusStore,
-                 batch_size: int = 10):
+                 batch_size: int = 10,
+                 accumulator: Optional[BatchAccumulator] = None,
+                 file_hash: Optional[str] = None,
+                 old_ids: Optional[List[int]] = None):
     """
     处理单个文件
     
@@ -32,6 +209,9 @@ def process_file(file_path: str,
         vectorizer: CLIP向量化器
         milvus_store: Milvus存储
         batch_size: 批处理大小
+        accumulator: 批量累积器；提供时只解析文件并把内容加入累积器，由其统一编码和写入
+        file_hash: 文件内容哈希，未提供时自动计算；随向量一起写入，供后续运行跳过未变化的文件
+        old_ids: 该文件旧版本数据的主键，新数据全部写入后删除；处理失败时保留
     """
     print(f"\n处理文件: {file_path}")
     print("-" * 60)
@@ -40,10 +220,18 @@ def process_file(file_path: str,
         # 解析文件
         parser = parser_factory.get_parser(file_path)
         extracted = parser.parse(file_path)
+        extracted.metadata['file_hash'] = file_hash or file_content_hash(file_path)
         
         print(f"  提取到 {len(extracted.text_chunks)} 个文本块")
         print(f"  提取到 {len(extracted.images)} 个图像")
         
+        if accumulator is not None:
+            file_type = extracted.metadata['file_type']
+            accumulator.add_file(file_path, file_type, extracted.metadata,
+                                 extracted.text_chunks, extracted.images, old_ids or ())
+            print(f"  ✓ 已加入批量队列")
+            return
+        
         # 向量化文本
         if extracted.text_chunks:
             print("  向量化文本...")
@@ -70,7 +258,7 @@ def process_file(file_path: str,
             )
             
             # 提取图像路径
-            image_paths = [img['path'] for img in extracted.images]
+            image_paths = extracted.images.paths
             
             # 存储图像向量
             milvus_store.insert_images(
@@ -81,6 +269,10 @@ def process_file(file_path: str,
                 metadata=extracted.metadata
             )
         
+        # 新数据写入后再删除旧版本
+        if old_ids:
+            milvus_store.delete_ids(old_ids)
+        
         print(f"  ✓ 文件处理完成")
         
     except Exception as e:
@@ -94,7 +286,9 @@ def process_directory(directory: str,
                      vectorizer: CLIPVectorizer,
                      milvus_store: MilvusStore,
                      file_extensions: List[str] = ['.docx', '.md', '.markdown'],
-                     recursive: bool = True):
+                     recursive: bool = True,
+                     encode_batch_size: int = 256,
+                     skip_existing: bool = True):
     """
     处理目录中的所有文件
     
@@ -105,6 +299,9 @@ def process_directory(directory: str,
         milvus_store: Milvus存储
         file_extensions: 支持的文件扩展名列表
         recursive: 是否递归处理子目录
+        encode_batch_size: 跨文件累积多少个块后统一向量化一次
+        skip_existing: 是否跳过以相同路径和内容哈希入库过的文件；需要处理的文件在集合中已有数据时
+            （如内容已修改），新数据写入成功后再删除旧数据
     """
     directory_path = Path(directory)
     
@@ -120,22 +317,53 @@ def process_directory(directory: str,
     else:
         for ext in file_extensions:
             files.extend(directory_path.glob(f"*{ext}"))
+    # 扩展名列表有重叠时（或大小写不敏感的文件系统上）同一文件可能被匹配多次，按首次出现的顺序去重
+    files = list(dict.fromkeys(files))
     
     if not files:
         print(f"在目录 {directory} 中未找到支持的文件")
         return
     
+    # 按内容哈希跳过已经入库且未变化的文件
+    file_hashes = {}
+    for file_path in files:
+        try:
+            file_hashes[file_path] = file_content_hash(str(file_path))
+        except OSError as e:
+            print(f"  ✗ 无法读取文件 {file_path}: {e}")
+    if skip_existing:
+        unchanged = milvus_store.unchanged_file_paths({str(path): h for path, h in file_hashes.items()})
+        file_hashes = {path: h for path, h in file_hashes.items() if str(path) not in unchanged}
+        if unchanged:
+            print(f"跳过 {len(unchanged)} 个未变化的已入库文件")
+    files = list(file_hashes)
+    
+    if not files:
+        print("没有需要处理的文件")
+        return
+    
+    # 已入库文件的旧版本数据：新数据写入成功后再删除，避免检索时新旧版本同时出现，处理失败时也不会丢失数据
+    old_ids = milvus_store.file_row_ids([str(file_path) for file_path in files])
+    if old_ids:
+        print(f"{len(old_ids)} 个已入库文件将重新入库，写入后替换旧数据")
+    
     print(f"\n找到 {len(files)} 个文件需要处理")
     print("=" * 60)
     
-    # 处理每个文件
-    for file_path in tqdm(files, desc="处理文件"):
+    # 处理每个文件：小文件的块跨文件累积后批量向量化，减少对CLIP服务器的请求次数
+    accumulator = BatchAccumulator(vectorizer, milvus_store, batch_size=encode_batch_size)
+    for file_path in tqdm(files, desc="处理文件", mininterval=0.5,
+                          miniters=max(1, len(files) // 200), smoothing=0.1):
         process_file(
             str(file_path),
             parser_factory,
             vectorizer,
-            milvus_store
+            milvus_store,
+            accumulator=accumulator,
+            file_hash=file_hashes[file_path],
+            old_ids=old_ids.get(str(file_path))
         )
+    accumulator.flush()
     
     print(f"\n✓ 所有文件处理完成")
 
@@ -170,17 +398,67 @@ def search(query_text: str,
     
     # 显示结果
     print(f"\n找到 {len(results)} 个结果:\n")
-    for i, result in enumerate(results, 1):
-        print(f"结果 {i}:")
-        print(f"  相似度: {result['distance']:.4f}")
-        print(f"  类型: {result['content_type']}")
-        print(f"  文件: {result['file_path']}")
+    similarities = milvus_store.similarities(results)
+    # 先写入缓冲区，最后一次性输出，避免每行一次stdout写入
+    buffer = io.StringIO()
+    for i, (result, similarity) in enumerate(zip(results, similarities), 1):
+        buffer.write(f"结果 {i}:\n")
+        buffer.write(f"  相似度: {similarity:.4f}\n")
+        buffer.write(f"  类型: {result['content_type']}\n")
+        buffer.write(f"  文件: {result['file_path']}\n")
         if result['content_type'] == 'text':
             content = result['content'][:200] + "..." if len(result['content']) > 200 else result['content']
-            print(f"  内容: {content}")
+            buffer.write(f"  内容: {content}\n")
         else:
-            print(f"  图像路径: {result['content']}")
-        print()
+            buffer.write(f"  图像路径: {result['content']}\n")
+        buffer.write("\n")
+    sys.stdout.write(buffer.getvalue())
+
+
+def serve(parser_factory: FileParserFactory,
+          vectorizer: CLIPVectorizer,
+          milvus_store: MilvusStore,
+          content_type: Optional[str] = None,
+          limit: int = 10,
+          recursive: bool = True):
+    """
+    常驻模式：从标准输入逐行读取命令，复用已初始化的CLIP和Milvus连接
+    
+    支持的命令:
+        search <查询文本>
+        file <文件路径>
+        dir <目录路径>
+        quit / exit
+    
+    Args:
+        parser_factory: 文件解析器工厂
+        vectorizer: CLIP向量化器
+        milvus_store: Milvus存储
+        content_type: 搜索时的内容类型筛选
+        limit: 搜索结果数量
+        recursive: 处理目录时是否递归
+    """
+    print("\n常驻模式已启动，命令: search <文本> | file <路径> | dir <路径> | quit")
+    
+    for line in sys.stdin:
+        command, _, argument = line.strip().partition(' ')
+        argument = argument.strip()
+        if not command:
+            continue
+        if command in ('quit', 'exit'):
+            break
+        
+        if not argument:
+            print(f"✗ 命令缺少参数: {command}")
+        elif command == 'search':
+            search(argument, vectorizer, milvus_store, content_type=content_type, limit=limit)
+        elif command == 'file':
+            process_file(argument, parser_factory, vectorizer, milvus_store)
+        elif command == 'dir':
+            process_directory(argument, parser_factory, vectorizer, milvus_store, recursive=recursive)
+        else:
+            print(f"✗ 未知命令: {command}")
+        sys.stdout.flush()
 
 
 def main():
@@ -198,6 +476,9 @@ def main():
   # 搜索
   python main.py --search "查询文本"
   
+  # 常驻模式：初始化一次，从标准输入读取多条命令
+  python main.py --serve
+  
   # 指定CLIP服务器地址
   python main.py --file document.docx --clip-server grpc://localhost:51000
         """
@@ -208,12 +489,17 @@ def main():
     input_group.add_argument('--file', type=str, help='处理单个文件')
     input_group.add_argument('--dir', type=str, help='处理目录中的所有文件')
     input_group.add_argument('--search', type=str, help='搜索模式')
+    input_group.add_argument('--serve', action='store_true', help='常驻模式，从标准输入读取命令')
     
     # 配置选项
     parser.add_argument('--clip-server', type=str,
                        default=os.getenv('CLIP_SERVER', 'grpc://0.0.0.0:51000'),
                        help='CLIP服务器地址 (默认: grpc://0.0.0.0:51000)')
     
+    parser.add_argument('--embedding-cache', type=str,
+                       default=os.getenv('EMBEDDING_CACHE_PATH'),
+                       help='sqlite向量缓存文件路径，重复的查询和内容跨多次运行复用已编码的向量')
+    
     parser.add_argument('--milvus-host', type=str,
                        default=os.getenv('MILVUS_HOST', 'localhost'),
                        help='Milvus服务器地址 (默认: localhost)')
@@ -233,6 +519,10 @@ def main():
     parser.add_argument('--drop-collection', action='store_true',
                        help='删除已存在的集合并重建')
     
+    parser.add_argument('--vector-dtype', type=str, choices=['float32', 'float16'],
+                       default=os.getenv('VECTOR_DTYPE', 'float32'),
+                       help='新建集合时向量的存储精度，float16需要Milvus 2.4+ (默认: float32)')
+    
     parser.add_argument('--content-type', type=str, choices=['text', 'image'],
                        help='搜索时筛选内容类型')
     
@@ -242,6 +532,9 @@ def main():
     parser.add_argument('--no-recursive', action='store_true',
                        help='不递归处理子目录')
     
+    parser.add_argument('--reindex', action='store_true',
+                       help='处理目录时不跳过内容未变化的已入库文件')
+    
     args = parser.parse_args()
     
     # 初始化组件
@@ -249,18 +542,23 @@ def main():
     print("=" * 60)
     
     try:
+        from file_parsers.file_parser import FileParserFactory
+        from clip.vectorizer import CLIPVectorizer
+        from milvus.milvus_store import get_store
+        
         # 初始化CLIP向量化器
-        vectorizer = CLIPVectorizer(server_url=args.clip_server)
+        vectorizer = CLIPVectorizer(server_url=args.clip_server, cache_path=args.embedding_cache)
         embedding_dim = vectorizer.get_embedding_dimension()
         print(f"✓ 向量维度: {embedding_dim}")
         
         # 初始化Milvus存储
-        milvus_store = MilvusStore(
+        milvus_store = get_store(
             host=args.milvus_host,
             port=args.milvus_port,
             collection_name=args.collection,
             embedding_dim=embedding_dim,
-            drop_existing=args.drop_collection
+            drop_existing=args.drop_collection,
+            vector_dtype=args.vector_dtype
         )
         
         # 获取统计信息
@@ -278,7 +576,17 @@ def main():
         sys.exit(1)
     
     # 执行操作
-    if args.search:
+    if args.serve:
+        serve(
+            parser_factory=parser_factory,
+            vectorizer=vectorizer,
+            milvus_store=milvus_store,
+            content_type=args.content_type,
+            limit=args.limit,
+            recursive=not args.no_recursive
+        )
+    
+    elif args.search:
         # 搜索模式
         search(
             query_text=args.search,
@@ -308,7 +616,8 @@ def main():
             parser_factory=parser_factory,
             vectorizer=vectorizer,
             milvus_store=milvus_store,
-            recursive=not args.no_recursive
+            recursive=not args.no_recursive,
+            skip_existing=not args.reindex
         )
         
         # 显示统计信息
@@ -3,28 +3,116 @@
 """
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Tuple, Union
 import argparse
+import numpy as np
 from tqdm import tqdm
 from dotenv import load_dotenv
 
 from file_parsers.hierarchical_parser import (
-    HierarchicalWordParser,
-    HierarchicalMarkdownParser,
-    HierarchicalContent
+    HierarchicalContent,
+    parse_one,
+    parse_many
 )
 from clip.vectorizer import CLIPVectorizer
 from milvus.hierarchical_store import HierarchicalMilvusStore
+from main import file_content_hash
 
 # 加载环境变量
 load_dotenv()
 
+# 支持的文件扩展名
+SUPPORTED_EXTENSIONS = ['.docx', '.md', '.markdown']
+
+
+def _parse_and_encode(file_path: str,
+                      vectorizer: CLIPVectorizer,
+                      max_chunk_size: int = 500,
+                      hierarchical_content: Optional[Union[HierarchicalContent, Exception]] = None,
+                      parse_cache_dir: Optional[str] = None
+                      ) -> Tuple[Optional[HierarchicalContent], Optional[np.ndarray]]:
+    """
+    解析（如尚未解析）并向量化单个文件，不访问Milvus
+    
+    Args:
+        file_path: 文件路径
+        vectorizer: CLIP向量化器
+        max_chunk_size: 最大块大小
+        hierarchical_content: 已解析好的内容（如 parse_many 的结果），为None时在此解析
+        parse_cache_dir: 解析结果缓存目录，为None时不使用缓存
+        
+    Returns:
+        (层次化内容, 块向量数组)；不支持的文件类型返回 (None, None)
+    """
+    if hierarchical_content is None:
+        if Path(file_path).suffix.lower() not in SUPPORTED_EXTENSIONS:
+            return None, None
+        
+        # 解析文件（文件未变化时直接读取缓存的解析结果）
+        hierarchical_content = parse_one(file_path, max_chunk_size, parse_cache_dir)
+    elif isinstance(hierarchical_content, Exception):
+        # 并行解析阶段的错误，按单文件处理失败报告
+        raise hierarchical_content
+    
+    # 提取文本内容并向量化
+    texts = [chunk.content for chunk in hierarchical_content.chunks]
+    embeddings = vectorizer.encode_texts(texts, show_progress=False)
+    return hierarchical_content, embeddings
+
+
+def _encode_group(group: List[Tuple[str, HierarchicalContent]],
+                  vectorizer: CLIPVectorizer) -> List[Tuple[str, HierarchicalContent, np.ndarray]]:
+    """
+    把一组文件的所有文本块合并为一次向量化调用，再按各文件的块数切回
+    
+    Args:
+        group: (文件路径, 层次化内容) 列表
+        vectorizer: CLIP向量化器
+        
+    Returns:
+        (文件路径, 层次化内容, 块向量数组) 列表
+    """
+    texts = [chunk.content for _, content in group for chunk in content.chunks]
+    embeddings = vectorizer.encode_texts(texts, show_progress=False)
+    offsets = np.cumsum([len(content.chunks) for _, content in group[:-1]])
+    return [(file_path, content, file_embeddings)
+            for (file_path, content), file_embeddings in zip(group, np.split(embeddings, offsets))]
+
+
+def _insert_encoded(file_path: str,
+                    hierarchical_content: HierarchicalContent,
+                    embeddings: np.ndarray,
+                    milvus_store: HierarchicalMilvusStore,
+                    file_hash: Optional[str] = None,
+                    old_ids: Optional[List[int]] = None):
+    """把已向量化的文件块写入Milvus，写入成功后删除该文件旧版本的数据（old_ids）"""
+    print(f"  提取到 {len(hierarchical_content.chunks)} 个块")
+    print(f"  最大层级: {hierarchical_content.metadata['max_level']}")
+    
+    # 存储到Milvus
+    milvus_store.insert_hierarchical_chunks(
+        hierarchical_content=hierarchical_content,
+        embeddings=embeddings,
+        file_path=file_path,
+        file_type=hierarchical_content.metadata['file_type'],
+        file_hash=file_hash
+    )
+    
+    # 新数据写入后再删除旧版本，写入失败时旧数据保留
+    if old_ids:
+        milvus_store.delete_ids(old_ids)
+    
+    print(f"  ✓ 文件处理完成")
+
 
 def process_file_hierarchical(file_path: str,
                               vectorizer: CLIPVectorizer,
                               milvus_store: HierarchicalMilvusStore,
-                              max_chunk_size: int = 500):
+                              max_chunk_size: int = 500,
+                              hierarchical_content: Optional[Union[HierarchicalContent, Exception]] = None,
+                              parse_cache_dir: Optional[str] = None):
     """
     使用层次化方式处理单个文件
     
@@ -33,44 +121,23 @@ def process_file_hierarchical(file_path: str,
         vectorizer: CLIP向量化器
         milvus_store: 层次化Milvus存储
         max_chunk_size: 最大块大小
+        hierarchical_content: 已解析好的内容（如 parse_many 的结果），为None时在此解析
+        parse_cache_dir: 解析结果缓存目录，为None时不使用缓存
     """
     print(f"\n处理文件: {file_path}")
     print("-" * 60)
     
     try:
-        # 根据文件类型选择解析器
-        ext = Path(file_path).suffix.lower()
-        
-        if ext == '.docx':
-            parser = HierarchicalWordParser(max_chunk_size=max_chunk_size)
-        elif ext in ['.md', '.markdown']:
-            parser = HierarchicalMarkdownParser(max_chunk_size=max_chunk_size)
-        else:
-            print(f"  ✗ 不支持的文件类型: {ext}")
+        hierarchical_content, embeddings = _parse_and_encode(
+            file_path, vectorizer, max_chunk_size, hierarchical_content, parse_cache_dir)
+        if hierarchical_content is None:
+            print(f"  ✗ 不支持的文件类型: {Path(file_path).suffix.lower()}")
             return
         
-        # 解析文件
-        hierarchical_content = parser.parse(file_path)
-        
-        print(f"  提取到 {len(hierarchical_content.chunks)} 个块")
-        print(f"  最大层级: {hierarchical_content.metadata['max_level']}")
-        
-        # 提取文本内容
-        texts = [chunk.content for chunk in hierarchical_content.chunks]
-        
-        # 向量化
-        print("  向量化文本块...")
-        embeddings = vectorizer.encode_texts(texts, show_progress=False)
-        
-        # 存储到Milvus
-        milvus_store.insert_hierarchical_chunks(
-            hierarchical_content=hierarchical_content,
-            embeddings=embeddings,
-            file_path=file_path,
-            file_type=hierarchical_content.metadata['file_type']
-        )
-        
-        print(f"  ✓ 文件处理完成")
+        # 文件已入库时用新数据替换旧数据
+        old_ids = milvus_store.file_row_ids([file_path]).get(file_path)
+        _insert_encoded(file_path, hierarchical_content, embeddings, milvus_store,
+                        file_content_hash(file_path), old_ids)
         
     except Exception as e:
         print(f"  ✗ 处理文件时出错: {e}")
@@ -78,12 +145,52 @@ def process_file_hierarchical(file_path: str,
         traceback.print_exc()
 
 
+def collect_files(directory: str, file_extensions: List[str], recursive: bool = True) -> List[str]:
+    """
+    一次遍历目录树，收集指定扩展名的文件，跳过隐藏目录和 __pycache__
+    
+    Args:
+        directory: 目录路径
+        file_extensions: 支持的文件扩展名（不区分大小写）
+        recursive: 是否递归搜索子目录
+        
+    Returns:
+        排序后的文件路径列表
+    """
+    exts = tuple(ext.lower() for ext in file_extensions)
+    files = []
+    pending_dirs = [directory]
+    while pending_dirs:
+        try:
+            entries = os.scandir(pending_dirs.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        # 与 os.walk 一致，不进入符号链接指向的目录
+                        if (recursive and not entry.is_symlink()
+                                and not entry.name.startswith('.') and entry.name != '__pycache__'):
+                            pending_dirs.append(entry.path)
+                    elif entry.name.lower().endswith(exts):
+                        files.append(entry.path)
+                except OSError:
+                    continue
+    files.sort()
+    return files
+
+
 def process_directory_hierarchical(directory: str,
                                   vectorizer: CLIPVectorizer,
                                   milvus_store: HierarchicalMilvusStore,
-                                  file_extensions: List[str] = ['.docx', '.md', '.markdown'],
+                                  file_extensions: List[str] = SUPPORTED_EXTENSIONS,
                                   recursive: bool = True,
-                                  max_chunk_size: int = 500):
+                                  max_chunk_size: int = 500,
+                                  workers: int = 4,
+                                  encode_batch: int = 256,
+                                  parse_cache_dir: Optional[str] = None,
+                                  skip_existing: bool = True):
     """
     批量处理目录
     
@@ -94,6 +201,11 @@ def process_directory_hierarchical(directory: str,
         file_extensions: 支持的文件扩展名
         recursive: 是否递归
         max_chunk_size: 最大块大小
+        workers: 并发的向量化调用数（同时发往CLIP服务器的请求数）
+        encode_batch: 每次向量化调用合并的文本块数，小文件的块会跨文件合并后一起编码
+        parse_cache_dir: 解析结果缓存目录，为None时不使用缓存
+        skip_existing: 是否跳过以相同路径和内容哈希入库过的文件；需要处理的文件在集合中已有数据时
+            （如内容已修改或 --reindex），新数据写入成功后再删除旧数据
     """
     directory_path = Path(directory)
     
@@ -102,29 +214,94 @@ def process_directory_hierarchical(directory: str,
         return
     
     # 收集文件
-    files = []
-    if recursive:
-        for ext in file_extensions:
-            files.extend(directory_path.rglob(f"*{ext}"))
-    else:
-        for ext in file_extensions:
-            files.extend(directory_path.glob(f"*{ext}"))
+    files = collect_files(directory, file_extensions, recursive)
     
     if not files:
         print(f"在目录 {directory} 中未找到支持的文件")
         return
     
-    print(f"\n找到 {len(files)} 个文件需要处理")
+    # 按内容哈希跳过已经入库且未变化的文件，避免重复解析、向量化和写入
+    file_hashes = {}
+    for file_path in files:
+        try:
+            file_hashes[file_path] = file_content_hash(file_path)
+        except OSError as e:
+            print(f"  ✗ 无法读取文件 {file_path}: {e}")
+    if skip_existing:
+        unchanged = milvus_store.unchanged_file_paths(file_hashes)
+        file_hashes = {path: h for path, h in file_hashes.items() if path not in unchanged}
+        if unchanged:
+            print(f"跳过 {len(unchanged)} 个未变化的已入库文件")
+    file_paths = list(file_hashes)
+    
+    if not file_paths:
+        print("没有需要处理的文件")
+        return
+    
+    # 已入库文件的旧版本数据：新数据写入成功后再删除，避免重复的块，处理失败时也不会丢失数据
+    old_ids = milvus_store.file_row_ids(file_paths)
+    if old_ids:
+        print(f"{len(old_ids)} 个已入库文件将重新入库，写入后替换旧数据")
+    
+    print(f"\n找到 {len(file_paths)} 个文件需要处理")
     print("=" * 60)
     
-    # 处理每个文件
-    for file_path in tqdm(files, desc="处理文件"):
-        process_file_hierarchical(
-            str(file_path),
-            vectorizer,
-            milvus_store,
-            max_chunk_size
-        )
+    # 多进程并行解析所有文件（未变化的文件直接读取缓存的解析结果）
+    contents = parse_many(file_paths, max_chunk_size=max_chunk_size, return_exceptions=True,
+                          cache_dir=parse_cache_dir)
+    
+    import traceback
+    
+    # 按块数把文件累积成组，每组的文本块只调用一次向量化，避免小文件各自产生一次CLIP请求；
+    # 组的大小同时限制了已向量化、尚未写入的数据量
+    groups, group, group_chunks = [], [], 0
+    for file_path, content in zip(file_paths, contents):
+        if isinstance(content, Exception):
+            print(f"\n处理文件: {file_path}")
+            print("-" * 60)
+            print(f"  ✗ 处理文件时出错: {content}")
+            traceback.print_exception(type(content), content, content.__traceback__)
+            continue
+        group.append((file_path, content))
+        group_chunks += len(content.chunks)
+        if group_chunks >= encode_batch:
+            groups.append(group)
+            group, group_chunks = [], 0
+    if group:
+        groups.append(group)
+    
+    # 多组并发向量化，使CLIP请求的往返延迟相互重叠；写入Milvus只在主线程中按完成顺序进行
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool, tqdm(
+            total=sum(len(g) for g in groups), desc="处理文件", mininterval=0.5,
+            miniters=max(1, len(file_paths) // 200), smoothing=0.1) as pbar:
+        futures = {pool.submit(_encode_group, group, vectorizer): group for group in groups}
+        for future in as_completed(futures):
+            group = futures[future]
+            try:
+                encoded = future.result()
+            except Exception as e:
+                # 向量化失败时整组的文件都按处理失败报告
+                for file_path, _ in group:
+                    print(f"\n处理文件: {file_path}")
+                    print("-" * 60)
+                    print(f"  ✗ 处理文件时出错: {e}")
+                traceback.print_exc()
+                pbar.update(len(group))
+                continue
+            
+            for file_path, hierarchical_content, embeddings in encoded:
+                print(f"\n处理文件: {file_path}")
+                print("-" * 60)
+                try:
+                    _insert_encoded(file_path, hierarchical_content, embeddings, milvus_store,
+                                    file_hashes[file_path], old_ids.get(file_path))
+                except Exception as e:
+                    print(f"  ✗ 处理文件时出错: {e}")
+                    traceback.print_exc()
+                pbar.update(1)
+    
+    # 所有文件写入后统一flush一次并重建混合检索索引
+    milvus_store.finalize()
     
     print(f"\n✓ 所有文件处理完成")
 
@@ -135,7 +312,8 @@ def hybrid_search(query_text: str,
                  content_type: Optional[str] = None,
                  limit: int = 10,
                  alpha: float = 0.7,
-                 hierarchical: bool = True):
+                 hierarchical: bool = True,
+                 fusion: str = 'rrf'):
     """
     混合检索
     
@@ -147,6 +325,7 @@ def hybrid_search(query_text: str,
         limit: 返回结果数量
         alpha: 向量检索权重
         hierarchical: 是否使用层次化检索
+        fusion: 融合方式，'rrf'（倒数排名融合）或 'cc'（归一化分数的凸组合）
     """
     print(f"\n搜索: {query_text}")
     print(f"混合检索权重 - 向量: {alpha:.1%}, 关键词: {1-alpha:.1%}")
@@ -164,7 +343,8 @@ def hybrid_search(query_text: str,
             limit=limit,
             alpha=alpha,
             include_children=True,
-            include_parent=True
+            include_parent=True,
+            fusion=fusion
         )
     else:
         results = milvus_store.hybrid_search(
@@ -172,7 +352,8 @@ def hybrid_search(query_text: str,
             query_vector=query_vector,
             content_type=content_type,
             limit=limit,
-            alpha=alpha
+            alpha=alpha,
+            fusion=fusion
         )
     
     # 显示结果
@@ -248,6 +429,10 @@ def main():
     parser.add_argument('--drop-collection', action='store_true',
                        help='删除已存在的集合并重建')
     
+    parser.add_argument('--vector-dtype', type=str, choices=['float32', 'float16'],
+                       default=os.getenv('VECTOR_DTYPE', 'float32'),
+                       help='新建集合时向量的存储精度，float16需要Milvus 2.4+ (默认: float32)')
+    
     parser.add_argument('--content-type', type=str, choices=['text', 'image'],
                        help='搜索时筛选内容类型')
     
@@ -263,9 +448,25 @@ def main():
     parser.add_argument('--alpha', type=float, default=0.7,
                        help='混合检索中向量检索的权重 (0-1, 默认0.7)')
     
+    parser.add_argument('--fusion', type=str, choices=['rrf', 'cc'], default='rrf',
+                       help='混合检索的融合方式：rrf 倒数排名融合，cc 归一化分数加权 (默认: rrf)')
+    
     parser.add_argument('--no-hierarchical', action='store_true',
                        help='不使用层次化检索（仅混合检索）')
     
+    parser.add_argument('--workers', type=int, default=4,
+                       help='处理目录时并发的向量化调用数 (默认4)')
+    
+    parser.add_argument('--encode-batch', type=int, default=256,
+                       help='处理目录时每次向量化调用跨文件合并的文本块数 (默认256)')
+    
+    parser.add_argument('--parse-cache', type=str,
+                       default=os.getenv('PARSE_CACHE_DIR', '.parse_cache'),
+                       help='解析结果缓存目录，文件未变化时跳过重新解析（设为空字符串禁用）')
+    
+    parser.add_argument('--reindex', action='store_true',
+                       help='处理目录时不跳过内容未变化的已入库文件，重新写入并替换旧数据')
+    
     args = parser.parse_args()
     
     # 初始化组件
@@ -284,7 +485,8 @@ def main():
             port=args.milvus_port,
             collection_name=args.collection,
             embedding_dim=embedding_dim,
-            drop_existing=args.drop_collection
+            drop_existing=args.drop_collection,
+            vector_dtype=args.vector_dtype
         )
         
         # 获取统计信息
@@ -308,7 +510,8 @@ def main():
             content_type=args.content_type,
             limit=args.limit,
             alpha=args.alpha,
-            hierarchical=not args.no_hierarchical
+            hierarchical=not args.no_hierarchical,
+            fusion=args.fusion
         )
     
     elif args.file:
@@ -317,8 +520,10 @@ def main():
             file_path=args.file,
             vectorizer=vectorizer,
             milvus_store=milvus_store,
-            max_chunk_size=args.max_chunk_size
+            max_chunk_size=args.max_chunk_size,
+            parse_cache_dir=args.parse_cache or None
         )
+        milvus_store.finalize()
         
         # 显示统计信息
         stats = milvus_store.get_stats()
@@ -331,7 +536,11 @@ def main():
             vectorizer=vectorizer,
             milvus_store=milvus_store,
             recursive=not args.no_recursive,
-            max_chunk_size=args.max_chunk_size
+            max_chunk_size=args.max_chunk_size,
+            workers=args.workers,
+            encode_batch=args.encode_batch,
+            parse_cache_dir=args.parse_cache or None,
+            skip_existing=not args.reindex
         )
         
         # 显示统计信息
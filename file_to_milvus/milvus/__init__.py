@@ -1,10 +1,11 @@
-from .milvus_store import MilvusStore
+from .milvus_store import MilvusStore, get_store
 from .hierarchical_store import HierarchicalMilvusStore
 from .hybrid_search import HybridRetriever, HierarchicalHybridRetriever
 from .knowledge_base import KnowledgeBase, create_knowledge_base
 
 __all__ = [
     'MilvusStore',
+    'get_store',
     'HierarchicalMilvusStore', 
     'HybridRetriever',
     'HierarchicalHybridRetriever',
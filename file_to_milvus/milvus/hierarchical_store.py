@@ -1,13 +1,38 @@
 """
 层次化存储：支持父子关系的存储和检索
 """
+import heapq
+import json
+import math
+import os
+import pickle
+import threading
+from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 import numpy as np
 
+# orjson 为可选依赖，序列化小字典比标准库 json 快数倍
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from milvus.milvus_store import MilvusStore
 from milvus.hybrid_search import HybridRetriever, HierarchicalHybridRetriever
 from file_parsers.hierarchical_parser import HierarchicalContent, Chunk
 
+# 混合检索（BM25）索引的磁盘缓存目录，每个集合一个文件
+HYBRID_CACHE_DIR = Path(os.getenv('HYBRID_CACHE_DIR', '.hybrid_cache'))
+# 检索器的内部结构变化时递增，旧格式的缓存会被忽略并从Milvus重建
+HYBRID_CACHE_VERSION = 6
+
+
+def _dumps(obj) -> str:
+    """把元数据序列化为JSON字符串，安装了 orjson 时使用 orjson"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj)
+
 
 class HierarchicalMilvusStore(MilvusStore):
     """支持层次化结构的Milvus存储"""
@@ -18,95 +43,135 @@ class HierarchicalMilvusStore(MilvusStore):
         self.milvus_id_to_chunk_id = {}  # Milvus ID到块索引的映射
         self.chunk_contents = {}  # 存储块内容用于混合检索
         self.hybrid_retriever = None
+        self._hybrid_synced = False  # 混合检索器是否已包含集合中的全部文本块（从Milvus重建、加载缓存或集合为新建）
+        self._hybrid_lock = threading.Lock()  # 并发查询时只由一个线程从Milvus重建混合检索器
+        # 集合只在初始化时加载一次，之后的检索不再逐次发起load请求
+        if self.collection.has_index():
+            self.load()
+        if not self._load_hybrid_cache() and self.is_new_collection:
+            # 新建的集合为空，之后插入的块都会增量添加到检索器中，无需再从Milvus重建
+            self.hybrid_retriever = HybridRetriever(alpha=0.7)
+            self.hybrid_retriever.index_documents([], [])
+            self._hybrid_synced = True
     
     def insert_hierarchical_chunks(self,
                                    hierarchical_content: HierarchicalContent,
                                    embeddings: np.ndarray,
                                    file_path: str,
-                                   file_type: str):
+                                   file_type: str,
+                                   file_hash: Optional[str] = None):
         """
         插入层次化块
         
+        插入后不会立即flush：Milvus会在增长段写满时自动封存，逐文件flush会强制同步封存段，
+        使写入延迟成倍增加。批量写入结束后调用一次 finalize() 落盘并重建混合检索索引
+        
         Args:
             hierarchical_content: 层次化内容对象
             embeddings: 块向量数组
             file_path: 文件路径
             file_type: 文件类型
+            file_hash: 源文件内容哈希，写入每一行，供后续运行跳过未变化的文件；为None时取块元数据中的值
         """
         if len(hierarchical_content.chunks) != len(embeddings):
             raise ValueError(f"Chunks and embeddings length mismatch: {len(hierarchical_content.chunks)} vs {len(embeddings)}")
         
-        data = []
         from datetime import datetime
-        import json
+        chunks = hierarchical_content.chunks
         current_time = datetime.now().isoformat()
         
         # 存储块内容用于混合检索
-        for chunk in hierarchical_content.chunks:
+        for chunk in chunks:
             self.chunk_contents[chunk.index] = chunk.content
         
-        # 准备插入数据
-        for chunk, embedding in zip(hierarchical_content.chunks, embeddings):
-            meta_dict = chunk.metadata.copy()
-            meta_dict.update({
-                'chunk_index': chunk.index,
-                'children_ids': chunk.children_ids,
-            })
-            
-            data.append({
-                "content_type": "text",
-                "content": chunk.content[:65535],
-                "embedding": embedding.tolist(),
-                "file_path": file_path[:1024],
-                "file_type": file_type,
-                "chunk_index": chunk.index,
-                "parent_id": chunk.parent_id if chunk.parent_id is not None else -1,
-                "chunk_type": chunk.chunk_type.value,
-                "level": chunk.level,
-                "metadata": json.dumps(meta_dict),
-                "created_at": current_time
-            })
+        # 按列准备插入数据，向量整体作为一个二维数组传入
+        # 大多数块没有元数据（为None），直接构造要序列化的字典，不复制块的元数据
+        metadata = [
+            _dumps({**chunk.metadata, 'chunk_index': chunk.index, 'children_ids': chunk.children_ids}
+                   if chunk.metadata else {'chunk_index': chunk.index, 'children_ids': chunk.children_ids})
+            for chunk in chunks
+        ]
+        if file_hash is not None:
+            file_hashes = [file_hash] * len(chunks)
+        else:
+            file_hashes = [chunk.metadata.get('file_hash', '') if chunk.metadata else '' for chunk in chunks]
         
-        # 插入数据
-        insert_result = self.collection.insert(data)
-        self.collection.flush()
+        columns = {
+            "content_type": ["text"] * len(chunks),
+            "content": [chunk.content[:65535] for chunk in chunks],
+            "embedding": self._vector_array(embeddings),
+            "file_path": [file_path[:1024]] * len(chunks),
+            "file_type": [file_type] * len(chunks),
+            "chunk_index": [chunk.index for chunk in chunks],
+            "parent_id": [chunk.parent_id if chunk.parent_id is not None else -1 for chunk in chunks],
+            "chunk_type": [chunk.chunk_type.value for chunk in chunks],
+            "level": [chunk.level for chunk in chunks],
+            "metadata": metadata,
+            "created_at": [current_time] * len(chunks),
+            "file_hash": file_hashes,
+        }
+        
+        # 插入数据（过大或行数过多时自动拆分为多次请求）
+        primary_keys = self._insert_columns(columns)
         
         # 建立映射关系
-        for i, chunk in enumerate(hierarchical_content.chunks):
-            milvus_id = insert_result.primary_keys[i]
+        for chunk, milvus_id in zip(hierarchical_content.chunks, primary_keys):
             self.chunk_id_to_milvus_id[chunk.index] = milvus_id
             self.milvus_id_to_chunk_id[milvus_id] = chunk.index
         
-        # 更新混合检索器（增量添加，而不是替换）
+        # 增量更新混合检索器，只对新块分词；集合中已有的数据在 finalize() 时从Milvus补齐
+        # 文档以Milvus主键标识：chunk_index 只在单个文件内唯一
         documents = [chunk.content for chunk in hierarchical_content.chunks]
-        indices = [chunk.index for chunk in hierarchical_content.chunks]
+        indices = [int(milvus_id) for milvus_id in primary_keys]
         
         if self.hybrid_retriever is None:
-            # 首次创建混合检索器
             self.hybrid_retriever = HybridRetriever(alpha=0.7)
-            # 需要从Milvus加载所有现有文档来构建完整的索引
-            self._rebuild_hybrid_retriever()
-        else:
-            # 增量添加新文档
-            existing_docs = self.hybrid_retriever.documents
-            existing_indices = self.hybrid_retriever.doc_indices
-            
-            # 合并新文档
-            all_documents = existing_docs + documents
-            all_indices = existing_indices + indices
-            
-            # 重新索引
-            self.hybrid_retriever.index_documents(all_documents, all_indices)
+        self.hybrid_retriever.add_documents(documents, indices)
         
         print(f"✓ Inserted {len(hierarchical_content.chunks)} hierarchical chunks")
     
+    def finalize(self):
+        """
+        结束一轮批量写入：flush已插入的数据，并从Milvus重建一次混合检索索引
+        
+        在调用之前，新插入的数据可能还不能被查询到（最终一致性），
+        依赖最新数据的检索应在 finalize() 之后进行
+        """
+        self.collection.flush()
+        # 每个会话最多从Milvus重建一次，之后的写入都增量添加到检索器中
+        if not self._hybrid_synced:
+            self._rebuild_hybrid_retriever()
+        self._save_hybrid_cache()
+    
+    def invalidate_hybrid_index(self):
+        """
+        删除数据后使混合检索索引失效：删除磁盘缓存，下次检索或 finalize() 时从Milvus重建
+        
+        删除不会立即减少 num_entities，不清除缓存的话下次启动仍会加载包含已删除块的旧索引
+        """
+        self._hybrid_synced = False
+        try:
+            self._hybrid_cache_path().unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Warning: 删除混合检索索引缓存失败: {e}")
+    
+    def delete_ids(self, ids: List[int]) -> int:
+        """按主键删除行，并使混合检索索引失效"""
+        deleted = super().delete_ids(ids)
+        if deleted:
+            self.invalidate_hybrid_index()
+        return deleted
+    
     def hybrid_search(self,
                      query_text: str,
                      query_vector: np.ndarray,
                      content_type: Optional[str] = None,
                      limit: int = 10,
                      alpha: float = 0.7,
-                     expr: Optional[str] = None) -> List[Dict]:
+                     expr: Optional[str] = None,
+                     fusion: str = 'rrf') -> List[Dict]:
         """
         混合检索：结合向量检索和关键词检索
         
@@ -117,21 +182,51 @@ class HierarchicalMilvusStore(MilvusStore):
             limit: 返回结果数量
             alpha: 向量检索权重 (0-1)
             expr: 额外的过滤表达式
+            fusion: 融合方式，'rrf'（默认，倒数排名融合）或 'cc'（归一化分数的凸组合）
             
         Returns:
             搜索结果列表
         """
-        # 确保集合已加载
-        if not self.collection.has_index():
+        return self.hybrid_search_batch([query_text], np.atleast_2d(query_vector), content_type=content_type,
+                                        limit=limit, alpha=alpha, expr=expr, fusion=fusion)[0]
+    
+    def hybrid_search_batch(self,
+                            query_texts: List[str],
+                            query_vectors: np.ndarray,
+                            content_type: Optional[str] = None,
+                            limit: int = 10,
+                            alpha: float = 0.7,
+                            expr: Optional[str] = None,
+                            fusion: str = 'rrf') -> List[List[Dict]]:
+        """
+        批量混合检索：所有查询向量在一次Milvus检索请求中完成，再逐个查询与关键词检索融合
+        
+        Args:
+            query_texts: 查询文本列表
+            query_vectors: 查询向量数组，shape: (查询数, embedding_dim)
+            content_type: 内容类型筛选
+            limit: 每个查询返回结果数量
+            alpha: 向量检索权重 (0-1)
+            expr: 额外的过滤表达式
+            fusion: 融合方式，'rrf' 或 'cc'
+            
+        Returns:
+            每个查询的搜索结果列表，顺序与 query_texts 一致
+        """
+        if len(query_texts) != len(query_vectors):
+            raise ValueError(f"Queries and vectors length mismatch: {len(query_texts)} vs {len(query_vectors)}")
+        if not query_texts:
+            return []
+        
+        # 确保集合已加载（已加载说明索引存在，不再重复检查）
+        if not self.is_loaded and not self.collection.has_index():
             raise RuntimeError("Collection does not have an index. Please create index first.")
         
-        self.collection.load()
+        self.load()
         
         # 1. 向量检索
-        search_params = {
-            "metric_type": "L2",
-            "params": {"nprobe": 10}
-        }
+        num_candidates = math.ceil(limit * 1.5)
+        search_params = self._search_params(num_candidates)
         
         filter_expr = None
         if content_type:
@@ -142,67 +237,69 @@ class HierarchicalMilvusStore(MilvusStore):
         
         # 向量搜索，返回更多结果用于混合检索
         vector_results = self.collection.search(
-            data=[query_vector.tolist()],
+            data=self._query_vectors(query_vectors),
             anns_field="embedding",
             param=search_params,
-            limit=limit * 3,  # 获取更多候选结果
+            limit=num_candidates,  # 获取更多候选结果（分数归一化后的融合不需要过大的候选集）
             expr=filter_expr,
-            output_fields=["chunk_index", "content", "parent_id", "chunk_type", "level", "metadata"]
+            output_fields=["chunk_index", "content", "parent_id", "chunk_type", "level", "metadata",
+                           "file_path", "file_type"]
         )
         
-        # 准备向量检索结果
-        vector_scores = []
-        for hits in vector_results:
-            for hit in hits:
-                chunk_idx = hit.entity.get('chunk_index')
-                if chunk_idx is not None:
-                    vector_scores.append((int(chunk_idx), float(hit.distance)))
-        
-        # 2. 混合检索
-        if self.hybrid_retriever and len(vector_scores) > 0:
-            # 确保混合检索器已初始化（从Milvus重建索引）
-            if not self.hybrid_retriever.documents:
-                self._rebuild_hybrid_retriever()
-            
-            # 使用混合检索器
-            self.hybrid_retriever.alpha = alpha
-            hybrid_results = self.hybrid_retriever.search(query_text, vector_scores, top_k=limit)
-            
-            # 创建chunk_index到hit的映射
-            chunk_idx_to_hit = {}
-            for hits in vector_results:
-                for hit in hits:
-                    chunk_idx = hit.entity.get('chunk_index')
-                    if chunk_idx is not None:
-                        chunk_idx_to_hit[int(chunk_idx)] = hit
-            
-            # 获取详细结果
-            detailed_results = []
-            for chunk_idx, score in hybrid_results:
-                # 从向量检索结果中获取详细信息
-                hit_info = chunk_idx_to_hit.get(chunk_idx)
-                if not hit_info:
-                    continue
-                
-                import json
-                detailed_results.append({
-                    'id': hit_info.id,
-                    'distance': score,  # 使用混合检索分数
-                    'content_type': 'text',
-                    'content': hit_info.entity.get('content'),
-                    'chunk_index': chunk_idx,
-                    'parent_id': hit_info.entity.get('parent_id'),
-                    'chunk_type': hit_info.entity.get('chunk_type'),
-                    'level': hit_info.entity.get('level'),
-                    'file_path': hit_info.entity.get('file_path', ''),
-                    'file_type': hit_info.entity.get('file_type', ''),
-                    'metadata': json.loads(hit_info.entity.get('metadata', '{}'))
-                })
-            
-            return detailed_results
-        else:
+        # 2. 逐个查询做混合检索
+        return [self._fuse_hits(query_text, hits, limit, alpha, fusion)
+                for query_text, hits in zip(query_texts, vector_results)]
+    
+    def _fuse_hits(self, query_text: str, hits, limit: int, alpha: float, fusion: str) -> List[Dict]:
+        """把一个查询的向量检索命中与关键词检索融合，没有可用的混合检索器时退回纯向量检索结果"""
+        # 准备向量检索结果，以Milvus主键标识文本块（不同文件的 chunk_index 会重复）
+        vector_scores = [(int(hit.id), float(hit.distance)) for hit in hits]
+        
+        if not (self.hybrid_retriever and len(vector_scores) > 0):
             # 回退到纯向量检索
-            return self._format_vector_results(vector_results, limit)
+            return self._format_vector_results([hits], limit)
+        
+        # 确保混合检索器包含集合中的全部文本块（从Milvus重建索引）
+        if not self._hybrid_synced:
+            with self._hybrid_lock:
+                if not self._hybrid_synced:
+                    self._rebuild_hybrid_retriever()
+                    self._save_hybrid_cache()
+        
+        # 使用混合检索器
+        self.hybrid_retriever.alpha = alpha
+        hybrid_results = self.hybrid_retriever.search(
+            query_text, vector_scores, top_k=limit,
+            higher_is_better=self.metric_type != "L2",
+            fusion=fusion
+        )
+        
+        # 创建主键到hit的映射
+        id_to_hit = {int(hit.id): hit for hit in hits}
+        
+        # 获取详细结果
+        detailed_results = []
+        for milvus_id, score in hybrid_results:
+            # 从向量检索结果中获取详细信息
+            hit_info = id_to_hit.get(milvus_id)
+            if not hit_info:
+                continue
+            
+            detailed_results.append({
+                'id': hit_info.id,
+                'distance': score,  # 使用混合检索分数
+                'content_type': 'text',
+                'content': hit_info.entity.get('content'),
+                'chunk_index': hit_info.entity.get('chunk_index'),
+                'parent_id': hit_info.entity.get('parent_id'),
+                'chunk_type': hit_info.entity.get('chunk_type'),
+                'level': hit_info.entity.get('level'),
+                'file_path': hit_info.entity.get('file_path', ''),
+                'file_type': hit_info.entity.get('file_type', ''),
+                'metadata': json.loads(hit_info.entity.get('metadata', '{}'))
+            })
+        
+        return detailed_results
     
     def hierarchical_search(self,
                            query_text: str,
@@ -211,7 +308,8 @@ class HierarchicalMilvusStore(MilvusStore):
                            limit: int = 10,
                            alpha: float = 0.7,
                            include_children: bool = True,
-                           include_parent: bool = True) -> List[Dict]:
+                           include_parent: bool = True,
+                           fusion: str = 'rrf') -> List[Dict]:
         """
         层次化混合检索：考虑父子关系
         
@@ -223,83 +321,169 @@ class HierarchicalMilvusStore(MilvusStore):
             alpha: 向量检索权重
             include_children: 是否包含子节点
             include_parent: 是否包含父节点
+            fusion: 融合方式，'rrf' 或 'cc'
             
         Returns:
             搜索结果列表（包含上下文信息）
         """
+        return self.hierarchical_search_batch([query_text], np.atleast_2d(query_vector), content_type=content_type,
+                                              limit=limit, alpha=alpha, include_children=include_children,
+                                              include_parent=include_parent, fusion=fusion)[0]
+    
+    def hierarchical_search_batch(self,
+                                  query_texts: List[str],
+                                  query_vectors: np.ndarray,
+                                  content_type: Optional[str] = None,
+                                  limit: int = 10,
+                                  alpha: float = 0.7,
+                                  include_children: bool = True,
+                                  include_parent: bool = True,
+                                  fusion: str = 'rrf') -> List[List[Dict]]:
+        """
+        批量层次化混合检索：一次向量检索请求完成所有查询，所有查询需要的父块和子块也用一次查询取回
+        
+        Args:
+            query_texts: 查询文本列表
+            query_vectors: 查询向量数组，shape: (查询数, embedding_dim)
+            content_type: 内容类型
+            limit: 每个查询返回结果数量
+            alpha: 向量检索权重
+            include_children: 是否包含子节点
+            include_parent: 是否包含父节点
+            fusion: 融合方式，'rrf' 或 'cc'
+            
+        Returns:
+            每个查询的搜索结果列表（包含上下文信息），顺序与 query_texts 一致
+        """
         # 先执行混合检索
-        results = self.hybrid_search(
-            query_text=query_text,
-            query_vector=query_vector,
+        results_per_query = self.hybrid_search_batch(
+            query_texts=query_texts,
+            query_vectors=query_vectors,
             content_type=content_type,
             limit=limit * 2,  # 获取更多结果用于扩展
-            alpha=alpha
+            alpha=alpha,
+            fusion=fusion
         )
         
-        # 扩展结果：添加父节点和子节点
+        # 收集所有需要补充的父块和子块，用一次查询全部取回；块索引只在同一文件内唯一，按文件区分
+        def related_ids(result):
+            ids = []
+            if include_parent:
+                parent_id = result.get('parent_id')
+                if parent_id is not None and parent_id != -1:
+                    ids.append(parent_id)
+            if include_children:
+                ids.extend(result.get('metadata', {}).get('children_ids', []))
+            return ids
+        
+        needed_per_query = []
+        for results in results_per_query:
+            hit_keys = {(result.get('file_path', ''), result.get('chunk_index')) for result in results}
+            needed_per_query.append({(result.get('file_path', ''), chunk_id)
+                                     for result in results for chunk_id in related_ids(result)} - hit_keys)
+        related = self._fetch_chunks(set().union(*needed_per_query))
+        
+        return [self._expand_results(results, {key: related[key] for key in needed if key in related},
+                                     related_ids, limit)
+                for results, needed in zip(results_per_query, needed_per_query)]
+    
+    @staticmethod
+    def _expand_results(results: List[Dict], related: Dict[Tuple[str, int], Dict], related_ids,
+                        limit: int) -> List[Dict]:
+        """
+        在每个结果之后添加其父节点和子节点，并按相关度取前 limit 个
+        
+        Args:
+            results: 一个查询的混合检索结果
+            related: 该查询需要的上下文块 {(文件路径, 块索引): 块信息}，会被修改
+            related_ids: 返回结果的父块和子块索引的函数
+            limit: 返回结果数量
+        """
+        # 取回的块已排除命中结果本身，取出后即从字典中移除，每个上下文块只会被添加一次
         expanded_results = []
-        seen_ids = set()
+        seen_keys = set()
         
         for result in results:
-            chunk_idx = result.get('chunk_index')
-            if chunk_idx in seen_ids:
+            file_path = result.get('file_path', '')
+            key = (file_path, result.get('chunk_index'))
+            if key in seen_keys:
                 continue
             
             # 添加当前结果
             expanded_results.append(result)
-            seen_ids.add(chunk_idx)
+            seen_keys.add(key)
             
-            # 添加父节点
-            if include_parent:
-                parent_id = result.get('parent_id')
-                if parent_id and parent_id != -1:
-                    parent_result = self._get_chunk_by_index(parent_id)
-                    if parent_result and parent_id not in seen_ids:
-                        expanded_results.append(parent_result)
-                        seen_ids.add(parent_id)
-            
-            # 添加子节点
-            if include_children:
-                children_ids = result.get('metadata', {}).get('children_ids', [])
-                for child_id in children_ids:
-                    if child_id not in seen_ids:
-                        child_result = self._get_chunk_by_index(child_id)
-                        if child_result:
-                            expanded_results.append(child_result)
-                            seen_ids.add(child_id)
-        
-        # 重新排序（按相关度）
-        expanded_results.sort(key=lambda x: x.get('distance', float('inf')))
-        
-        return expanded_results[:limit]
+            for chunk_id in related_ids(result):
+                related_chunk = related.pop((file_path, chunk_id), None)
+                if related_chunk:
+                    # 上下文块沿用引出它的结果的分数，排序后紧随该结果
+                    expanded_results.append(dict(related_chunk, distance=result.get('distance')))
+        
+        # 按相关度取前 limit 个（混合检索分数越大越相关），扩展出的块很多时无需全量排序
+        # nlargest 与 sorted(reverse=True)[:limit] 结果一致，同分的上下文块仍紧随其结果
+        return heapq.nlargest(limit, expanded_results, key=lambda x: x.get('distance', float('-inf')))
     
-    def _get_chunk_by_index(self, chunk_index: int) -> Optional[Dict]:
-        """根据块索引获取块信息"""
-        # 这里需要从Milvus中查询
-        # 简化实现：从已有的映射中查找
-        milvus_id = self.chunk_id_to_milvus_id.get(chunk_index)
-        if milvus_id is None:
-            return None
-        
-        # 实际应该从Milvus查询，这里简化处理
-        return None
+    def _fetch_chunks(self, keys) -> Dict[Tuple[str, int], Dict]:
+        """
+        用一次Milvus查询批量取回指定的块
+        
+        Args:
+            keys: (文件路径, 块索引) 的集合
+            
+        Returns:
+            {(文件路径, 块索引): 块信息}
+        """
+        if not keys:
+            return {}
+        
+        by_file = {}
+        for file_path, chunk_index in keys:
+            by_file.setdefault(file_path, []).append(int(chunk_index))
+        expr = " || ".join(
+            f"(file_path == {json.dumps(file_path)} && chunk_index in {sorted(indices)})"
+            for file_path, indices in by_file.items()
+        )
+        rows = self.collection.query(
+            expr=expr,
+            output_fields=["chunk_index", "content", "parent_id", "chunk_type", "level", "metadata",
+                           "file_path", "file_type"],
+            limit=len(keys)
+        )
+        return {
+            (row['file_path'], row['chunk_index']): {
+                'id': row['id'],
+                'content_type': 'text',
+                'content': row['content'],
+                'chunk_index': row['chunk_index'],
+                'parent_id': row['parent_id'],
+                'chunk_type': row['chunk_type'],
+                'level': row['level'],
+                'file_path': row['file_path'],
+                'file_type': row['file_type'],
+                'metadata': json.loads(row.get('metadata') or '{}')
+            }
+            for row in rows
+        }
     
     def _rebuild_hybrid_retriever(self):
-        """从Milvus重建混合检索器索引"""
+        """从Milvus重建混合检索器索引，磁盘缓存与集合一致时直接使用缓存"""
+        if self._load_hybrid_cache():
+            return
+        
         try:
-            if not self.collection.has_index():
+            if not self.is_loaded and not self.collection.has_index():
                 # 如果集合还没有索引，创建空的检索器
                 if self.hybrid_retriever is None:
                     self.hybrid_retriever = HybridRetriever(alpha=0.7)
                     self.hybrid_retriever.index_documents([], [])
                 return
             
-            self.collection.load()
+            self.load()
             
             # 查询所有文本块（Milvus limit 最大 16384）
             results = self.collection.query(
                 expr="content_type == 'text'",
-                output_fields=["chunk_index", "content"],
+                output_fields=["content"],
                 limit=16384
             )
             
@@ -308,16 +492,18 @@ class HierarchicalMilvusStore(MilvusStore):
                 if self.hybrid_retriever is None:
                     self.hybrid_retriever = HybridRetriever(alpha=0.7)
                 self.hybrid_retriever.index_documents([], [])
+                self._hybrid_synced = True
                 return
             
             # 重建索引
             documents = [r['content'] for r in results]
-            indices = [r['chunk_index'] for r in results]
+            indices = [int(r['id']) for r in results]
             
             if self.hybrid_retriever is None:
                 self.hybrid_retriever = HybridRetriever(alpha=0.7)
             
             self.hybrid_retriever.index_documents(documents, indices)
+            self._hybrid_synced = True
             print(f"✓ 重建混合检索索引，共 {len(documents)} 个文档块")
         
         except Exception as e:
@@ -327,9 +513,54 @@ class HierarchicalMilvusStore(MilvusStore):
                 self.hybrid_retriever = HybridRetriever(alpha=0.7)
                 self.hybrid_retriever.index_documents([], [])
     
+    def _hybrid_cache_path(self) -> Path:
+        """当前集合的混合检索索引缓存文件"""
+        return HYBRID_CACHE_DIR / f"{self.collection_name}.pkl"
+    
+    def _load_hybrid_cache(self) -> bool:
+        """
+        加载磁盘上的混合检索索引，缓存时的实体数与集合当前的实体数一致时才使用
+        
+        Returns:
+            是否成功加载了缓存
+        """
+        try:
+            with open(self._hybrid_cache_path(), 'rb') as f:
+                cached = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"Warning: 读取混合检索索引缓存失败: {e}")
+            return False
+        
+        if (cached.get('version') != HYBRID_CACHE_VERSION
+                or cached.get('num_entities') != self.collection.num_entities):
+            return False
+        self.hybrid_retriever = cached['retriever']
+        self._hybrid_synced = True
+        print(f"✓ 加载混合检索索引缓存，共 {len(self.hybrid_retriever.documents)} 个文档块")
+        return True
+    
+    def _save_hybrid_cache(self):
+        """把与集合同步的混合检索索引写入磁盘，下次启动时无需从Milvus重建"""
+        if not self._hybrid_synced or self.hybrid_retriever is None:
+            return
+        
+        path = self._hybrid_cache_path()
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # 先写临时文件再替换，避免中断时留下不完整的缓存
+            tmp_path = path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'version': HYBRID_CACHE_VERSION,
+                             'num_entities': self.collection.num_entities,
+                             'retriever': self.hybrid_retriever}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: 保存混合检索索引缓存失败: {e}")
+    
     def _format_vector_results(self, vector_results, limit: int) -> List[Dict]:
         """格式化向量检索结果"""
-        import json
         formatted_results = []
         for hits in vector_results:
             for hit in hits:
@@ -342,6 +573,8 @@ class HierarchicalMilvusStore(MilvusStore):
                     'parent_id': hit.entity.get('parent_id'),
                     'chunk_type': hit.entity.get('chunk_type'),
                     'level': hit.entity.get('level'),
+                    'file_path': hit.entity.get('file_path', ''),
+                    'file_type': hit.entity.get('file_type', ''),
                     'metadata': json.loads(hit.entity.get('metadata', '{}'))
                 })
                 if len(formatted_results) >= limit:
@@ -1,15 +1,30 @@
 """
 混合检索：结合向量检索和关键词检索
 """
+import importlib.util
 import re
+import threading
 from typing import List, Dict, Optional, Tuple
 import numpy as np
-from collections import Counter, defaultdict
+from collections import Counter, OrderedDict, defaultdict
+
+# numba 为可选依赖，安装后BM25打分循环会在第一次查询时被JIT编译为机器码
+NUMBA_AVAILABLE = importlib.util.find_spec('numba') is not None
+
+# 倒数排名融合（RRF）的平滑常数，常用取值为60
+RRF_K = 60
+FUSION_METHODS = ('cc', 'rrf')
+
+# 分词时去除标点的正则，在模块加载时编译一次
+_PUNCT_RE = re.compile(r'[^\w\s]')
 
 
 class BM25:
     """BM25关键词检索算法"""
     
+    # 缓存最近查询的分数数组的条目数，重试或重放的相同查询不再分词和打分
+    QUERY_CACHE_SIZE = 128
+    
     def __init__(self, k1: float = 1.5, b: float = 0.75):
         """
         初始化BM25
@@ -21,11 +36,38 @@ class BM25:
         self.k1 = k1
         self.b = b
         self.documents = []
-        self.frequencies = []
         self.doc_lengths = []
         self.avg_doc_length = 0
         self.idf = {}
-        self.vocab = set()
+        self.term_ids = {}  # 词到词ID的映射，ID按首次出现的顺序分配，键即为词表
+        # 按文档顺序追加的 (词ID, 词频, 文档下标) 扁平数组，每次 add_documents 追加一段，
+        # 重建倒排表时只需拼接和排序，不再逐文档遍历
+        self._term_batches = []
+        # 按词ID排列的倒排表（CSR）：词t的倒排项位于 [term_ptr[t], term_ptr[t+1])，
+        # 每个倒排项保存文档下标和预先算好的该词在该文档上的BM25分数
+        self.term_ptr = np.zeros(1, dtype=np.int64)
+        self.posting_docs = np.empty(0, dtype=np.int32)
+        self.posting_scores = np.empty(0, dtype=np.float64)
+        self.max_scores = np.empty(0, dtype=np.float64)  # 每个词在所有文档上的最大分数，用于MaxScore剪枝
+        self.idf_arr = np.empty(0, dtype=np.float64)  # 按词ID排列的IDF
+        self._idf_stale = False
+        self._query_cache = OrderedDict()  # 查询文本 -> 只读的分数数组，索引变化时清空
+        self._query_cache_lock = threading.Lock()
+        self._index_lock = threading.Lock()  # 多个线程同时查询时，过期的倒排表只重建一次
+    
+    def __getstate__(self):
+        # 锁不能序列化，查询缓存也不需要随索引一起保存
+        state = self.__dict__.copy()
+        state.pop('_query_cache', None)
+        state.pop('_query_cache_lock', None)
+        state.pop('_index_lock', None)
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self._index_lock = threading.Lock()
     
     def fit(self, documents: List[str]):
         """
@@ -34,33 +76,101 @@ class BM25:
         Args:
             documents: 文档列表
         """
-        self.documents = documents
-        self.frequencies = []
+        self.documents = []
         self.doc_lengths = []
+        self.term_ids = {}
+        self._term_batches = []
+        self.add_documents(documents)
+    
+    def add_documents(self, documents: List[str]):
+        """
+        增量添加文档：只对新文档分词，IDF在下次打分时按累计的文档频率重新计算
         
-        # 处理文档
+        Args:
+            documents: 新文档列表
+        """
+        first_doc = len(self.documents)
+        self.documents.extend(documents)
+        
+        # 处理文档：每个文档的词频直接追加到扁平列表中
+        term_ids, tfs, n_terms = [], [], []
         for doc in documents:
             words = self._tokenize(doc)
-            self.vocab.update(words)
             freq = Counter(words)
-            self.frequencies.append(freq)
+            term_ids.extend(self.term_ids.setdefault(word, len(self.term_ids)) for word in freq)
+            tfs.extend(freq.values())
+            n_terms.append(len(freq))
             self.doc_lengths.append(len(words))
+        if documents:
+            self._term_batches.append((
+                np.array(term_ids, dtype=np.int64),
+                np.array(tfs, dtype=np.float64),
+                np.repeat(np.arange(first_doc, len(self.documents), dtype=np.int32), n_terms),
+            ))
         
         # 计算平均文档长度
         self.avg_doc_length = sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0
+        self._idf_stale = True
+        with self._query_cache_lock:
+            self._query_cache.clear()
+    
+    def _update_idf(self):
+        """按当前的文档频率重新计算IDF，并重建按词排列的倒排表"""
+        if not self._idf_stale:
+            return
+        with self._index_lock:
+            if self._idf_stale:
+                self._rebuild_index()
+    
+    def _rebuild_index(self):
+        """_update_idf 的实际重建逻辑，调用时需持有 _index_lock"""
+        # 把追加的各段合并为一段，之后的重建只需拼接新增的部分
+        if len(self._term_batches) > 1:
+            self._term_batches = [tuple(np.concatenate(parts) for parts in zip(*self._term_batches))]
+        if self._term_batches:
+            term_of, tfs, docs = self._term_batches[0]
+        else:
+            term_of, tfs, docs = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64),
+                                  np.empty(0, dtype=np.int32))
+        
+        # 每个词ID在每个文档中只出现一次，按词ID计数即为文档频率，IDF公式对整个数组一次计算
+        n_docs = len(self.documents)
+        df = np.bincount(term_of, minlength=len(self.term_ids)).astype(np.float64)
+        self.idf_arr = np.log((n_docs - df + 0.5) / (df + 0.5) + 1.0)
+        self.idf = dict(zip(self.term_ids, self.idf_arr.tolist()))
+        self._build_postings(term_of, tfs, docs)
+        self._idf_stale = False
+    
+    def _build_postings(self, term_of: np.ndarray, tfs: np.ndarray, docs: np.ndarray):
+        """
+        把按文档排列的 (词ID, 词频, 文档下标) 数组重排为按词ID排序的扁平数组（CSR），
+        并预先计算每个倒排项的BM25分数
+        
+        BM25对查询词是可加的，词在文档上的分数只取决于索引本身，建索引时一次算好，
+        查询时只需把查询词的倒排项分数按文档累加
+        """
+        n_terms = len(self.term_ids)
+        nnz = len(term_of)
+        order = np.argsort(term_of, kind='stable')  # 同一个词的倒排项保持文档顺序
+        term_of, tfs, docs = term_of[order], tfs[order], docs[order]
+        self.term_ptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_of, minlength=n_terms), out=self.term_ptr[1:])
+        self.posting_docs = docs
         
-        # 计算IDF
-        n_docs = len(documents)
-        for word in self.vocab:
-            df = sum(1 for freq in self.frequencies if word in freq)
-            self.idf[word] = np.log((n_docs - df + 0.5) / (df + 0.5) + 1.0)
+        if self.avg_doc_length == 0 or nnz == 0:
+            self.posting_scores = np.zeros(nnz, dtype=np.float64)
+            self.max_scores = np.zeros(n_terms, dtype=np.float64)
+            return
+        doc_lens = np.asarray(self.doc_lengths, dtype=np.float64)[docs]
+        self.posting_scores = self.idf_arr[term_of] * tfs * (self.k1 + 1) / (
+            tfs + self.k1 * (1 - self.b + self.b * (doc_lens / self.avg_doc_length)))
+        # 每个词ID都至少有一个倒排项，按段取最大值即为该词分数的精确上界
+        self.max_scores = np.maximum.reduceat(self.posting_scores, self.term_ptr[:-1])
     
     def _tokenize(self, text: str) -> List[str]:
         """简单的分词"""
         # 移除标点，转换为小写，分词
-        text = re.sub(r'[^\w\s]', ' ', text.lower())
-        words = text.split()
-        return words
+        return _PUNCT_RE.sub(' ', text.lower()).split()
     
     def score(self, query: str, doc_idx: int) -> float:
         """
@@ -73,29 +183,40 @@ class BM25:
         Returns:
             BM25分数
         """
-        if doc_idx >= len(self.frequencies):
+        if doc_idx >= len(self.documents):
             return 0.0
+        return float(self.get_scores(query)[doc_idx])
+    
+    def get_scores(self, query: str) -> np.ndarray:
+        """
+        计算查询和所有文档的相关度分数
         
-        query_terms = self._tokenize(query)
-        doc_freq = self.frequencies[doc_idx]
-        doc_length = self.doc_lengths[doc_idx]
-        
-        score = 0.0
-        for term in query_terms:
-            if term not in self.idf:
-                continue
-            
-            tf = doc_freq.get(term, 0)
-            if tf == 0:
-                continue
+        Args:
+            query: 查询文本
             
-            # BM25公式
-            idf = self.idf[term]
-            numerator = idf * tf * (self.k1 + 1)
-            denominator = tf + self.k1 * (1 - self.b + self.b * (doc_length / self.avg_doc_length))
-            score += numerator / denominator
+        Returns:
+            只读的BM25分数数组，shape: (文档数,)；最近的查询命中缓存时直接返回缓存的数组
+        """
+        with self._query_cache_lock:
+            scores = self._query_cache.get(query)
+            if scores is not None:
+                self._query_cache.move_to_end(query)
+                return scores
+        
+        self._update_idf()
+        scores = np.zeros(len(self.documents), dtype=np.float64)
+        query_term_ids = np.array([self.term_ids[term] for term in self._tokenize(query)
+                                   if term in self.term_ids], dtype=np.int64)
+        if len(query_term_ids) > 0:
+            _get_bm25_kernel()(query_term_ids, self.term_ptr, self.posting_docs, self.posting_scores, scores)
         
-        return score
+        # 缓存的数组会被多次返回，设为只读防止调用方修改
+        scores.setflags(write=False)
+        with self._query_cache_lock:
+            self._query_cache[query] = scores
+            while len(self._query_cache) > self.QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return scores
     
     def search(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
         """
@@ -108,16 +229,171 @@ class BM25:
         Returns:
             [(文档索引, 分数)] 列表
         """
-        scores = []
-        for i in range(len(self.documents)):
-            score = self.score(query, i)
-            if score > 0:
-                scores.append((i, score))
+        with self._query_cache_lock:
+            cached = self._query_cache.get(query)
+        if cached is not None or top_k <= 0:
+            scores = self.get_scores(query)
+            matched = np.flatnonzero(scores > 0)
+        else:
+            scores, matched = self._maxscore(query, top_k)
+        
+        # 只保留有分数的文档，先用 np.partition 找到第top_k大的分数，只对入选的文档排序；
+        # 与第top_k名同分的文档按文档顺序取，结果与全量稳定排序后截断一致
+        if 0 < top_k < len(matched):
+            matched_scores = scores[matched]
+            kth = -np.partition(-matched_scores, top_k - 1)[top_k - 1]
+            above = matched[matched_scores > kth]
+            ties = matched[matched_scores == kth][:top_k - len(above)]
+            matched = np.concatenate([above, ties])
+        matched = matched[np.argsort(-scores[matched], kind='stable')][:top_k]
+        
+        return [(int(i), float(scores[i])) for i in matched]
+    
+    def _maxscore(self, query: str, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        用MaxScore剪枝计算前top_k个文档的分数
+        
+        查询词按分数上界从大到小累加。当剩余查询词的上界之和已经低于当前第top_k名的分数时，
+        还没出现过的文档不可能再进入前top_k，剩余的词只需在仍有希望的候选文档上查找累加。
+        
+        Args:
+            query: 查询文本
+            top_k: 需要的结果数量（> 0）
+            
+        Returns:
+            (分数数组, 候选文档下标)：候选文档的分数是完整的，前top_k名一定在候选之中
+        """
+        self._update_idf()
+        scores = np.zeros(len(self.documents), dtype=np.float64)
+        term_counts = Counter(self.term_ids[term] for term in self._tokenize(query) if term in self.term_ids)
+        if not term_counts:
+            return scores, np.empty(0, dtype=np.int64)
+        
+        # 重复的查询词按出现次数加权，与逐词累加的结果一致
+        query_term_ids = np.fromiter(term_counts.keys(), dtype=np.int64, count=len(term_counts))
+        weights = np.fromiter(term_counts.values(), dtype=np.float64, count=len(term_counts))
+        bounds = self.max_scores[query_term_ids] * weights
+        order = np.argsort(-bounds, kind='stable')
+        query_term_ids, weights, bounds = query_term_ids[order], weights[order], bounds[order]
+        # remaining[i]：第i个词之后所有词的上界之和
+        remaining = np.append(np.cumsum(bounds[::-1])[::-1][1:], 0.0)
         
-        # 按分数排序
-        scores.sort(key=lambda x: x[1], reverse=True)
+        # touched：已经累加过分数的文档（不重复），阈值只在这些文档上计算，不扫描全部文档
+        seen = np.zeros(len(self.documents), dtype=bool)
+        touched = np.empty(0, dtype=self.posting_docs.dtype)
+        for i, term_id in enumerate(query_term_ids):
+            start, stop = self.term_ptr[term_id], self.term_ptr[term_id + 1]
+            docs = self.posting_docs[start:stop]
+            scores[docs] += weights[i] * self.posting_scores[start:stop]
+            if i + 1 == len(query_term_ids):
+                break
+            new_docs = docs[~seen[docs]]
+            seen[new_docs] = True
+            touched = np.concatenate([touched, new_docs])
+            if len(touched) < top_k:
+                continue
+            
+            touched_scores = scores[touched]
+            threshold = -np.partition(-touched_scores, top_k - 1)[top_k - 1]
+            if remaining[i] >= threshold:
+                continue
+            
+            # 剪枝：只有加上剩余上界后能达到阈值的文档才可能进入前top_k
+            candidates = touched[touched_scores + remaining[i] >= threshold]
+            for j in range(i + 1, len(query_term_ids)):
+                start, stop = self.term_ptr[query_term_ids[j]], self.term_ptr[query_term_ids[j] + 1]
+                docs = self.posting_docs[start:stop]  # 同一个词的倒排项按文档下标有序
+                pos = np.searchsorted(docs, candidates)
+                found = pos < len(docs)
+                found[found] = docs[pos[found]] == candidates[found]
+                scores[candidates[found]] += weights[j] * self.posting_scores[start:stop][pos[found]]
+            return scores, np.sort(candidates)
         
-        return scores[:top_k]
+        return scores, np.flatnonzero(scores > 0)
+
+
+def _bm25_accumulate(query_term_ids, term_ptr, posting_docs, posting_scores, out):
+    """
+    遍历每个查询词的倒排项，把预先算好的BM25分数累加到 out[文档]
+    
+    只做标量循环，安装了numba时会被JIT编译为机器码
+    """
+    for q in range(query_term_ids.shape[0]):
+        term_id = query_term_ids[q]
+        for j in range(term_ptr[term_id], term_ptr[term_id + 1]):
+            out[posting_docs[j]] += posting_scores[j]
+
+
+def _bm25_accumulate_numpy(query_term_ids, term_ptr, posting_docs, posting_scores, out):
+    """_bm25_accumulate 的NumPy版本：取出所有查询词的倒排项，用一次 bincount 按文档求和"""
+    slices = [slice(term_ptr[term_id], term_ptr[term_id + 1]) for term_id in query_term_ids]
+    docs = np.concatenate([posting_docs[sl] for sl in slices])
+    weights = np.concatenate([posting_scores[sl] for sl in slices])
+    out += np.bincount(docs, weights=weights, minlength=len(out))
+
+
+_bm25_kernel = None
+
+
+def _get_bm25_kernel():
+    """
+    返回BM25累加函数：默认为NumPy版本，安装了numba时在第一次调用时导入numba并编译标量循环
+    
+    不在导入时编译，也不使用 cache=True：本文件会以 milvus.hybrid_search 和
+    file_to_milvus.milvus.hybrid_search 两个模块名被导入，共用磁盘缓存会导致加载失败
+    """
+    global _bm25_kernel
+    if _bm25_kernel is None:
+        kernel = _bm25_accumulate_numpy
+        if NUMBA_AVAILABLE:
+            try:
+                import numba
+                kernel = numba.njit(_bm25_accumulate)
+            except ImportError:
+                pass
+        _bm25_kernel = kernel
+    return _bm25_kernel
+
+
+def _min_max_normalize(scores: np.ndarray, higher_is_better: bool = True) -> np.ndarray:
+    """
+    把分数min-max缩放到[0, 1]，缩放后越大越相关
+    
+    Args:
+        scores: 分数数组，NaN 表示该候选没有这一路的分数（保持为NaN）
+        higher_is_better: 原始分数是否越大越相关（距离则为False）
+        
+    Returns:
+        归一化后的分数数组；所有分数相同时都视为最相关（1.0）
+    """
+    present = ~np.isnan(scores)
+    if not present.any():
+        return scores
+    low, high = scores[present].min(), scores[present].max()
+    if high == low:
+        return np.where(present, 1.0, np.nan)
+    if higher_is_better:
+        return (scores - low) / (high - low)
+    return (high - scores) / (high - low)
+
+
+def _rrf_scores(scores: np.ndarray, higher_is_better: bool = True, k: int = RRF_K) -> np.ndarray:
+    """
+    把分数转换为倒数排名分数 1 / (k + rank)，只依赖名次，不受分数尺度影响
+    
+    Args:
+        scores: 分数数组，NaN 表示该候选没有这一路的分数（记为0）
+        higher_is_better: 原始分数是否越大越相关（距离则为False）
+        k: 平滑常数
+        
+    Returns:
+        倒数排名分数数组
+    """
+    present = ~np.isnan(scores)
+    keys = np.where(present, -scores if higher_is_better else scores, np.inf)
+    ranks = np.empty(len(scores), dtype=np.float64)
+    ranks[np.argsort(keys, kind='stable')] = np.arange(1, len(scores) + 1)
+    return np.where(present, 1.0 / (k + ranks), 0.0)
 
 
 class HybridRetriever:
@@ -136,11 +412,15 @@ class HybridRetriever:
             bm25_b: BM25参数b
         """
         self.alpha = alpha
-        self.beta = 1.0 - alpha  # 关键词检索权重
         self.bm25 = BM25(k1=bm25_k1, b=bm25_b)
         self.documents = []
         self.doc_indices = []  # 文档在原始数据中的索引映射
     
+    @property
+    def beta(self) -> float:
+        """关键词检索权重，随 alpha 变化，保证两路权重之和为1"""
+        return 1.0 - self.alpha
+    
     def index_documents(self, documents: List[str], indices: Optional[List[int]] = None):
         """
         索引文档
@@ -149,15 +429,32 @@ class HybridRetriever:
             documents: 文档文本列表
             indices: 文档在原始数据中的索引（可选）
         """
-        self.documents = documents
-        self.doc_indices = indices if indices is not None else list(range(len(documents)))
+        # 复制一份，后续 add_documents 原地追加时不会修改调用方的列表
+        self.documents = list(documents)
+        self.doc_indices = list(indices) if indices is not None else list(range(len(documents)))
         self.bm25.fit(documents)
     
+    def add_documents(self, documents: List[str], indices: Optional[List[int]] = None):
+        """
+        增量索引新文档，已索引的文档不会重新分词
+        
+        Args:
+            documents: 新文档文本列表
+            indices: 新文档在原始数据中的索引（可选，默认接续已有文档的位置）
+        """
+        if indices is None:
+            indices = list(range(len(self.documents), len(self.documents) + len(documents)))
+        self.documents.extend(documents)
+        self.doc_indices.extend(indices)
+        self.bm25.add_documents(documents)
+    
     def hybrid_search(self,
                      query_text: str,
                      vector_scores: List[Tuple[int, float]],
                      top_k: int = 10,
-                     normalize: bool = True) -> List[Tuple[int, float]]:
+                     normalize: bool = True,
+                     higher_is_better: bool = False,
+                     fusion: str = 'cc') -> List[Tuple[int, float]]:
         """
         混合检索
         
@@ -165,64 +462,65 @@ class HybridRetriever:
             query_text: 查询文本
             vector_scores: 向量检索结果 [(doc_idx, score), ...]
             top_k: 返回前k个结果
-            normalize: 是否归一化分数
+            normalize: 是否归一化分数（只用于 'cc' 融合）
+            higher_is_better: 向量分数是否越大越相似（IP度量的内积），默认按距离处理
+            fusion: 融合方式，'cc' 为归一化分数的凸组合，'rrf' 为按 alpha 加权的倒数排名融合；
+                候选很少（如只有一个文件）时min-max归一化和BM25的IDF都不稳定，RRF只看名次更稳健
             
         Returns:
             [(doc_idx, final_score), ...] 列表
         """
-        # 向量检索分数
-        vector_score_map = {idx: score for idx, score in vector_scores}
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"Unsupported fusion method: {fusion}")
         
-        # 关键词检索分数
-        bm25_scores = self.bm25.search(query_text, top_k=len(self.documents))
-        bm25_score_map = {idx: score for idx, score in bm25_scores}
+        # 向量检索结果拆成下标和分数两个数组
+        vector_idx = np.fromiter((idx for idx, _ in vector_scores), dtype=np.int64, count=len(vector_scores))
+        vector_vals = np.fromiter((score for _, score in vector_scores), dtype=np.float64, count=len(vector_scores))
         
-        # 获取所有候选文档索引
-        all_indices = set(vector_score_map.keys()) | set(bm25_score_map.keys())
+        # 关键词检索分数（BM25的分数按文档位置排列，转换为与向量检索结果一致的原始索引）
+        # 所有有分数的文档都参与融合，不需要先排序
+        bm25_scores = self.bm25.get_scores(query_text)
+        matched = np.flatnonzero(bm25_scores > 0)
+        bm25_idx = np.fromiter((self.doc_indices[pos] for pos in matched.tolist()), dtype=np.int64, count=len(matched))
+        bm25_vals = bm25_scores[matched]
         
-        # 归一化分数
-        if normalize:
-            # 归一化向量分数 (转换为相似度，距离越小分数越高)
-            if vector_scores:
-                max_vector_score = max(score for _, score in vector_scores)
-                min_vector_score = min(score for _, score in vector_scores)
-                vector_range = max_vector_score - min_vector_score if max_vector_score != min_vector_score else 1.0
-                
-                for idx in all_indices:
-                    if idx in vector_score_map:
-                        # 如果是距离，转换为相似度（距离越小，相似度越高）
-                        normalized = 1.0 - (vector_score_map[idx] - min_vector_score) / vector_range
-                        vector_score_map[idx] = max(0.0, normalized)
-            
-            # 归一化BM25分数
-            if bm25_scores:
-                max_bm25_score = max(score for _, score in bm25_scores)
-                min_bm25_score = min(score for _, score in bm25_scores)
-                bm25_range = max_bm25_score - min_bm25_score if max_bm25_score != min_bm25_score else 1.0
-                
-                for idx in all_indices:
-                    if idx in bm25_score_map:
-                        normalized = (bm25_score_map[idx] - min_bm25_score) / bm25_range
-                        bm25_score_map[idx] = normalized
-        
-        # 混合分数
-        hybrid_scores = []
-        for idx in all_indices:
-            vector_score = vector_score_map.get(idx, 0.0)
-            bm25_score = bm25_score_map.get(idx, 0.0)
+        # 所有候选文档索引（有序、不重复），两路分数按候选散射为对齐的数组（缺失的一路记为NaN）
+        candidates = np.union1d(vector_idx, bm25_idx)
+        if len(candidates) == 0:
+            return []
+        vector_arr = np.full(len(candidates), np.nan)
+        vector_arr[np.searchsorted(candidates, vector_idx)] = vector_vals
+        bm25_arr = np.full(len(candidates), np.nan)
+        bm25_arr[np.searchsorted(candidates, bm25_idx)] = bm25_vals
+        
+        if fusion == 'rrf':
+            # 两路各自按名次计分后加权相加，某一路没有结果的候选该路按0计
+            fused = (self.alpha * _rrf_scores(vector_arr, higher_is_better)
+                     + self.beta * _rrf_scores(bm25_arr))
+        else:
+            # 归一化分数：两路分数都用min-max缩放到[0, 1]后再做凸组合，alpha才有一致的含义
+            if normalize:
+                # 向量分数转换为相似度（距离越小或内积越大分数越高）
+                vector_arr = _min_max_normalize(vector_arr, higher_is_better)
+                bm25_arr = _min_max_normalize(bm25_arr)
             
-            # 加权组合
-            final_score = self.alpha * vector_score + self.beta * bm25_score
-            hybrid_scores.append((idx, final_score))
+            # 加权组合，某一路没有分数的候选该路按0计
+            fused = self.alpha * np.nan_to_num(vector_arr) + self.beta * np.nan_to_num(bm25_arr)
         
-        # 排序并返回top_k
-        hybrid_scores.sort(key=lambda x: x[1], reverse=True)
-        return hybrid_scores[:top_k]
+        # 只对前top_k个候选排序
+        if top_k < len(fused):
+            top = np.argpartition(-fused, top_k)[:top_k]
+        else:
+            top = np.arange(len(fused))
+        top = top[np.argsort(-fused[top], kind='stable')]
+        return [(int(candidates[i]), float(fused[i])) for i in top]
     
     def search(self,
               query_text: str,
               vector_scores: List[Tuple[int, float]],
-              top_k: int = 10) -> List[Tuple[int, float]]:
+              top_k: int = 10,
+              higher_is_better: bool = False,
+              fusion: str = 'cc') -> List[Tuple[int, float]]:
         """
         执行混合检索（简化接口）
         
@@ -230,11 +528,14 @@ class HybridRetriever:
             query_text: 查询文本
             vector_scores: 向量检索结果
             top_k: 返回结果数量
+            higher_is_better: 向量分数是否越大越相似
+            fusion: 融合方式，'cc' 或 'rrf'
             
         Returns:
             [(doc_idx, score), ...]
         """
-        return self.hybrid_search(query_text, vector_scores, top_k)
+        return self.hybrid_search(query_text, vector_scores, top_k,
+                                  higher_is_better=higher_is_better, fusion=fusion)
 
 
 class HierarchicalHybridRetriever:
@@ -256,16 +557,16 @@ class HierarchicalHybridRetriever:
         self.parent_boost = parent_boost
         self.sibling_boost = sibling_boost
         self.hybrid_retriever = HybridRetriever(alpha=alpha)
-        self.chunk_tree = {}
+        self.chunk_tree = []
         self.chunk_to_doc_idx = {}  # chunk索引到文档索引的映射
     
-    def index_chunks(self, chunks, chunk_tree: Dict):
+    def index_chunks(self, chunks, chunk_tree: List):
         """
         索引文档块
         
         Args:
             chunks: 块列表
-            chunk_tree: 块树结构
+            chunk_tree: 块树结构（按块索引排列的块列表）
         """
         self.chunk_tree = chunk_tree
         documents = [chunk.content for chunk in chunks]
@@ -311,17 +612,16 @@ class HierarchicalHybridRetriever:
             }
             
             # 获取块信息
-            chunk = self.chunk_tree.get(chunk_idx)
+            chunk = self.chunk_tree[chunk_idx] if 0 <= chunk_idx < len(self.chunk_tree) else None
             if chunk:
                 context_info['parent_id'] = chunk.parent_id
-                context_info['children_ids'] = chunk.children_ids
+                context_info['children_ids'] = list(chunk.children_ids)
                 context_info['level'] = chunk.level
                 
                 # 获取兄弟节点
                 if chunk.parent_id:
-                    parent = self.chunk_tree.get(chunk.parent_id)
-                    if parent:
-                        context_info['sibling_ids'] = [cid for cid in parent.children_ids if cid != chunk_idx]
+                    parent = self.chunk_tree[chunk.parent_id]
+                    context_info['sibling_ids'] = [cid for cid in parent.children_ids if cid != chunk_idx]
                 
                 # 如果父节点也被检索到，提升分数
                 if chunk.parent_id and chunk.parent_id in [idx for idx, _ in hybrid_results]:
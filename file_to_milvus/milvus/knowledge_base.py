@@ -2,13 +2,14 @@
 Milvus知识库API：统一的接口封装，便于调用
 """
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict, Optional, Union
 import numpy as np
 from pathlib import Path
 import json
 from datetime import datetime
 
-from clip.vectorizer import CLIPVectorizer
+from clip.vectorizer import get_default_vectorizer
 from file_parsers.hierarchical_parser import (
     HierarchicalWordParser,
     HierarchicalMarkdownParser,
@@ -62,7 +63,7 @@ class KnowledgeBase:
     def _init_components(self):
         """初始化所有组件"""
         # 初始化CLIP向量化器
-        self.vectorizer = CLIPVectorizer(server_url=self.clip_server)
+        self.vectorizer = get_default_vectorizer(self.clip_server)
         self.embedding_dim = self.vectorizer.get_embedding_dimension()
         
         # 初始化Milvus存储
@@ -80,13 +81,16 @@ class KnowledgeBase:
     
     def add_document(self,
                     file_path: Union[str, Path],
-                    file_type: Optional[str] = None) -> Dict:
+                    file_type: Optional[str] = None,
+                    finalize: bool = True) -> Dict:
         """
         添加文档到知识库
         
         Args:
             file_path: 文件路径
             file_type: 文件类型 ('word' 或 'markdown')，如果为None则自动检测
+            finalize: 是否在写入后立即flush并重建混合检索索引，
+                批量添加时设为False，全部写入后再调用一次 store.finalize()
             
         Returns:
             处理结果字典，包含：
@@ -95,6 +99,22 @@ class KnowledgeBase:
             - file_path: 文件路径
             - message: 消息
         """
+        checked = self._check_document(file_path, file_type)
+        if not checked['success']:
+            return checked
+        
+        prepared = self._prepare_document(checked['file_path'], checked['file_type'])
+        if not prepared['success']:
+            return prepared
+        return self._store_document(prepared, finalize=finalize)
+    
+    def _check_document(self, file_path: Union[str, Path], file_type: Optional[str] = None) -> Dict:
+        """
+        检查文件是否存在并确定文件类型
+        
+        Returns:
+            成功时包含 file_path（Path）和 file_type，失败时为 add_document 的失败结果
+        """
         file_path = Path(file_path)
         
         if not file_path.exists():
@@ -116,6 +136,15 @@ class KnowledgeBase:
                     'message': f'不支持的文件类型: {ext}'
                 }
         
+        return {'success': True, 'file_path': file_path, 'file_type': file_type}
+    
+    def _prepare_document(self, file_path: Path, file_type: str) -> Dict:
+        """
+        解析并向量化文档，不访问Milvus，可以在多个线程中并发执行
+        
+        Returns:
+            成功时包含 hierarchical_content 和 embeddings，失败时为 add_document 的失败结果
+        """
         try:
             # 解析文件
             if file_type == 'word':
@@ -144,13 +173,41 @@ class KnowledgeBase:
             
             embeddings = self.vectorizer.encode_texts(texts, show_progress=False)
             
+            return {
+                'success': True,
+                'file_path': file_path,
+                'file_type': file_type,
+                'hierarchical_content': hierarchical_content,
+                'embeddings': embeddings
+            }
+        
+        except Exception as e:
+            return {
+                'success': False,
+                'message': f'处理文件时出错: {str(e)}',
+                'error': str(e)
+            }
+    
+    def _store_document(self, prepared: Dict, finalize: bool = True) -> Dict:
+        """
+        把 _prepare_document 的结果写入Milvus；写入会修改存储和混合检索器的状态，只在一个线程中调用
+        
+        Returns:
+            add_document 的处理结果
+        """
+        hierarchical_content = prepared['hierarchical_content']
+        file_path = prepared['file_path']
+        file_type = prepared['file_type']
+        try:
             # 存储到Milvus
             self.store.insert_hierarchical_chunks(
                 hierarchical_content=hierarchical_content,
-                embeddings=embeddings,
+                embeddings=prepared['embeddings'],
                 file_path=str(file_path),
                 file_type=file_type
             )
+            if finalize:
+                self.store.finalize()
             
             return {
                 'success': True,
@@ -169,25 +226,52 @@ class KnowledgeBase:
     
     def add_documents(self,
                      file_paths: List[Union[str, Path]],
-                     show_progress: bool = True) -> List[Dict]:
+                     show_progress: bool = True,
+                     max_workers: Optional[int] = None) -> List[Dict]:
         """
         批量添加文档
         
+        解析和向量化在线程池中并发进行，使CLIP请求的往返延迟相互重叠；
+        写入Milvus只在当前线程中按完成顺序进行
+        
         Args:
             file_paths: 文件路径列表
             show_progress: 是否显示进度
+            max_workers: 并发处理的文件数，默认 min(32, 文件数)
             
         Returns:
-            处理结果列表
+            处理结果列表，顺序与 file_paths 一致
         """
         from tqdm import tqdm
         
-        results = []
-        iterator = tqdm(file_paths, desc="处理文档") if show_progress else file_paths
+        if not file_paths:
+            return []
+        if max_workers is None:
+            max_workers = min(32, len(file_paths))
+        
+        results = [None] * len(file_paths)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor, \
+                tqdm(total=len(file_paths), desc="处理文档", mininterval=0.5,
+                     miniters=max(1, len(file_paths) // 200), smoothing=0.1,
+                     disable=not show_progress) as pbar:
+            futures = {}
+            for i, file_path in enumerate(file_paths):
+                checked = self._check_document(file_path)
+                if not checked['success']:
+                    results[i] = checked
+                    pbar.update(1)
+                    continue
+                futures[executor.submit(self._prepare_document, checked['file_path'], checked['file_type'])] = i
+            
+            for future in as_completed(futures):
+                i = futures[future]
+                prepared = future.result()
+                results[i] = self._store_document(prepared, finalize=False) if prepared['success'] else prepared
+                pbar.update(1)
         
-        for file_path in iterator:
-            result = self.add_document(file_path)
-            results.append(result)
+        # 全部写入后统一flush一次并重建混合检索索引
+        if any(result['success'] for result in results):
+            self.store.finalize()
         
         return results
     
@@ -216,7 +300,7 @@ class KnowledgeBase:
         Returns:
             搜索结果列表，每个结果包含：
             - content: 内容文本
-            - distance: 相似度分数（越小越好）
+            - distance: 相似度分数（越大越好）
             - chunk_type: 块类型
             - level: 层级
             - parent_id: 父块ID
@@ -248,21 +332,7 @@ class KnowledgeBase:
                     expr=filter_expr
                 )
             
-            # 格式化结果
-            formatted_results = []
-            for result in results:
-                formatted_results.append({
-                    'content': result.get('content', ''),
-                    'distance': result.get('distance', float('inf')),
-                    'chunk_type': result.get('chunk_type', 'unknown'),
-                    'level': result.get('level', 0),
-                    'parent_id': result.get('parent_id'),
-                    'file_path': result.get('file_path', ''),
-                    'chunk_index': result.get('chunk_index'),
-                    'metadata': result.get('metadata', {})
-                })
-            
-            return formatted_results
+            return self._format_results(results)
         
         except Exception as e:
             print(f"查询时出错: {e}")
@@ -274,29 +344,81 @@ class KnowledgeBase:
                    queries: List[str],
                    top_k: int = 10,
                    alpha: float = 0.7,
-                   hierarchical: bool = True) -> List[List[Dict]]:
+                   hierarchical: bool = True,
+                   include_children: bool = True,
+                   include_parent: bool = True,
+                   content_type: Optional[str] = None,
+                   filter_expr: Optional[str] = None) -> List[List[Dict]]:
         """
         批量查询
         
+        所有查询文本一次性向量化，并在一次Milvus检索请求中完成向量检索
+        
         Args:
             queries: 查询文本列表
             top_k: 每个查询返回结果数量
             alpha: 混合检索权重
             hierarchical: 是否使用层次化检索
+            include_children: 是否包含子块
+            include_parent: 是否包含父块
+            content_type: 内容类型筛选 ('text' 或 'image')
+            filter_expr: 额外的过滤表达式（Milvus表达式）
             
         Returns:
-            每个查询的结果列表
+            每个查询的结果列表，顺序与 queries 一致
         """
-        results = []
-        for query in queries:
-            result = self.query(
-                query_text=query,
-                top_k=top_k,
-                alpha=alpha,
-                hierarchical=hierarchical
-            )
-            results.append(result)
-        return results
+        if not queries:
+            return []
+        
+        try:
+            # 批量向量化查询文本
+            query_vectors = self.vectorizer.encode_texts(queries, show_progress=False)
+            
+            # 执行批量检索
+            if hierarchical:
+                results_per_query = self.store.hierarchical_search_batch(
+                    query_texts=queries,
+                    query_vectors=query_vectors,
+                    content_type=content_type,
+                    limit=top_k,
+                    alpha=alpha,
+                    include_children=include_children,
+                    include_parent=include_parent
+                )
+            else:
+                results_per_query = self.store.hybrid_search_batch(
+                    query_texts=queries,
+                    query_vectors=query_vectors,
+                    content_type=content_type,
+                    limit=top_k,
+                    alpha=alpha,
+                    expr=filter_expr
+                )
+            
+            return [self._format_results(results) for results in results_per_query]
+        
+        except Exception as e:
+            print(f"批量查询时出错: {e}")
+            import traceback
+            traceback.print_exc()
+            return [[] for _ in queries]
+    
+    @staticmethod
+    def _format_results(results: List[Dict]) -> List[Dict]:
+        """把存储层的检索结果整理为对外的结果格式"""
+        formatted_results = []
+        for result in results:
+            formatted_results.append({
+                'content': result.get('content', ''),
+                'distance': result.get('distance', float('-inf')),
+                'chunk_type': result.get('chunk_type', 'unknown'),
+                'level': result.get('level', 0),
+                'parent_id': result.get('parent_id'),
+                'file_path': result.get('file_path', ''),
+                'chunk_index': result.get('chunk_index'),
+                'metadata': result.get('metadata', {})
+            })
+        return formatted_results
     
     def get_context(self, chunk_index: int, include_siblings: bool = False) -> Dict:
         """
@@ -350,7 +472,7 @@ class KnowledgeBase:
             
             # Milvus的删除操作
             # 注意：Milvus的删除需要先查询ID，然后删除
-            self.store.collection.load()
+            self.store.load()
             
             # 查询要删除的ID
             results = self.store.collection.query(
@@ -369,6 +491,8 @@ class KnowledgeBase:
             # 执行删除
             self.store.collection.delete(expr=expr)
             self.store.collection.flush()
+            # 已删除的块不能再被关键词检索命中，混合检索索引需要重建
+            self.store.invalidate_hybrid_index()
             
             return {
                 'success': True,
@@ -391,7 +515,7 @@ class KnowledgeBase:
             文档路径列表
         """
         try:
-            self.store.collection.load()
+            self.store.load()
             
             # 查询所有唯一的文件路径
             results = self.store.collection.query(
@@ -414,12 +538,12 @@ class KnowledgeBase:
         注意：这会重新索引所有文档，可能需要一些时间
         """
         try:
-            self.store.collection.load()
+            self.store.load()
             
             # 查询所有块（Milvus limit 最大 16384）
             results = self.store.collection.query(
                 expr="content_type == 'text'",
-                output_fields=["chunk_index", "content"],
+                output_fields=["content"],
                 limit=16384
             )
             
@@ -429,7 +553,7 @@ class KnowledgeBase:
             
             # 重建BM25索引
             documents = [r['content'] for r in results]
-            indices = [r['chunk_index'] for r in results]
+            indices = [int(r['id']) for r in results]
             
             from milvus.hybrid_search import HybridRetriever
             self.store.hybrid_retriever = HybridRetriever(alpha=0.7)
@@ -1,7 +1,10 @@
 """
 Milvus数据库存储：将向量存储到Milvus
 """
-from typing import List, Dict, Optional
+import atexit
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 import numpy as np
 from pymilvus import (
     connections,
@@ -15,15 +18,84 @@ from datetime import datetime
 import json
 
 
+# 支持的向量存储精度及其对应的Milvus字段类型（FLOAT16_VECTOR 需要 pymilvus 2.4+，更早的版本为None）
+_VECTOR_DTYPES = {
+    "float32": DataType.FLOAT_VECTOR,
+    "float16": getattr(DataType, "FLOAT16_VECTOR", None),
+}
+
+
+# 按 (host, port, collection_name) 缓存的存储实例，同一进程内重复获取时复用连接和集合
+_MILVUS_SINGLETON: Dict[Tuple[str, int, str], "MilvusStore"] = {}
+_SINGLETON_LOCK = threading.Lock()
+
+
+def _ensure_connection(host: str, port: int) -> bool:
+    """
+    确保 "default" 连接指向给定的Milvus服务器，已连接到同一地址时不再重复握手
+
+    Returns:
+        是否新建了连接
+    """
+    if connections.has_connection("default"):
+        if connections.get_connection_addr("default").get("address") == f"{host}:{port}":
+            return False
+        connections.disconnect("default")
+    connections.connect(alias="default", host=host, port=port)
+    return True
+
+
+@atexit.register
+def _disconnect_on_exit():
+    """进程退出时断开默认连接"""
+    if connections.has_connection("default"):
+        connections.disconnect("default")
+
+
+def get_store(host: str = "localhost",
+              port: int = 19530,
+              collection_name: str = "clip_documents",
+              embedding_dim: int = 512,
+              drop_existing: bool = False,
+              vector_dtype: str = "float32") -> "MilvusStore":
+    """
+    获取（或创建）进程内共享的MilvusStore实例
+
+    Args:
+        host: Milvus服务器地址
+        port: Milvus服务器端口
+        collection_name: 集合名称
+        embedding_dim: 向量维度
+        drop_existing: 是否删除重建集合；为True时总会新建实例并替换缓存
+        vector_dtype: 新建集合时向量字段的存储精度
+
+    Returns:
+        MilvusStore实例
+    """
+    key = (host, int(port), collection_name)
+    with _SINGLETON_LOCK:
+        store = _MILVUS_SINGLETON.get(key)
+        if store is None or drop_existing:
+            store = MilvusStore(host, port, collection_name, embedding_dim, drop_existing, vector_dtype)
+            _MILVUS_SINGLETON[key] = store
+        return store
+
+
 class MilvusStore:
     """Milvus向量数据库存储"""
     
+    # gRPC单条消息默认上限为64MB，单次插入请求按48MB预留余量
+    _MAX_INSERT_BYTES = 48 << 20
+    # 单次插入的最大行数，约1万行一批时Milvus的写入吞吐最高，过大的批次会造成延迟尖峰
+    _MAX_INSERT_ROWS = int(os.getenv('MILVUS_INSERT_BATCH', '10000'))
+    
     def __init__(self, 
                  host: str = "localhost",
                  port: int = 19530,
                  collection_name: str = "clip_documents",
                  embedding_dim: int = 512,
-                 drop_existing: bool = False):
+                 drop_existing: bool = False,
+                 vector_dtype: str = "float32"):
         """
         初始化Milvus存储
         
@@ -33,19 +105,29 @@ class MilvusStore:
             collection_name: 集合名称
             embedding_dim: 向量维度
             drop_existing: 如果集合已存在，是否删除重建
+            vector_dtype: 新建集合时向量字段的存储精度，默认 'float32'；'float16' 下CLIP向量的召回几乎无损，
+                传输和存储的向量减半（需要Milvus 2.4+和pymilvus 2.4+）；使用已有集合时以集合的字段类型为准
         """
+        if vector_dtype not in _VECTOR_DTYPES:
+            raise ValueError(f"Unsupported vector dtype: {vector_dtype}")
+        if _VECTOR_DTYPES[vector_dtype] is None:
+            raise ValueError(f"Vector dtype {vector_dtype} requires pymilvus>=2.4.0")
+        
         self.host = host
         self.port = port
         self.collection_name = collection_name
         self.embedding_dim = embedding_dim
+        # 向量入库和查询前都做L2归一化，内积即为余弦相似度
+        self.metric_type = "IP"
+        self.index_type = "HNSW"
+        self.vector_dtype = vector_dtype
+        self.has_file_hash = True
+        self.is_loaded = False  # 集合是否已加载到内存，避免每次查询都发起一次load请求
+        self.is_new_collection = False  # 集合是否由本实例新建（或删除后重建），新建的集合初始为空
         
-        # 连接到Milvus
-        connections.connect(
-            alias="default",
-            host=host,
-            port=port
-        )
-        print(f"✓ Connected to Milvus: {host}:{port}")
+        # 连接到Milvus（已连接到同一服务器时复用现有连接）
+        if _ensure_connection(host, port):
+            print(f"✓ Connected to Milvus: {host}:{port}")
         
         # 创建或获取集合
         self._setup_collection(drop_existing)
@@ -60,6 +142,16 @@ class MilvusStore:
                 print(f"✓ Dropped existing collection: {self.collection_name}")
             else:
                 self.collection = Collection(self.collection_name)
+                # 向量精度以已有集合的schema为准
+                embedding_field = next(f for f in self.collection.schema.fields if f.name == "embedding")
+                self.vector_dtype = "float16" if embedding_field.dtype == _VECTOR_DTYPES["float16"] else "float32"
+                # 旧版本创建的集合没有 file_hash 字段
+                self.has_file_hash = any(f.name == "file_hash" for f in self.collection.schema.fields)
+                # 距离度量以已有索引为准，旧版本创建的集合使用L2
+                if self.collection.indexes:
+                    index_params = self.collection.indexes[0].params
+                    self.metric_type = index_params.get("metric_type", "L2")
+                    self.index_type = index_params.get("index_type", "IVF_FLAT")
                 print(f"✓ Using existing collection: {self.collection_name}")
                 return
         
@@ -68,7 +160,7 @@ class MilvusStore:
             FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
             FieldSchema(name="content_type", dtype=DataType.VARCHAR, max_length=20),  # 'text' or 'image'
             FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=65535),  # 原始内容
-            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=self.embedding_dim),
+            FieldSchema(name="embedding", dtype=_VECTOR_DTYPES[self.vector_dtype], dim=self.embedding_dim),
             FieldSchema(name="file_path", dtype=DataType.VARCHAR, max_length=1024),
             FieldSchema(name="file_type", dtype=DataType.VARCHAR, max_length=20),
             FieldSchema(name="chunk_index", dtype=DataType.INT64),  # 文本块索引或图像索引
@@ -77,6 +169,7 @@ class MilvusStore:
             FieldSchema(name="level", dtype=DataType.INT64),  # 层级深度
             FieldSchema(name="metadata", dtype=DataType.VARCHAR, max_length=65535),  # JSON格式的额外元数据
             FieldSchema(name="created_at", dtype=DataType.VARCHAR, max_length=50),
+            FieldSchema(name="file_hash", dtype=DataType.VARCHAR, max_length=64, default_value=""),  # 源文件内容哈希，用于跳过未变化的文件
         ]
         
         # 创建集合schema
@@ -91,11 +184,11 @@ class MilvusStore:
             schema=schema
         )
         
-        # 创建索引
+        # 创建索引：HNSW图索引在相同召回率下比IVF需要比较的候选更少，查询尾延迟更低
         index_params = {
-            "metric_type": "L2",  # 使用L2距离
-            "index_type": "IVF_FLAT",
-            "params": {"nlist": 1024}
+            "metric_type": self.metric_type,  # 归一化向量上的内积（余弦相似度）
+            "index_type": self.index_type,
+            "params": {"M": 16, "efConstruction": 200}
         }
         
         self.collection.create_index(
@@ -103,15 +196,200 @@ class MilvusStore:
             index_params=index_params
         )
         
+        self.is_new_collection = True
         print(f"✓ Created collection: {self.collection_name}")
         print(f"✓ Created index on embedding field")
     
+    def _insert_rows(self, data: List[Dict]) -> List:
+        """
+        插入多行数据，按估算的请求大小拆成多次插入，避免超过gRPC单条消息的大小上限
+        
+        Args:
+            data: 行字典列表
+            
+        Returns:
+            按行顺序排列的主键列表
+        """
+        primary_keys = []
+        row_bytes = (self._row_bytes(row['content'], row['metadata'], row['file_path']) for row in data)
+        for start, stop in self._batch_bounds(row_bytes):
+            primary_keys.extend(self.collection.insert(data[start:stop]).primary_keys)
+        return primary_keys
+    
+    def _insert_columns(self, columns: Dict[str, Sequence]) -> List:
+        """
+        按列插入数据：向量列直接传二维数组，省去逐行构造字典和向量列表的开销，
+        同样按估算的请求大小拆成多次插入
+        
+        Args:
+            columns: {字段名: 列数据}，需包含集合中除自增主键外的所有字段，多余的列会被忽略
+            
+        Returns:
+            按行顺序排列的主键列表
+        """
+        field_names = [f.name for f in self.collection.schema.fields if not f.auto_id]
+        ordered = [columns[name] for name in field_names]
+        
+        primary_keys = []
+        row_bytes = map(self._row_bytes, columns['content'], columns['metadata'], columns['file_path'])
+        for start, stop in self._batch_bounds(row_bytes):
+            primary_keys.extend(self.collection.insert([col[start:stop] for col in ordered]).primary_keys)
+        return primary_keys
+    
+    def _row_bytes(self, content: str, metadata: str, file_path: str) -> int:
+        """估算一行数据在插入请求中的大小"""
+        # 向量按存储精度传输，字符串字段按UTF-8的最大长度估算，另加固定的字段开销
+        vector_bytes = self.embedding_dim * np.dtype(self.vector_dtype).itemsize
+        return vector_bytes + 4 * (len(content) + len(metadata) + len(file_path)) + 128
+    
+    def _batch_bounds(self, row_bytes: Iterable[int]) -> List[Tuple[int, int]]:
+        """按每行的估算大小把行切分为若干段 [start, stop)，每段的总大小和行数都不超过单次插入的上限"""
+        bounds = []
+        start, batch_bytes, num_rows = 0, 0, 0
+        for i, size in enumerate(row_bytes):
+            if i > start and (batch_bytes + size > self._MAX_INSERT_BYTES or i - start >= self._MAX_INSERT_ROWS):
+                bounds.append((start, i))
+                start, batch_bytes = i, 0
+            batch_bytes += size
+            num_rows = i + 1
+        if start < num_rows:
+            bounds.append((start, num_rows))
+        return bounds
+    
+    def _file_hash_field(self, meta_dict: Dict) -> Dict:
+        """集合有 file_hash 字段时，从元数据中取出源文件哈希作为该字段的值"""
+        if self.has_file_hash and meta_dict.get('file_hash'):
+            return {"file_hash": meta_dict['file_hash']}
+        return {}
+    
+    def unchanged_file_paths(self, file_hashes: Dict[str, str]) -> set:
+        """
+        查询哪些文件已以当前内容入库：集合中存在路径和内容哈希都相同的行
+        
+        只按哈希匹配时，移动或复制的文件会因哈希已存在而永远不会以新路径入库，因此按 (路径, 哈希) 成对匹配
+        
+        Args:
+            file_hashes: {文件路径: 文件内容哈希}
+            
+        Returns:
+            内容未变化的文件路径集合
+        """
+        if not self.has_file_hash or not file_hashes:
+            return set()
+        
+        self.load()
+        wanted = {file_path[:1024]: file_hash for file_path, file_hash in file_hashes.items()}
+        found = set()
+        pending = list(wanted)
+        for start in range(0, len(pending), 256):
+            batch = pending[start:start + 256]
+            hashes = list(dict.fromkeys(wanted[file_path] for file_path in batch))
+            rows = self.collection.query(
+                expr=f"file_path in {json.dumps(batch)} && file_hash in {json.dumps(hashes)}",
+                output_fields=["file_path", "file_hash"],
+                limit=16384
+            )
+            found.update(row['file_path'] for row in rows if wanted.get(row['file_path']) == row['file_hash'])
+            # 每个文件对应多行，结果被 limit 截断时逐个确认剩余的文件
+            if len(rows) >= 16384:
+                for file_path in batch:
+                    if file_path not in found and self.collection.query(
+                            expr=f"file_path == {json.dumps(file_path)} && file_hash == {json.dumps(wanted[file_path])}",
+                            output_fields=["file_path"], limit=1):
+                        found.add(file_path)
+        return {file_path for file_path in file_hashes if file_path[:1024] in found}
+    
+    def file_row_ids(self, file_paths: List[str]) -> Dict[str, List[int]]:
+        """
+        查询给定文件在集合中已有的行的主键
+        
+        重新入库的文件先记下旧数据的主键，新数据写入成功后再用 delete_ids() 删除，
+        处理失败时旧版本仍然保留
+        
+        Args:
+            file_paths: 文件路径列表
+            
+        Returns:
+            {文件路径: 主键列表}，只包含集合中有数据的文件
+        """
+        if not file_paths:
+            return {}
+        
+        self.load()
+        by_path = {}
+        pending = list(dict.fromkeys(file_path[:1024] for file_path in file_paths))
+        for start in range(0, len(pending), 256):
+            batch = pending[start:start + 256]
+            rows = self.collection.query(
+                expr=f"file_path in {json.dumps(batch)}",
+                output_fields=["file_path"],
+                limit=16384
+            )
+            # 结果被 limit 截断时逐个文件重新查询
+            if len(rows) >= 16384:
+                rows = [row for file_path in batch for row in self.collection.query(
+                    expr=f"file_path == {json.dumps(file_path)}", output_fields=["file_path"], limit=16384)]
+            for row in rows:
+                by_path.setdefault(row['file_path'], []).append(row['id'])
+        return {file_path: by_path[file_path[:1024]] for file_path in file_paths if file_path[:1024] in by_path}
+    
+    def delete_ids(self, ids: List[int]) -> int:
+        """
+        按主键删除行
+        
+        Args:
+            ids: 主键列表
+            
+        Returns:
+            删除的行数
+        """
+        ids = [int(i) for i in ids]
+        deleted = 0
+        for start in range(0, len(ids), 4096):
+            result = self.collection.delete(expr=f"id in {ids[start:start + 4096]}")
+            deleted += result.delete_count
+        return deleted
+    
+    def _vector_array(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        把向量转换为按存储精度排列的连续二维数组
+        
+        IP度量下先做L2归一化，使距离即为余弦相似度。结果直接写入一个按存储精度预分配的数组，
+        不修改传入的数组，也不产生额外的float32中间副本；传入的也可以是 np.memmap
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim == 1:
+            embeddings = embeddings[np.newaxis]
+        if self.metric_type != "IP" and self.vector_dtype == "float32":
+            return np.ascontiguousarray(embeddings)
+        
+        out = np.empty(embeddings.shape, dtype=self.vector_dtype)
+        if self.metric_type == "IP":
+            norms = np.sqrt(np.einsum('ij,ij->i', embeddings, embeddings))[:, np.newaxis]
+            norms[norms == 0] = 1
+            np.divide(embeddings, norms, out=out, casting='same_kind')
+        else:
+            out[...] = embeddings
+        return out
+    
+    def _row_vectors(self, embeddings: np.ndarray) -> List:
+        """把向量数组转换为插入或查询时每行的向量：float32字段用列表，float16字段用float16数组"""
+        embeddings = self._vector_array(embeddings)
+        if self.vector_dtype == "float16":
+            return list(embeddings)
+        return embeddings.tolist()
+    
+    def _query_vectors(self, query_vectors: np.ndarray) -> List[np.ndarray]:
+        """把查询向量转换为检索请求的数据：直接传入每行的numpy数组，不转换为Python列表"""
+        return list(self._vector_array(query_vectors))
+    
     def insert_texts(self,
                      texts: List[str],
                      embeddings: np.ndarray,
                      file_path: str,
                      file_type: str,
-                     metadata: Optional[Dict] = None):
+                     metadata: Optional[Dict] = None,
+                     auto_flush: bool = True):
         """
         插入文本向量
         
@@ -121,6 +399,10 @@ class MilvusStore:
             file_path: 文件路径
             file_type: 文件类型
             metadata: 额外元数据
+            auto_flush: 插入后是否立即flush；批量导入时传False，最后统一调用 flush()
+            
+        Returns:
+            插入行的主键列表
         """
         if len(texts) != len(embeddings):
             raise ValueError(f"Texts and embeddings length mismatch: {len(texts)} vs {len(embeddings)}")
@@ -128,14 +410,14 @@ class MilvusStore:
         data = []
         current_time = datetime.now().isoformat()
         
-        for i, (text, embedding) in enumerate(zip(texts, embeddings)):
+        for i, (text, embedding) in enumerate(zip(texts, self._row_vectors(embeddings))):
             meta_dict = metadata or {}
             meta_dict['chunk_index'] = i
             
             data.append({
                 "content_type": "text",
                 "content": text[:65535],  # 截断过长的文本
-                "embedding": embedding.tolist(),
+                "embedding": embedding,
                 "file_path": file_path[:1024],
                 "file_type": file_type,
                 "chunk_index": i,
@@ -143,21 +425,25 @@ class MilvusStore:
                 "chunk_type": meta_dict.get('chunk_type', 'paragraph'),
                 "level": meta_dict.get('level', 0),
                 "metadata": json.dumps(meta_dict),
-                "created_at": current_time
+                "created_at": current_time,
+                **self._file_hash_field(meta_dict)
             })
         
-        # 插入数据
-        self.collection.insert(data)
-        self.collection.flush()
+        # 插入数据（过大或行数过多时自动拆分为多次请求）
+        primary_keys = self._insert_rows(data)
+        if auto_flush:
+            self.collection.flush()
         
         print(f"✓ Inserted {len(texts)} text embeddings")
+        return primary_keys
     
     def insert_images(self,
                       image_paths: List[str],
                       embeddings: np.ndarray,
                       file_path: str,
                       file_type: str,
-                      metadata: Optional[Dict] = None):
+                      metadata: Optional[Dict] = None,
+                      auto_flush: bool = True):
         """
         插入图像向量
         
@@ -167,6 +453,10 @@ class MilvusStore:
             file_path: 源文件路径
             file_type: 文件类型
             metadata: 额外元数据
+            auto_flush: 插入后是否立即flush；批量导入时传False，最后统一调用 flush()
+            
+        Returns:
+            插入行的主键列表
         """
         if len(image_paths) != len(embeddings):
             raise ValueError(f"Image paths and embeddings length mismatch: {len(image_paths)} vs {len(embeddings)}")
@@ -174,7 +464,7 @@ class MilvusStore:
         data = []
         current_time = datetime.now().isoformat()
         
-        for i, (img_path, embedding) in enumerate(zip(image_paths, embeddings)):
+        for i, (img_path, embedding) in enumerate(zip(image_paths, self._row_vectors(embeddings))):
             meta_dict = metadata or {}
             meta_dict['image_index'] = i
             meta_dict['image_path'] = img_path
@@ -182,19 +472,22 @@ class MilvusStore:
             data.append({
                 "content_type": "image",
                 "content": img_path,  # 存储图像路径
-                "embedding": embedding.tolist(),
+                "embedding": embedding,
                 "file_path": file_path[:1024],
                 "file_type": file_type,
                 "chunk_index": i,
                 "metadata": json.dumps(meta_dict),
-                "created_at": current_time
+                "created_at": current_time,
+                **self._file_hash_field(meta_dict)
             })
         
-        # 插入数据
-        self.collection.insert(data)
-        self.collection.flush()
+        # 插入数据（过大或行数过多时自动拆分为多次请求）
+        primary_keys = self._insert_rows(data)
+        if auto_flush:
+            self.collection.flush()
         
         print(f"✓ Inserted {len(image_paths)} image embeddings")
+        return primary_keys
     
     def search(self,
                query_vectors: np.ndarray,
@@ -211,19 +504,40 @@ class MilvusStore:
             expr: 额外的过滤表达式
             
         Returns:
-            搜索结果列表
+            搜索结果列表（多个查询向量的结果依次拼接）
+        """
+        return [
+            result
+            for hits in self.search_batch(query_vectors, content_type, limit, expr)
+            for result in hits
+        ]
+    
+    def search_batch(self,
+                     query_vectors: np.ndarray,
+                     content_type: Optional[str] = None,
+                     limit: int = 10,
+                     expr: Optional[str] = None) -> List[List[Dict]]:
         """
-        # 确保集合已加载
-        if not self.collection.has_index():
+        在一次请求中搜索多个查询向量，按查询分别返回结果
+        
+        Args:
+            query_vectors: 查询向量，可以是单个向量或向量数组
+            content_type: 筛选内容类型 ('text' 或 'image')
+            limit: 每个查询返回的结果数量
+            expr: 额外的过滤表达式
+            
+        Returns:
+            每个查询向量对应一个结果列表
+        """
+        # 确保集合已加载（已加载说明索引存在，不再重复检查）
+        if not self.is_loaded and not self.collection.has_index():
             raise RuntimeError("Collection does not have an index. Please create index first.")
         
-        self.collection.load()
+        self.load()
+        
+        search_params = self._search_params(limit)
         
         # 构建过滤表达式
-        search_params = {
-            "metric_type": "L2",
-            "params": {"nprobe": 10}
-        }
         
         filter_expr = None
         if content_type:
@@ -234,7 +548,7 @@ class MilvusStore:
         
         # 搜索
         results = self.collection.search(
-            data=query_vectors.tolist() if isinstance(query_vectors, np.ndarray) else [query_vectors.tolist()],
+            data=self._query_vectors(query_vectors),
             anns_field="embedding",
             param=search_params,
             limit=limit,
@@ -243,10 +557,9 @@ class MilvusStore:
         )
         
         # 格式化结果
-        formatted_results = []
-        for hits in results:
-            for hit in hits:
-                formatted_results.append({
+        return [
+            [
+                {
                     'id': hit.id,
                     'distance': hit.distance,
                     'content_type': hit.entity.get('content_type'),
@@ -254,9 +567,56 @@ class MilvusStore:
                     'file_path': hit.entity.get('file_path'),
                     'file_type': hit.entity.get('file_type'),
                     'metadata': json.loads(hit.entity.get('metadata', '{}'))
-                })
+                }
+                for hit in hits
+            ]
+            for hits in results
+        ]
+    
+    def _search_params(self, limit: int) -> Dict:
+        """
+        按集合的索引类型构建搜索参数
         
-        return formatted_results
+        Args:
+            limit: 本次搜索返回的结果数量（HNSW 要求 ef 不小于它）
+        """
+        if self.index_type == "HNSW":
+            params = {"ef": max(64, limit)}
+        else:
+            params = {"nprobe": 10}
+        return {"metric_type": self.metric_type, "params": params}
+    
+    def load(self):
+        """加载集合到内存；只在首次调用或 release() 之后真正发起请求"""
+        if not self.is_loaded:
+            self.collection.load()
+            self.is_loaded = True
+    
+    def release(self):
+        """从内存中释放集合，之后的查询会重新加载"""
+        self.collection.release()
+        self.is_loaded = False
+    
+    def flush(self):
+        """把已插入的数据落盘（封存当前的增长段）"""
+        self.collection.flush()
+    
+    def similarities(self, results: List[Dict]) -> np.ndarray:
+        """
+        将搜索结果的距离批量转换为相似度分数（越大越相似）
+        
+        L2距离按 1/(1+d) 转换；IP/COSINE 的距离本身就是相似度，直接返回
+        
+        Args:
+            results: search() 返回的结果列表
+            
+        Returns:
+            与results一一对应的相似度数组
+        """
+        distances = np.fromiter((r['distance'] for r in results), dtype=np.float32, count=len(results))
+        if self.metric_type != "L2":
+            return distances
+        return 1.0 / (1.0 + distances)
     
     def get_stats(self) -> Dict:
         """获取集合统计信息"""
@@ -0,0 +1,110 @@
+"""
+层次化解析器单元测试
+"""
+import os
+import random
+
+import pytest
+
+from file_parsers import hierarchical_parser
+from file_parsers.hierarchical_parser import (
+    HierarchicalMarkdownParser,
+    _content_defined_cuts,
+    _parse_cache_path,
+    parse_one,
+)
+
+
+# 混合中英文字符的随机文本，模拟没有句末标点、需要按内容定义切分的超长句子
+_ALPHABET = 'abcdefghij klmnopqrstuvwxyz的是了我不人在他有这个上们来到时大地为子中你说生国年着就那和要她出也得里后自以会'
+
+
+def random_text(rng: random.Random, length: int) -> str:
+    return ''.join(rng.choice(_ALPHABET) for _ in range(length))
+
+
+def test_content_defined_cuts_sizes():
+    """块长度不超过 max_size，除最后一块外不小于 min_size，平均长度在 avg_size 附近"""
+    rng = random.Random(0)
+    for min_size, avg_size, max_size in [(16, 64, 256), (8, 32, 100), (0, 100, 400)]:
+        text = random_text(rng, 20000)
+        cuts = _content_defined_cuts(text, min_size, avg_size, max_size)
+        sizes = [stop - start for start, stop in zip([0] + cuts, cuts)]
+
+        assert cuts[-1] == len(text)
+        assert all(size <= max_size for size in sizes)
+        assert all(size >= min_size for size in sizes[:-1])
+        assert avg_size / 2 <= sum(sizes) / len(sizes) <= avg_size * 2
+
+
+def test_content_defined_cuts_stable_after_prefix_insert():
+    """在文本前部插入字符后，切分点很快重新对齐，之后的切分点只整体平移插入的长度"""
+    rng = random.Random(1)
+    for min_size, avg_size, max_size in [(16, 64, 256), (8, 32, 100)]:
+        text = random_text(rng, 20000)
+        prefix = random_text(rng, 37)
+        cuts = _content_defined_cuts(text, min_size, avg_size, max_size)
+        shifted = [cut - len(prefix) for cut in _content_defined_cuts(prefix + text, min_size, avg_size, max_size)]
+
+        # 找到第一个重新对齐的切分点，之后的切分点应完全一致，且覆盖大部分切分点
+        common = set(cuts) & set(shifted)
+        first = next(i for i, cut in enumerate(cuts) if cut in common)
+        assert first < len(cuts) // 4
+        assert shifted[shifted.index(cuts[first]):] == cuts[first:]
+
+
+def write_markdown(path, text: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return str(path)
+
+
+def chunk_contents(content):
+    return [chunk.content for chunk in content.chunks]
+
+
+def test_parse_cache_reuses_result(tmp_path, monkeypatch):
+    """文件未变化时直接读取缓存，不再调用解析器"""
+    file_path = write_markdown(tmp_path / 'doc.md', '# 标题\n\n' + '第一段内容。' * 20 + '\n\n## 小节\n\n' + '第二段内容。' * 20 + '\n')
+    cache_dir = str(tmp_path / 'cache')
+    first = parse_one(file_path, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+
+    def fail(self, file_path):
+        raise AssertionError("缓存命中时不应重新解析")
+
+    monkeypatch.setattr(HierarchicalMarkdownParser, 'parse', fail)
+    cached = parse_one(file_path, cache_dir=cache_dir)
+    assert any('第二段内容' in text for text in chunk_contents(first))
+    assert chunk_contents(cached) == chunk_contents(first)
+
+
+def test_parse_cache_invalidated_by_file_change(tmp_path):
+    """文件内容变化后重新解析"""
+    file_path = write_markdown(tmp_path / 'doc.md', '# 标题\n\n' + '旧的内容。' * 20 + '\n')
+    cache_dir = str(tmp_path / 'cache')
+    parse_one(file_path, cache_dir=cache_dir)
+
+    write_markdown(file_path, '# 标题\n\n' + '新的内容，长度也不同。' * 20 + '\n')
+    content = parse_one(file_path, cache_dir=cache_dir)
+    texts = chunk_contents(content)
+    assert any('新的内容' in text for text in texts)
+    assert not any('旧的内容' in text for text in texts)
+
+
+def test_parse_cache_key_includes_parser_settings_and_version(tmp_path, monkeypatch):
+    """分块参数或缓存版本不同时使用不同的缓存文件"""
+    file_path = write_markdown(tmp_path / 'doc.md', '# 标题\n\n内容。\n')
+    cache_dir = str(tmp_path / 'cache')
+    base = _parse_cache_path(cache_dir, file_path, HierarchicalMarkdownParser())
+    assert base == _parse_cache_path(cache_dir, file_path, HierarchicalMarkdownParser())
+
+    for kwargs in ({'max_chunk_size': 300}, {'min_chunk_size': 10}, {'overlap_size': 0}):
+        assert _parse_cache_path(cache_dir, file_path, HierarchicalMarkdownParser(**kwargs)) != base
+
+    monkeypatch.setattr(hierarchical_parser, 'PARSE_CACHE_VERSION', hierarchical_parser.PARSE_CACHE_VERSION + 1)
+    assert _parse_cache_path(cache_dir, file_path, HierarchicalMarkdownParser()) != base
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
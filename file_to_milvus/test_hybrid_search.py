@@ -0,0 +1,90 @@
+"""
+BM25检索单元测试：MaxScore剪枝后的 search 结果应与全量打分后排序截断的结果一致
+"""
+import random
+
+import numpy as np
+
+from milvus.hybrid_search import BM25
+
+
+def full_ranking(bm25: BM25, query: str, top_k: int):
+    """全量打分后排序截断：只保留有分数的文档，同分时按文档顺序"""
+    scores = bm25.get_scores(query)
+    matched = [i for i in np.flatnonzero(scores > 0).tolist()]
+    matched.sort(key=lambda i: (-scores[i], i))
+    return [(i, float(scores[i])) for i in matched[:top_k]]
+
+
+def assert_same_ranking(result, expected):
+    assert [i for i, _ in result] == [i for i, _ in expected], (result, expected)
+    assert np.allclose([s for _, s in result], [s for _, s in expected])
+
+
+def random_corpus(rng: random.Random, n_docs: int, vocab_size: int):
+    """按Zipf分布生成文档，少数常见词出现在大部分文档中，罕见词的分数上界更高，剪枝更容易生效"""
+    words = [f'w{i}' for i in range(vocab_size)]
+    weights = [1 / (i + 1) for i in range(vocab_size)]
+    docs = [' '.join(rng.choices(words, weights, k=rng.randint(1, 30))) for _ in range(n_docs)]
+    queries = [' '.join(rng.choices(words, weights, k=rng.randint(1, 6))) for _ in range(20)]
+    return docs, queries
+
+
+def test_search_matches_full_ranking():
+    """随机语料上 search(q, k) 与全量打分的前k名一致"""
+    rng = random.Random(0)
+    for _ in range(30):
+        docs, queries = random_corpus(rng, rng.randint(20, 400), rng.randint(5, 200))
+        bm25 = BM25()
+        bm25.fit(docs)
+        for query in queries:
+            # 先执行 search：get_scores 会缓存查询的分数，之后的 search 不再走MaxScore
+            results = {top_k: bm25.search(query, top_k) for top_k in (1, 3, 10, 50)}
+            for top_k, result in results.items():
+                assert_same_ranking(result, full_ranking(bm25, query, top_k))
+
+
+def test_search_ties_follow_document_order():
+    """同分文档按文档顺序排列，第k名处的同分文档也按文档顺序截断"""
+    docs = ['apple banana', 'cherry', 'apple banana', 'apple banana', 'apple', 'apple banana']
+    for top_k in range(1, len(docs) + 1):
+        bm25 = BM25()
+        bm25.fit(docs)
+        result = bm25.search('apple banana', top_k)
+        assert_same_ranking(result, full_ranking(bm25, 'apple banana', top_k))
+
+    bm25 = BM25()
+    bm25.fit(docs)
+    assert [i for i, _ in bm25.search('apple banana', 2)] == [0, 2]
+
+
+def test_search_top_k_larger_than_matches():
+    """k 大于匹配文档数时只返回有分数的文档"""
+    docs = ['red fish', 'blue fish', 'one two', 'red car', 'three four']
+    bm25 = BM25()
+    bm25.fit(docs)
+    result = bm25.search('red fish', 100)
+    assert sorted(i for i, _ in result) == [0, 1, 3]
+    assert_same_ranking(result, full_ranking(bm25, 'red fish', 100))
+
+    assert bm25.search('unknown words', 5) == []
+
+
+def test_search_uses_cached_scores():
+    """查询缓存命中后的 search 结果与第一次相同"""
+    rng = random.Random(1)
+    docs, queries = random_corpus(rng, 300, 100)
+    bm25 = BM25()
+    bm25.fit(docs)
+    for query in queries:
+        first = bm25.search(query, 5)
+        bm25.get_scores(query)
+        assert_same_ranking(bm25.search(query, 5), first)
+
+
+if __name__ == "__main__":
+    test_search_matches_full_ranking()
+    test_search_ties_follow_document_order()
+    test_search_top_k_larger_than_matches()
+    test_search_uses_cached_scores()
+    print("✓ BM25检索测试通过")
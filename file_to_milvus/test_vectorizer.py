@@ -0,0 +1,92 @@
+"""
+向量化器缓存单元测试：用替换了 encode 的客户端代替CLIP服务器
+"""
+import zlib
+
+import numpy as np
+
+from clip.cache import EmbeddingCache
+from clip.vectorizer import CLIPVectorizer
+
+
+def fake_vector(text: str) -> np.ndarray:
+    """每个文本对应一个固定的、未归一化的向量"""
+    return np.random.default_rng(zlib.crc32(text.encode('utf-8'))).standard_normal(8).astype(np.float32) * 3
+
+
+def make_vectorizer(monkeypatch, **kwargs):
+    """创建向量化器，所有客户端的 encode 都记录请求内容并返回 fake_vector"""
+    vectorizer = CLIPVectorizer(**kwargs)
+    payloads = []
+
+    def encode(content, show_progress=False, **_):
+        content = list(content)
+        payloads.append(content)
+        return np.stack([fake_vector(text) for text in content])
+
+    for client in vectorizer._pool:
+        monkeypatch.setattr(client, 'encode', encode)
+    return vectorizer, payloads
+
+
+def test_embedding_cache_lru():
+    """超出容量时淘汰最久未使用的条目，maxsize <= 0 时不缓存"""
+    cache = EmbeddingCache(maxsize=2)
+    cache.put('a', np.ones(4))
+    cache.put('b', np.ones(4) * 2)
+    assert cache.get('a') is not None  # a 变为最近使用
+    cache.put('c', np.ones(4) * 3)
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+    assert cache.get('a').dtype == np.float32
+
+    disabled = EmbeddingCache(maxsize=0)
+    disabled.put('a', np.ones(4))
+    assert disabled.get('a') is None
+    assert len(disabled) == 0
+
+
+def test_cache_hits_skip_rpc(monkeypatch):
+    """已编码过的文本直接从缓存返回，不再请求服务器"""
+    vectorizer, payloads = make_vectorizer(monkeypatch)
+    first = vectorizer.encode_texts(['cat', 'dog'], show_progress=False)
+    assert payloads == [['cat', 'dog']]
+
+    second = vectorizer.encode_texts(['dog', 'cat'], show_progress=False)
+    assert payloads == [['cat', 'dog']]
+    assert np.allclose(second, first[::-1])
+
+    vectorizer.encode_texts(['cat', 'bird'], show_progress=False)
+    assert payloads == [['cat', 'dog'], ['bird']]
+
+
+def test_duplicates_sent_once_and_order_preserved(monkeypatch):
+    """同一批中重复的文本只发送一次，结果顺序与输入一致"""
+    vectorizer, payloads = make_vectorizer(monkeypatch)
+    texts = ['a', 'b', 'a', 'c', 'b', 'a']
+    vectors = vectorizer.encode_texts(texts, show_progress=False, normalize=False)
+
+    assert payloads == [['a', 'b', 'c']]
+    assert vectors.shape == (len(texts), 8)
+    for text, vector in zip(texts, vectors):
+        assert np.allclose(vector, fake_vector(text))
+
+
+def test_normalize_flag(monkeypatch):
+    """normalize=False 返回原始向量，normalize=True 返回单位向量；缓存中保存的是原始向量"""
+    vectorizer, payloads = make_vectorizer(monkeypatch)
+    raw = vectorizer.encode_texts(['x', 'y'], show_progress=False, normalize=False)
+    assert np.allclose(raw, np.stack([fake_vector('x'), fake_vector('y')]))
+
+    normalized = vectorizer.encode_texts(['x', 'y'], show_progress=False)
+    assert len(payloads) == 1
+    assert np.allclose(np.linalg.norm(normalized, axis=1), 1.0)
+    assert np.allclose(normalized, raw / np.linalg.norm(raw, axis=1, keepdims=True))
+
+    raw_again = vectorizer.encode_texts(['x', 'y'], show_progress=False, normalize=False)
+    assert np.allclose(raw_again, raw)
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, '-q']))